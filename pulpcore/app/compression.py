@@ -0,0 +1,164 @@
+"""
+Precompressed variants of published metadata.
+
+When a publication completes, its metadata files can be stored compressed next to the original
+file, e.g. ``repomd.xml.gz`` next to ``repomd.xml``. The Content App serves a variant to clients
+that accept its encoding, see ``PUBLISHED_METADATA_COMPRESSION``.
+"""
+from collections import OrderedDict
+from gettext import gettext as _
+import gzip
+import logging
+import os
+import shutil
+import tempfile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+log = logging.getLogger(__name__)
+
+# The supported content-codings and the extension of their variants, in order of preference.
+ENCODINGS = OrderedDict((
+    ('zstd', '.zst'),
+    ('gzip', '.gz'),
+))
+
+# Files smaller than this are not worth compressing.
+MIN_SIZE = 1024
+
+# The extensions of files that are compressed already.
+COMPRESSED_EXTENSIONS = ('.bz2', '.gz', '.xz', '.zip', '.zst')
+
+
+def variant_path(path, encoding):
+    """
+    Args:
+        path (str): The path of a file.
+        encoding (str): A content-coding of :data:`ENCODINGS`.
+
+    Returns:
+        str: The path of the variant of the file compressed with `encoding`.
+    """
+    return path + ENCODINGS[encoding]
+
+
+def _compress(src, dst, encoding):
+    if encoding == 'gzip':
+        with gzip.GzipFile(fileobj=dst, mode='wb', mtime=0) as compressed:
+            shutil.copyfileobj(src, compressed)
+    else:
+        zstandard.ZstdCompressor().copy_stream(src, dst)
+
+
+def compress_file(path, encodings):
+    """
+    Store the variants of a file compressed with each of the given encodings next to it.
+
+    Variants are written to a temporary file first, so the Content App never serves a partial one.
+    Files that are compressed already, by their extension, are not compressed again.
+
+    Args:
+        path (str): The path of the file.
+        encodings (list): The content-codings to compress the file with.
+
+    Returns:
+        list: The paths of the variants written.
+    """
+    if path.lower().endswith(COMPRESSED_EXTENSIONS) or os.path.getsize(path) < MIN_SIZE:
+        return []
+
+    written = []
+    for encoding in encodings:
+        if encoding not in ENCODINGS:
+            log.warning(_('Unknown metadata compression "{encoding}" ignored.').format(
+                encoding=encoding
+            ))
+            continue
+        if encoding == 'zstd' and zstandard is None:
+            log.warning(_('The zstandard package is not installed, zstd compressed metadata is '
+                          'not stored.'))
+            continue
+        dst_path = variant_path(path, encoding)
+        with open(path, 'rb') as src, tempfile.NamedTemporaryFile(
+                dir=os.path.dirname(path), prefix='.', delete=False) as dst:
+            try:
+                _compress(src, dst, encoding)
+            except BaseException:
+                os.unlink(dst.name)
+                raise
+        os.chmod(dst.name, os.stat(path).st_mode & 0o777)
+        os.replace(dst.name, dst_path)
+        written.append(dst_path)
+    return written
+
+
+def delete_variants(path):
+    """
+    Delete the compressed variants of a file.
+
+    Args:
+        path (str): The path of the file.
+    """
+    for encoding in ENCODINGS:
+        try:
+            os.unlink(variant_path(path, encoding))
+        except FileNotFoundError:
+            pass
+
+
+def parse_accept_encoding(header):
+    """
+    Parse an `Accept-Encoding` header.
+
+    Args:
+        header (str): The header value.
+
+    Returns:
+        dict: Maps the (lower case) content-codings to their quality values.
+    """
+    accepted = {}
+    for item in header.split(','):
+        coding, _sep, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _sep, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+
+def negotiate_encoding(header, encodings):
+    """
+    Choose the content-coding to respond with.
+
+    Args:
+        header (str): The `Accept-Encoding` header of the request, or None.
+        encodings (list): The content-codings the file is available in, besides `identity`.
+
+    Returns:
+        str: The content-coding of `encodings` the client accepts with the highest quality value,
+            or None when the file should be sent as is. Ties are broken by the order of
+            :data:`ENCODINGS`.
+    """
+    if not header or not encodings:
+        return None
+    accepted = parse_accept_encoding(header)
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        if encoding not in encodings:
+            continue
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
@@ -0,0 +1,47 @@
+# Generated by Django 2.2.6 on 2026-10-18 21:10
+
+from django.db import migrations, models
+
+
+def backfill_version_numbers(apps, schema_editor):
+    RepositoryContent = apps.get_model('core', 'RepositoryContent')
+    RepositoryVersion = apps.get_model('core', 'RepositoryVersion')
+
+    RepositoryContent.objects.update(number_added=models.Subquery(
+        RepositoryVersion.objects.filter(pk=models.OuterRef('version_added')).values('number')
+    ))
+    RepositoryContent.objects.filter(version_removed__isnull=False).update(
+        number_removed=models.Subquery(
+            RepositoryVersion.objects.filter(pk=models.OuterRef('version_removed')).values('number')
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_add_duplicated_reserved_resources'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repositorycontent',
+            name='number_added',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='repositorycontent',
+            name='number_removed',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.RunPython(backfill_version_numbers, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='repositorycontent',
+            name='number_added',
+            field=models.PositiveIntegerField(),
+        ),
+        migrations.AddIndex(
+            model_name='repositorycontent',
+            index=models.Index(fields=['repository', 'number_added', 'number_removed'], name='core_repocontent_numbers_idx'),
+        ),
+    ]
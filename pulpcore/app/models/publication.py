@@ -1,5 +1,8 @@
+from django.conf import settings
 from django.db import models, transaction
 
+from pulpcore.app.compression import compress_file, delete_variants
+
 from . import storage
 from .base import MasterModel, Model
 from .repository import Remote, Repository, RepositoryVersion
@@ -101,11 +104,15 @@ class Publication(MasterModel):
             **kwargs (dict): Delete options.
 
         Notes:
-            Deletes the Task.created_resource when complete is False.
+            Deletes the Task.created_resource when complete is False. The files of the published
+            metadata are deleted as well.
         """
+        published_metadata = list(self.published_metadata.all())
         with transaction.atomic():
             CreatedResource.objects.filter(object_id=self.pk).delete()
             super().delete(**kwargs)
+        for metadata in published_metadata:
+            metadata.delete_file()
 
     def __enter__(self):
         """
@@ -126,11 +133,29 @@ class Publication(MasterModel):
             exc_tb (types.TracebackType): (optional) stack trace.
         """
         if not exc_val:
+            self.compress_published_metadata()
             self.complete = True
             self.save()
         else:
             self.delete()
 
+    def compress_published_metadata(self):
+        """
+        Store the compressed variants of the published metadata files next to them.
+
+        The encodings are set by ``PUBLISHED_METADATA_COMPRESSION``. Variants are only stored for
+        file storages with local paths, since other storages are served by redirecting to them.
+        """
+        encodings = settings.PUBLISHED_METADATA_COMPRESSION
+        if not encodings:
+            return
+        for published_metadata in self.published_metadata.iterator():
+            try:
+                path = published_metadata.file.path
+            except NotImplementedError:
+                return
+            compress_file(path, encodings)
+
 
 class PublishedFile(Model):
     """
@@ -181,6 +206,29 @@ class PublishedMetadata(PublishedFile):
 
     file = models.FileField(upload_to=_storage_path, max_length=255)
 
+    def delete(self, *args, **kwargs):
+        """
+        Deletes PublishedMetadata model and the file associated with it
+
+        Args:
+            args (list): list of positional arguments for Model.delete()
+            kwargs (dict): dictionary of keyword arguments to pass to Model.delete()
+        """
+        super().delete(*args, **kwargs)
+        self.delete_file()
+
+    def delete_file(self):
+        """
+        Delete the file and its compressed variants, see ``PUBLISHED_METADATA_COMPRESSION``.
+        """
+        try:
+            path = self.file.path
+        except NotImplementedError:
+            path = None
+        self.file.delete(save=False)
+        if path:
+            delete_variants(path)
+
     class Meta:
         default_related_name = 'published_metadata'
         unique_together = (
@@ -201,6 +249,24 @@ class ContentGuard(MasterModel):
     name = models.CharField(max_length=255, db_index=True, unique=True)
     description = models.TextField(null=True)
 
+    def permit_cache_key(self, request):
+        """
+        Get the key the decision of `permit()` for a request may be cached by.
+
+        The Content App caches the decision for ``CONTENT_APP_PERMIT_CACHE_TTL`` seconds, so the
+        guard does not have to check the credentials of every request again. Guards opt in by
+        returning a fingerprint of the credentials their decision depends on, e.g. the digest of
+        a client certificate. By default decisions are not cached.
+
+        Args:
+            request (:class:`aiohttp.web.Request`): A request for a published file.
+
+        Returns:
+            str: A fingerprint of the credentials of `request`, or None if the decision must not be
+                cached.
+        """
+        return None
+
 
 class BaseDistribution(MasterModel):
     """
@@ -1,11 +1,13 @@
 """
 Repository related Django models.
 """
+from collections import Counter
 from contextlib import suppress
 
 import django
-from django.db import models, transaction
+from django.db import connection, models, transaction
 from django.urls import reverse
+from django.utils import timezone
 
 from pulpcore.app.util import get_view_name_for_model
 from pulpcore.exceptions import ResourceImmutableError
@@ -156,9 +158,16 @@ class RepositoryContent(Model):
     """
     Association between a repository and its contained content.
 
+    The numbers of the versions which added and removed the content are stored next to the
+    relations to them, so the content of a version can be queried without joining the versions.
+
     Fields:
 
         created (models.DatetimeField): When the association was created.
+        number_added (models.PositiveIntegerField): The number of the RepositoryVersion which
+            added the referenced Content.
+        number_removed (models.PositiveIntegerField): The number of the RepositoryVersion which
+            removed the referenced Content.
 
     Relations:
 
@@ -177,10 +186,21 @@ class RepositoryContent(Model):
     version_removed = models.ForeignKey('RepositoryVersion', null=True,
                                         related_name='removed_memberships',
                                         on_delete=models.CASCADE)
+    number_added = models.PositiveIntegerField()
+    number_removed = models.PositiveIntegerField(null=True)
 
     class Meta:
         unique_together = (('repository', 'content', 'version_added'),
                            ('repository', 'content', 'version_removed'))
+        indexes = [
+            models.Index(fields=['repository', 'number_added', 'number_removed'],
+                         name='core_repocontent_numbers_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.number_added = self.version_added.number
+        self.number_removed = self.version_removed.number if self.version_removed_id else None
+        return super().save(*args, **kwargs)
 
 
 class RepositoryVersion(Model):
@@ -216,6 +236,9 @@ class RepositoryVersion(Model):
     base_version = models.ForeignKey('RepositoryVersion', null=True,
                                      on_delete=models.SET_NULL)
 
+    # The number of content units added per query on databases other than PostgreSQL.
+    ADD_CONTENT_BATCH_SIZE = 10000
+
     class Meta:
         default_related_name = 'versions'
         unique_together = ('repository', 'number')
@@ -241,12 +264,25 @@ class RepositoryVersion(Model):
             >>>     ...
             >>>
         """
-        relationships = RepositoryContent.objects.filter(
-            repository=self.repository, version_added__number__lte=self.number
-        ).exclude(
-            version_removed__number__lte=self.number
+        return Content.objects.filter(
+            pk__in=self._content_relationships().values('content_id')
+        )
+
+    def _content_relationships(self):
+        """
+        Returns:
+            django.db.models.QuerySet: The RepositoryContent of the content in this version.
+        """
+        return RepositoryContent.objects.filter(self._content_q())
+
+    def _content_q(self):
+        """
+        Returns:
+            django.db.models.Q: Matches the RepositoryContent of the content in this version.
+        """
+        return models.Q(repository_id=self.repository_id, number_added__lte=self.number) & (
+            models.Q(number_removed__isnull=True) | models.Q(number_removed__gt=self.number)
         )
-        return Content.objects.filter(version_memberships__in=relationships)
 
     def added(self):
         """
@@ -262,6 +298,37 @@ class RepositoryVersion(Model):
         """
         return Content.objects.filter(version_memberships__version_removed=self)
 
+    def diff(self, base_version):
+        """
+        Compare the content of this version with the content of another version.
+
+        Both versions are compared in a single query over their RepositoryContent, which groups the
+        relations of both versions by content and keeps the content that is in only one of them.
+        `base_version` may belong to any repository.
+
+        Args:
+            base_version (pulpcore.app.models.RepositoryVersion): The version to compare with.
+
+        Returns:
+            django.db.models.QuerySet: Dicts with the `content_id` of each content unit in only one
+                of the versions, and `in_version` and `in_base`, which are 1 if the content unit is
+                in this version or in `base_version` respectively and 0 otherwise. They are ordered
+                by `content_id`.
+        """
+        in_version = self._content_q()
+        in_base = base_version._content_q()
+
+        def contains(condition):
+            return models.Max(models.Case(
+                models.When(condition, then=models.Value(1)),
+                default=models.Value(0),
+                output_field=models.IntegerField(),
+            ))
+
+        return RepositoryContent.objects.filter(in_version | in_base).values('content_id').annotate(
+            in_version=contains(in_version), in_base=contains(in_base)
+        ).exclude(in_version=models.F('in_base')).order_by('content_id')
+
     def contains(self, content):
         """
         Check whether a content exists in this repository version's set of content
@@ -296,15 +363,45 @@ class RepositoryVersion(Model):
             version.save()
 
             if base_version:
-                # first remove the content that isn't in the base version
-                version.remove_content(version.content.exclude(pk__in=base_version.content))
-                # now add any content that's in the base_version but not in version
-                version.add_content(base_version.content.exclude(pk__in=version.content))
+                version._copy_content(base_version)
 
             resource = CreatedResource(content_object=version)
             resource.save()
             return version
 
+    def _copy_content(self, base_version):
+        """
+        Replace the content of this version with the content of another version.
+
+        The content of this version that isn't in `base_version` is found with a single ``EXCEPT``
+        and removed, then the content of `base_version` that isn't in this version is added.
+        Databases without ``EXCEPT``, i.e. MySQL and MariaDB, find the removed content with an
+        anti-join instead. When
+        this version has no content yet, e.g. the first version of a repository, the relations of
+        the content of `base_version` are copied without comparing both versions.
+
+        Args:
+            base_version (pulpcore.app.models.RepositoryVersion): The version to copy the content
+                of.
+        """
+        relations = self._content_relationships()
+        base_content_pks = base_version._content_relationships().values_list('content_id')
+        if not relations.exists():
+            if connection.vendor == 'postgresql':
+                self._insert_content_relationships(base_content_pks, skip_present=False)
+            else:
+                self.add_content(base_version.content)
+            return
+
+        content_pks = relations.values_list('content_id', flat=True)
+        if connection.features.supports_select_difference:
+            removed = content_pks.difference(base_content_pks)
+        else:
+            # MySQL can't update a table it selects from in a subquery, so the pks are loaded.
+            removed = list(content_pks.exclude(content_id__in=base_content_pks))
+        self.remove_content(removed)
+        self.add_content(base_version.content)
+
     @staticmethod
     def latest(repository):
         """
@@ -341,9 +438,16 @@ class RepositoryVersion(Model):
         """
         Add a content unit to this version.
 
+        Content already in this version is skipped. On PostgreSQL the relations are inserted by a
+        single ``INSERT ... SELECT`` from `content`, so the content is never loaded into Python.
+        Other databases insert them in batches of ``ADD_CONTENT_BATCH_SIZE``.
+
         Args:
            content (django.db.models.QuerySet): Set of Content to add
 
+        Returns:
+            int: The number of content units added.
+
         Raise:
             pulpcore.exception.ResourceImmutableError: if add_content is called on a
                 complete RepositoryVersion
@@ -351,17 +455,80 @@ class RepositoryVersion(Model):
         if self.complete:
             raise ResourceImmutableError(self)
 
-        repo_content = []
-        for content_pk in content.exclude(pk__in=self.content).values_list('pk', flat=True):
-            repo_content.append(
-                RepositoryContent(
-                    repository=self.repository,
-                    content_id=content_pk,
-                    version_added=self
-                )
-            )
+        content_pks = content.order_by().values_list('pk', flat=True).distinct()
+        if connection.vendor == 'postgresql':
+            return self._insert_content_relationships(content_pks)
+
+        content_pks = content_pks.exclude(
+            pk__in=self._content_relationships().values('content_id')
+        )
+        # Each batch is in this version once inserted, so the next query skips it.
+        added = 0
+        while True:
+            batch = [
+                RepositoryContent(repository_id=self.repository_id, content_id=content_pk,
+                                  version_added=self, number_added=self.number)
+                for content_pk in content_pks[:self.ADD_CONTENT_BATCH_SIZE]
+            ]
+            if not batch:
+                return added
+            RepositoryContent.objects.bulk_create(batch)
+            added += len(batch)
+
+    def _insert_content_relationships(self, content_pks, skip_present=True):
+        """
+        Add content to this version with a single ``INSERT ... SELECT`` on PostgreSQL.
+
+        The primary keys of the relations are generated by the database.
+
+        Args:
+            content_pks (django.db.models.QuerySet): The distinct primary keys of the content to
+                add.
+            skip_present (bool): Skip the content already in this version. Only pass False when
+                none of `content_pks` can be in this version.
 
-        RepositoryContent.objects.bulk_create(repo_content)
+        Returns:
+            int: The number of content units added.
+        """
+        if connection.pg_version >= 130000:
+            new_uuid = 'gen_random_uuid()'
+        else:
+            # gen_random_uuid() needs the pgcrypto extension before PostgreSQL 13.
+            new_uuid = 'md5(random()::text || clock_timestamp()::text)::uuid'
+
+        meta = RepositoryContent._meta
+        columns = ', '.join(
+            connection.ops.quote_name(meta.get_field(name).column)
+            for name in ('_id', '_created', '_last_updated', 'repository', 'version_added',
+                         'number_added', 'content')
+        )
+        content_sql, content_params = content_pks.query.sql_with_params()
+        now = timezone.now()
+        sql = (
+            'INSERT INTO {table} ({columns}) '
+            'SELECT {new_uuid}, %s, %s, %s, %s, %s, new_content.content_id '
+            'FROM ({content_sql}) AS new_content (content_id)'
+        ).format(
+            table=connection.ops.quote_name(meta.db_table), columns=columns, new_uuid=new_uuid,
+            content_sql=content_sql
+        )
+        params = [now, now, self.repository_id, self.pk, self.number, *content_params]
+
+        if skip_present:
+            relationships_sql, relationships_params = self._content_relationships().values_list(
+                'content_id'
+            ).query.sql_with_params()
+            sql += (
+                ' WHERE NOT EXISTS ('
+                'SELECT 1 FROM ({relationships_sql}) AS relationship (content_id) '
+                'WHERE relationship.content_id = new_content.content_id'
+                ')'
+            ).format(relationships_sql=relationships_sql)
+            params.extend(relationships_params)
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.rowcount
 
     def remove_content(self, content):
         """
@@ -382,7 +549,7 @@ class RepositoryVersion(Model):
             repository=self.repository,
             content_id__in=content,
             version_removed=None)
-        q_set.update(version_removed=self)
+        q_set.update(version_removed=self, number_removed=self.number)
 
     def _squash(self, repo_relations, next_version):
         """
@@ -404,14 +571,16 @@ class RepositoryVersion(Model):
 
         repo_relations.filter(version_removed=self,
                               content_id__in=content_removed_and_readded)\
-            .update(version_removed=None)
+            .update(version_removed=None, number_removed=None)
 
         repo_relations.filter(version_added=next_version,
                               content_id__in=content_removed_and_readded).delete()
 
         # "squash" by moving other additions and removals forward to the next version
-        repo_relations.filter(version_added=self).update(version_added=next_version)
-        repo_relations.filter(version_removed=self).update(version_removed=next_version)
+        repo_relations.filter(version_added=self).update(version_added=next_version,
+                                                         number_added=next_version.number)
+        repo_relations.filter(version_removed=self).update(version_removed=next_version,
+                                                           number_removed=next_version.number)
 
     def delete(self, **kwargs):
         """
@@ -433,48 +602,101 @@ class RepositoryVersion(Model):
                 # version is the latest version so simply update repo contents
                 # and delete the version
                 repo_relations.filter(version_added=self).delete()
-                repo_relations.filter(version_removed=self).update(version_removed=None)
+                repo_relations.filter(version_removed=self).update(version_removed=None,
+                                                                   number_removed=None)
             super().delete(**kwargs)
 
         else:
             with transaction.atomic():
                 RepositoryContent.objects.filter(version_added=self).delete()
                 RepositoryContent.objects.filter(version_removed=self) \
-                    .update(version_removed=None)
+                    .update(version_removed=None, number_removed=None)
                 CreatedResource.objects.filter(object_id=self.pk).delete()
                 self.repository.last_version = self.number - 1
                 self.repository.save()
                 super().delete(**kwargs)
 
-    def compute_counts(self):
+    def compute_counts(self, full=False):
         """
         Compute and save content unit counts by type.
 
         Count records are stored as :class:`~pulpcore.app.models.RepositoryVersionContentDetails`.
         This method deletes existing :class:`~pulpcore.app.models.RepositoryVersionContentDetails`
         objects and makes new ones with each call.
+
+        The counts of present content are those of the previous version plus the content added and
+        minus the content removed by this version, so a version that changes a few units of a large
+        repository is counted without scanning all of its content. They are counted over the whole
+        content of this version when the previous version has no counts.
+
+        Args:
+            full (bool): Count the present content over the whole content of this version, e.g. to
+                verify the counts computed from the previous version.
         """
         with transaction.atomic():
+            RepositoryVersionContentDetails.objects.filter(repository_version=self).delete()
+            added = self._count_by_type(self.added())
+            removed = self._count_by_type(self.removed())
+            present = None if full else self._count_present_from_previous(added, removed)
+            if present is None:
+                present = self._count_by_type(self.content)
+
             counts_list = []
-            for value, name in RepositoryVersionContentDetails.COUNT_TYPE_CHOICES:
-                RepositoryVersionContentDetails.objects.filter(repository_version=self).delete()
-                if value == RepositoryVersionContentDetails.ADDED:
-                    qs = self.added()
-                elif value == RepositoryVersionContentDetails.PRESENT:
-                    qs = self.content
-                elif value == RepositoryVersionContentDetails.REMOVED:
-                    qs = self.removed()
-                annotated = qs.values('_type').annotate(count=models.Count('_type'))
-                for item in annotated:
+            for value, counts in ((RepositoryVersionContentDetails.ADDED, added),
+                                  (RepositoryVersionContentDetails.PRESENT, present),
+                                  (RepositoryVersionContentDetails.REMOVED, removed)):
+                for content_type, count in counts.items():
                     count_obj = RepositoryVersionContentDetails(
-                        content_type=item['_type'],
+                        content_type=content_type,
                         repository_version=self,
-                        count=item['count'],
+                        count=count,
                         count_type=value,
                     )
                     counts_list.append(count_obj)
             RepositoryVersionContentDetails.objects.bulk_create(counts_list)
 
+    @staticmethod
+    def _count_by_type(content):
+        """
+        Args:
+            content (django.db.models.QuerySet): Set of Content to count.
+
+        Returns:
+            collections.Counter: The number of content units of each type.
+        """
+        annotated = content.order_by().values('_type').annotate(count=models.Count('_type'))
+        return Counter({item['_type']: item['count'] for item in annotated})
+
+    def _count_present_from_previous(self, added, removed):
+        """
+        Count the present content from the counts of the previous version.
+
+        Args:
+            added (collections.Counter): The number of content units of each type added by this
+                version.
+            removed (collections.Counter): The number of content units of each type removed by this
+                version.
+
+        Returns:
+            collections.Counter: The number of content units of each type present in this version,
+                or None if the previous version has no counts.
+        """
+        previous = self.repository.versions.filter(
+            number__lt=self.number, complete=True
+        ).order_by('-number').first()
+        present = Counter()
+        if previous is not None:
+            counts = previous.counts.values_list('count_type', 'content_type', 'count')
+            if not counts:
+                return None
+            for count_type, content_type, count in counts:
+                if count_type == RepositoryVersionContentDetails.PRESENT:
+                    present[content_type] = count
+        present.update(added)
+        present.subtract(removed)
+        # Drop the types of which no content is left.
+        return +present
+
     def __enter__(self):
         """
         Create the repository version
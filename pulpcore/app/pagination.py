@@ -28,3 +28,15 @@ class NamePagination(pagination.PageNumberPagination):
     ordering = 'name'
     page_size_query_param = 'page_size'
     max_page_size = 5000
+
+
+class ContentDiffPagination(pagination.CursorPagination):
+    """
+    Paginate the difference of two repository versions by the primary key of the content.
+
+    A cursor on the primary key pages through large differences without counting them or skipping
+    over the previous pages, so clients can stream the whole difference one page after the other.
+    """
+    ordering = 'content_id'
+    page_size_query_param = 'page_size'
+    max_page_size = 5000
@@ -43,6 +43,7 @@ from .repository import (  # noqa
     RepositorySerializer,
     RepositorySyncURLSerializer,
     RepositoryVersionCreateSerializer,
+    RepositoryVersionDiffSerializer,
     RepositoryVersionSerializer,
 )
 from .task import (  # noqa
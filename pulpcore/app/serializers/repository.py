@@ -1,5 +1,8 @@
+from functools import lru_cache
 from gettext import gettext as _
 
+from django.apps import apps
+from django.urls import NoReverseMatch, reverse
 from rest_framework import fields, serializers
 from rest_framework.validators import UniqueValidator
 from rest_framework_nested.serializers import NestedHyperlinkedModelSerializer
@@ -15,6 +18,7 @@ from pulpcore.app.serializers import (
     NestedRelatedField,
     SecretCharField,
 )
+from pulpcore.app.util import get_view_name_for_model
 
 
 class RepositorySerializer(ModelSerializer):
@@ -266,6 +270,63 @@ class RepositoryVersionSerializer(ModelSerializer, NestedHyperlinkedModelSeriali
         )
 
 
+@lru_cache()
+def _content_detail_view_name(content_type):
+    """
+    Args:
+        content_type (str): The `_type` of a content unit.
+
+    Returns:
+        str: The name of the detail view of the content type, or None if it has none.
+    """
+    for model in apps.get_models():
+        if not issubclass(model, models.Content):
+            continue
+        if '{app_label}.{type}'.format(app_label=model._meta.app_label,
+                                       type=model.TYPE) == content_type:
+            try:
+                return get_view_name_for_model(model, 'detail')
+            except LookupError:
+                return None
+    return None
+
+
+class RepositoryVersionDiffSerializer(serializers.Serializer):
+    """
+    Serializer for a content unit in the difference of two repository versions.
+
+    It serializes the rows of :meth:`~pulpcore.app.models.RepositoryVersion.diff`. The
+    `content_types` of the context map the primary keys of the content units to their `_type`.
+    """
+    content = serializers.CharField(
+        help_text=_('The HREF of the content unit.'),
+        read_only=True
+    )
+    content_type = serializers.CharField(
+        help_text=_('The type of the content unit.'),
+        read_only=True
+    )
+    change = serializers.ChoiceField(
+        help_text=_("'added' if the content unit is only in the repository version, 'removed' if "
+                    "it is only in the base version."),
+        choices=('added', 'removed'),
+        read_only=True
+    )
+
+    def to_representation(self, obj):
+        content_type = self.context['content_types'].get(obj['content_id'])
+        view_name = _content_detail_view_name(content_type)
+        try:
+            href = reverse(view_name, kwargs={'pk': obj['content_id']}) if view_name else None
+        except NoReverseMatch:
+            href = None
+        return {
+            'content': href,
+            'content_type': content_type,
+            'change': 'added' if obj['in_version'] else 'removed',
+        }
+
+
 class RepositoryVersionCreateSerializer(ModelSerializer, NestedHyperlinkedModelSerializer):
     add_content_units = serializers.ListField(
         help_text=_('A list of content units to add to a new repository version. This content is '
@@ -204,6 +204,27 @@ LOGGING = {
 CONTENT_HOST = ''
 CONTENT_PATH_PREFIX = '/pulp/content/'
 CONTENT_APP_TTL = 30
+CONTENT_APP_DATABASE_THREADS = 8
+CONTENT_APP_CACHE_REFRESH_INTERVAL = 5
+CONTENT_APP_PATH_CACHE_SIZE = 10000
+CONTENT_APP_PATH_CACHE_TTL = 3600
+CONTENT_APP_REPOSITORY_VERSION_INDEX_SIZE = 200000
+CONTENT_APP_PUBLICATION_FILTER_SIZE = 10000000
+CONTENT_APP_PERMIT_CACHE_TTL = 10
+CONTENT_APP_WARM_UP = False
+CONTENT_APP_HOT_DISTRIBUTIONS = []
+CONTENT_APP_STREAMED_CACHE_DIR = os.path.join(MEDIA_ROOT, 'streamed-cache/')
+CONTENT_APP_STREAMED_CACHE_SIZE = 0
+CONTENT_APP_METRICS_PATH = None
+CONTENT_APP_UPSTREAM_MAX_WAIT = 30
+CONTENT_APP_HEDGE_DELAY = None
+CONTENT_APP_PULL_THROUGH_WAIT = 5
+CONTENT_APP_STORAGE_SERVING = None
+CONTENT_APP_SIGNED_URL_TTL = None
+CONTENT_APP_STORAGE_CACHE_DIR = os.path.join(MEDIA_ROOT, 'storage-cache/')
+CONTENT_APP_STORAGE_CACHE_SIZE = 10 * 1024 ** 3
+
+PUBLISHED_METADATA_COMPRESSION = []
 
 REMOTE_USER_ENVIRON_NAME = "REMOTE_USER"
 
@@ -1,10 +1,12 @@
-import itertools
 from gettext import gettext as _
 
+from django.db.models import Exists, OuterRef, Q
 from django_filters import Filter
 from django_filters.rest_framework import DjangoFilterBackend, filters
+from drf_yasg.openapi import Parameter
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import mixins, serializers
+from rest_framework.decorators import action
 from rest_framework.filters import OrderingFilter
 
 from pulpcore.app import tasks
@@ -17,7 +19,7 @@ from pulpcore.app.models import (
     RepositoryContent,
     RepositoryVersion,
 )
-from pulpcore.app.pagination import NamePagination
+from pulpcore.app.pagination import ContentDiffPagination, NamePagination
 from pulpcore.app.response import OperationPostponedResponse
 from pulpcore.app.serializers import (
     AsyncOperationResponseSerializer,
@@ -26,6 +28,7 @@ from pulpcore.app.serializers import (
     RemoteSerializer,
     RepositorySerializer,
     RepositoryVersionCreateSerializer,
+    RepositoryVersionDiffSerializer,
     RepositoryVersionSerializer,
 )
 from pulpcore.app.viewsets import (
@@ -96,11 +99,8 @@ class RepositoryVersionContentFilter(Filter):
     """
     Filter used to get the repository versions where some given content can be found.
 
-    Given a content_href, this filter will:
-        1. Get the RepositoryContent that the content can be found in
-        2. Get a list of version_added and version_removed where the content was
-           changed on the repository
-        3. Calculate and return the versions that the content can be found on
+    Given a content_href, this filter returns the versions within the range of version numbers of
+    any of the RepositoryContent of the content in the repository.
     """
 
     def __init__(self, *args, **kwargs):
@@ -129,38 +129,13 @@ class RepositoryVersionContentFilter(Filter):
 
         # Get the repository from the parent request.
         repository_pk = self.parent.request.parser_context['kwargs']['repository_pk']
-        repository = Repository.objects.get(pk=repository_pk)
 
-        repository_content_set = RepositoryContent.objects.filter(content=content,
-                                                                  repository=repository)
-
-        # Get the sorted list of version_added and version_removed.
-        version_added = list(repository_content_set.values_list('version_added__number', flat=True))
-
-        # None values have to be filtered out from version_removed,
-        # in order for zip_longest to pass it a default fillvalue
-        version_removed = list(filter(None.__ne__, repository_content_set
-                                      .values_list('version_removed__number', flat=True)))
-
-        # The range finding should work as long as both lists are sorted
-        # Why it works: https://gist.github.com/werwty/6867f83ae5adbae71e452c28ecd9c444
-        version_added.sort()
-        version_removed.sort()
-
-        # Match every version_added to a version_removed, if len(version_removed)
-        # is shorter than len(version_added), pad out the remaining space with the current
-        # repository version +1 (the +1 is to the current version gets included when we
-        # calculate range)
-        version_tuples = itertools.zip_longest(version_added, version_removed,
-                                               fillvalue=repository.last_version + 1)
-
-        # Get the ranges between paired version_added and version_removed to get all
-        # the versions the content is present in.
-        versions = [list(range(added, removed)) for (added, removed) in version_tuples]
-        # Flatten the list of lists
-        versions = list(itertools.chain.from_iterable(versions))
-
-        return qs.filter(number__in=versions)
+        # The content is in every version within the range of one of its relations.
+        relations = RepositoryContent.objects.filter(
+            Q(number_removed__isnull=True) | Q(number_removed__gt=OuterRef('number')),
+            content=content, repository_id=repository_pk, number_added__lte=OuterRef('number')
+        )
+        return qs.annotate(has_content=Exists(relations)).filter(has_content=True)
 
 
 class RepositoryVersionFilter(BaseFilterSet):
@@ -256,9 +231,44 @@ class RepositoryVersionViewSet(NamedModelViewSet,
         )
         return OperationPostponedResponse(result, request)
 
+    base_version_parameter = Parameter(
+        name='base_version', in_='query', required=True, type='string',
+        description='The repository version to compare with, referenced by HREF. It may belong to '
+                    'any repository.'
+    )
+
+    @swagger_auto_schema(operation_description="List the content that is in only one of this "
+                                               "repository version and the base version.",
+                         manual_parameters=[base_version_parameter],
+                         responses={200: RepositoryVersionDiffSerializer(many=True)})
+    @action(detail=True, methods=['get'], pagination_class=ContentDiffPagination,
+            filter_backends=())
+    def diff(self, request, repository_pk, number):
+        """
+        Lists the content added and removed by this repository version relative to another one
+        """
+        version = self.get_object()
+        base_version_href = request.query_params.get('base_version')
+        if not base_version_href:
+            raise serializers.ValidationError(
+                detail=_('No value supplied for base_version')
+            )
+        base_version = self.get_resource(base_version_href, RepositoryVersion)
+
+        page = self.paginate_queryset(version.diff(base_version))
+        content_types = dict(Content.objects.filter(
+            pk__in=[row['content_id'] for row in page]
+        ).values_list('pk', '_type'))
+        serializer = RepositoryVersionDiffSerializer(
+            page, many=True, context={'request': request, 'content_types': content_types}
+        )
+        return self.get_paginated_response(serializer.data)
+
     def get_serializer_class(self):
         if self.action == 'create':
             return RepositoryVersionCreateSerializer
+        if self.action == 'diff':
+            return RepositoryVersionDiffSerializer
         return RepositoryVersionSerializer
 
 
@@ -5,6 +5,8 @@ from importlib import import_module
 import logging
 import os
 import socket
+import time
+import tracemalloc
 
 import django  # noqa otherwise E402: module level not at top of file
 django.setup()  # noqa otherwise E402: module level not at top of file
@@ -15,7 +17,11 @@ from django.conf import settings
 from pulpcore.app.apps import pulp_plugin_configs
 from pulpcore.app.models import ContentAppStatus
 
+from .cache import distribution_cache, warm_up
+from .downloads import pull_through_claims, remote_sessions, wait_for_background_tasks
+from .executor import close_database_connections, run_in_database_thread
 from .handler import Handler
+from .metrics import metrics_view, on_response_prepare
 
 
 log = logging.getLogger(__name__)
@@ -25,22 +31,81 @@ app = web.Application()
 CONTENT_MODULE_NAME = 'content'
 
 
+def _status_name():
+    return '{pid}@{hostname}'.format(pid=os.getpid(), hostname=socket.gethostname())
+
+
 async def _heartbeat():
-    name = '{pid}@{hostname}'.format(pid=os.getpid(), hostname=socket.gethostname())
+    name = _status_name()
     heartbeat_interval = settings.CONTENT_APP_TTL // 4
     i8ln_msg = _("Content App '{name}' heartbeat written, sleeping for '{interarrival}' seconds")
     msg = i8ln_msg.format(name=name, interarrival=heartbeat_interval)
 
     while True:
-        content_app_status, created = ContentAppStatus.objects.get_or_create(name=name)
+        content_app_status, created = await run_in_database_thread(
+            ContentAppStatus.objects.get_or_create, name=name
+        )
         if not created:
-            content_app_status.save_heartbeat()
+            await run_in_database_thread(content_app_status.save_heartbeat)
         log.debug(msg)
         await asyncio.sleep(heartbeat_interval)
 
 
+async def _refresh_caches():
+    refresh_interval = settings.CONTENT_APP_CACHE_REFRESH_INTERVAL
+    if not refresh_interval:
+        return
+
+    while True:
+        await asyncio.sleep(refresh_interval)
+        await run_in_database_thread(distribution_cache.refresh)
+
+
+async def _warm_up():
+    tracemalloc.start()
+    start = time.monotonic()
+    try:
+        loaded = await run_in_database_thread(warm_up, settings.CONTENT_APP_HOT_DISTRIBUTIONS)
+        memory = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    log.info(_("Content App warmed up in {seconds:.2f} seconds using {memory:.1f} MB: loaded "
+               "{distributions} distributions and {paths} published paths, indexed {indexed} "
+               "repository version paths").format(
+        seconds=time.monotonic() - start, memory=memory / 2 ** 20, **loaded
+    ))
+
+
+async def _wait_for_background_tasks(app):
+    await wait_for_background_tasks()
+
+
+async def _remove_status(app):
+    await run_in_database_thread(
+        lambda: ContentAppStatus.objects.filter(name=_status_name()).delete()
+    )
+
+
+async def _close_remote_sessions(app):
+    await remote_sessions.close()
+
+
+async def _close_pull_through_claims(app):
+    await pull_through_claims.close()
+
+
+async def _close_database_connections(app):
+    await close_database_connections()
+
+
 async def server(*args, **kwargs):
     asyncio.ensure_future(_heartbeat())
+    asyncio.ensure_future(_refresh_caches())
+    app.on_shutdown.append(_wait_for_background_tasks)
+    app.on_shutdown.append(_remove_status)
+    app.on_cleanup.append(_close_remote_sessions)
+    app.on_cleanup.append(_close_pull_through_claims)
+    app.on_cleanup.append(_close_database_connections)
     for pulp_plugin in pulp_plugin_configs():
         if pulp_plugin.name != "pulpcore.app":
             content_module_name = '{name}.{module}'.format(name=pulp_plugin.name,
@@ -48,4 +113,9 @@ async def server(*args, **kwargs):
             with suppress(ModuleNotFoundError):
                 import_module(content_module_name)
     app.add_routes([web.get(settings.CONTENT_PATH_PREFIX + '{path:.+}', Handler().stream_content)])
+    if settings.CONTENT_APP_METRICS_PATH:
+        app.add_routes([web.get(settings.CONTENT_APP_METRICS_PATH, metrics_view)])
+        app.on_response_prepare.append(on_response_prepare)
+    if settings.CONTENT_APP_WARM_UP:
+        await _warm_up()
     return app
@@ -0,0 +1,1054 @@
+"""
+Caches used by the Content App.
+
+The Content App answers every request by matching it against the database. The in-process caches
+in this module keep the results of those lookups in memory, so that repeated requests can be
+answered without any database queries. The :class:`RepositoryVersionPaths` index the paths of the
+repository versions served directly, so they can be matched without a join, and the
+:class:`PublishedPathFilters` rule out the paths a publication does not serve without a query. The
+:class:`StreamedCache` keeps files of ``streamed`` remotes on local disk instead of downloading
+them again for every request. The ``signed_url_cache`` reuses the URLs the storage signs for
+redirects while they are valid.
+"""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import logging
+from gettext import gettext as _
+import math
+import os
+import tempfile
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, MultipleObjectsReturned
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.db.models import Count, Max
+
+from pulpcore.app.models import (
+    BaseDistribution,
+    ContentArtifact,
+    ContentGuard,
+    Publication,
+    Remote,
+    Repository,
+    RepositoryVersion,
+)
+
+
+log = logging.getLogger(__name__)
+
+PERMIT_CACHE_SIZE = 10000
+
+# Signed URLs are dropped from the cache this many seconds before they expire, so clients that are
+# redirected to them have time to follow the redirect.
+SIGNED_URL_MARGIN = 60
+
+
+class LRUCache:
+    """
+    A size-bounded mapping that evicts the least recently used entries first.
+
+    Entries can also expire after a fixed time to live. The number of cache hits and misses is
+    counted, so the effectiveness of the cache can be observed.
+
+    By default every entry counts as 1 against `max_size`. With `weigh`, entries count as much as
+    it returns for their value instead, e.g. the number of paths of an index. Values that weigh
+    more than `max_size` on their own are not cached.
+
+    Args:
+        max_size (int): The maximum number (or total weight) of entries to keep.
+        ttl (int): An optional number of seconds after which an entry expires.
+        weigh (callable): An optional function returning the weight of a value.
+    """
+
+    def __init__(self, max_size, ttl=None, weigh=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.weigh = weigh
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """
+        Get the value cached for `key` and mark it as recently used.
+
+        Args:
+            key (hashable): The key to look up.
+            default (object): The value returned when `key` is not cached or expired.
+
+        Returns:
+            The cached value or `default`.
+        """
+        with self._lock:
+            try:
+                value, expires, weight = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires < time.monotonic():
+                del self._entries[key]
+                self.weight -= weight
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """
+        Cache `value` for `key`, evicting the least recently used entries beyond the size bound.
+
+        Args:
+            key (hashable): The key to cache the value for.
+            value (object): The value to cache.
+
+        Returns:
+            bool: True if the value was cached, False if it weighs more than the whole cache.
+        """
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        weight = self.weigh(value) if self.weigh else 1
+        with self._lock:
+            self._pop(key)
+            if weight > self.max_size:
+                return False
+            self._entries[key] = (value, expires, weight)
+            self.weight += weight
+            while self.weight > self.max_size:
+                self.weight -= self._entries.popitem(last=False)[1][2]
+        return True
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.weight -= entry[2]
+
+    def discard(self, key):
+        """
+        Drop the value cached for `key`, if any.
+
+        Args:
+            key (hashable): The key to drop.
+        """
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        """
+        Drop all cached values.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.weight = 0
+
+    def stats(self):
+        """
+        Returns:
+            dict: The number of cached entries, hits, and misses.
+        """
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class DistributionCache:
+    """
+    A longest-prefix map of ``base_path`` to distribution detail objects.
+
+    Distributions are stored already cast to their detail type, with their content guard and remote
+    cast as well and with the publication, repository, or repository version they serve loaded
+    alongside them. Matching a cached distribution therefore runs no queries.
+
+    The whole cache is dropped when the :meth:`generation` of the tables it depends on changes.
+    Checking the generation is the job of :meth:`refresh`, which the Content App calls
+    periodically instead of on every request.
+    """
+
+    # Models whose changes may alter the result of a distribution lookup.
+    GENERATION_MODELS = (
+        BaseDistribution,
+        ContentGuard,
+        Publication,
+        Remote,
+        Repository,
+        RepositoryVersion,
+    )
+
+    # Relations of a distribution that are used when serving it.
+    RELATIONS = (
+        'content_guard',
+        'remote',
+        'publication__repository_version__repository',
+        'repository',
+        'repository_version__repository',
+    )
+
+    def __init__(self):
+        self._generation = None
+        self._maps = {}
+        # Incremented by clear(), so maps loaded before are not installed afterwards.
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(distributions) for distributions in self._maps.values())
+
+    @classmethod
+    def generation(cls):
+        """
+        Compute a value that changes whenever any of the :attr:`GENERATION_MODELS` change.
+
+        Every save updates the `_last_updated` timestamp and every insert or delete changes the
+        number of rows, so the pair of both per table is enough to notice any change.
+
+        Returns:
+            tuple: The current generation.
+        """
+        generation = []
+        for model in cls.GENERATION_MODELS:
+            stats = model.objects.aggregate(count=Count('pk'), last_updated=Max('_last_updated'))
+            generation.append((stats['count'], stats['last_updated']))
+        return tuple(generation)
+
+    def refresh(self):
+        """
+        Drop all cached distributions if the generation has changed since they were loaded.
+
+        Returns:
+            bool: True if the cache was invalidated, otherwise False.
+        """
+        if self._generation is None:
+            return False
+        generation = self.generation()
+        if generation == self._generation:
+            return False
+        log.debug(_('Distribution cache invalidated'))
+        self.clear()
+        return True
+
+    def clear(self):
+        """
+        Drop all cached distributions.
+
+        Distributions that are being loaded while the cache is dropped are not cached.
+        """
+        with self._lock:
+            self._epoch += 1
+            self._generation = None
+            self._maps = {}
+
+    def get(self, model, base_paths):
+        """
+        Find the distribution of `model` with the longest base path in `base_paths`.
+
+        All distributions of `model` are loaded on the first call after the cache was dropped.
+
+        Args:
+            model (type): The (master or detail) distribution model to match.
+            base_paths (list): Candidate base paths, ordered from the longest to the shortest.
+
+        Returns:
+            detail of BaseDistribution: The matched distribution, or None if there is no match.
+        """
+        distributions = self._maps.get(model)
+        if distributions is None:
+            distributions = self.load(model)
+        for base_path in base_paths:
+            try:
+                return distributions[base_path]
+            except KeyError:
+                continue
+        return None
+
+    def add(self, model, distribution):
+        """
+        Cache a distribution of `model` that was matched outside of the cache.
+
+        Args:
+            model (type): The (master or detail) distribution model that was matched.
+            distribution (detail of BaseDistribution): The matched distribution, as returned by
+                :meth:`query`.
+        """
+        distributions = self._maps.get(model)
+        if distributions is not None:
+            distributions[distribution.base_path] = distribution
+
+    @classmethod
+    def query(cls, model, base_paths):
+        """
+        Query the distribution of `model` with a base path in `base_paths` outside of the cache.
+
+        The distribution is loaded like the distributions in the cache, along with its detail
+        object and its :attr:`RELATIONS`, in a single query.
+
+        Args:
+            model (type): The (master or detail) distribution model to match.
+            base_paths (list): Candidate base paths.
+
+        Returns:
+            detail of BaseDistribution: The matched distribution, cast and with its relations
+                loaded, so serving it runs no queries.
+
+        Raises:
+            django.core.exceptions.ObjectDoesNotExist: When no distribution matches.
+        """
+        queryset = model.objects.select_related(*cls._detail_relations(model))
+        return cls._prepare(queryset.get(base_path__in=base_paths), {})
+
+    def load(self, model):
+        """
+        Load all distributions of `model` in bulk.
+
+        Args:
+            model (type): The (master or detail) distribution model to load.
+
+        Returns:
+            dict: The loaded distributions keyed by base path.
+        """
+        with self._lock:
+            epoch, generation = self._epoch, self._generation
+        if generation is None:
+            generation = self.generation()
+        loaded = {}
+        detail_models = self._detail_models(model)
+        for detail_model in detail_models:
+            queryset = detail_model.objects.select_related(*self._relations(detail_model))
+            loaded.update((distribution.pk, distribution) for distribution in queryset)
+        if detail_models != [model]:
+            # Rows of `model` without a detail row are not returned by any detail model.
+            queryset = model.objects.select_related(*self._relations(model))
+            loaded.update((distribution.pk, distribution)
+                          for distribution in queryset.exclude(pk__in=list(loaded)))
+
+        distributions = {}
+        related = {}
+        for distribution in loaded.values():
+            distribution = self._prepare(distribution, related)
+            distributions[distribution.base_path] = distribution
+        with self._lock:
+            # A map loaded before the cache was dropped, or for another generation, may be stale.
+            if epoch == self._epoch and self._generation in (None, generation):
+                self._generation = generation
+                # Swap in the complete map at once, concurrent lookups must never see a partial
+                # one.
+                maps = dict(self._maps)
+                maps[model] = distributions
+                self._maps = maps
+        log.debug(_('Loaded {count} {model_name} objects into the distribution cache').format(
+            count=len(distributions), model_name=model.__name__
+        ))
+        return distributions
+
+    @staticmethod
+    def _detail_models(model):
+        """
+        Find the most detailed concrete models for `model`.
+
+        Args:
+            model (type): A distribution model.
+
+        Returns:
+            list: The concrete subclasses of `model` (or `model` itself) that have no concrete
+                subclasses of their own.
+        """
+        candidates = [m for m in apps.get_models() if issubclass(m, model) and not m._meta.proxy]
+        return [m for m in candidates if not any(o is not m and issubclass(o, m)
+                                                 for o in candidates)]
+
+    @classmethod
+    def _relations(cls, model):
+        """
+        Get the :attr:`RELATIONS` that exist on `model`.
+
+        Args:
+            model (type): A distribution model.
+
+        Returns:
+            list: Of relation names suitable for `select_related()`.
+        """
+        relations = []
+        for relation in cls.RELATIONS:
+            try:
+                model._meta.get_field(relation.split('__')[0])
+            except FieldDoesNotExist:
+                continue
+            relations.append(relation)
+        return relations
+
+    @classmethod
+    def _detail_relations(cls, model):
+        """
+        Get the :attr:`RELATIONS` of `model` and of its detail models, along with the relations
+        to its detail models, so casting needs no query.
+
+        Args:
+            model (type): A distribution model.
+
+        Returns:
+            list: Of relation names suitable for `select_related()`.
+        """
+        relations = cls._relations(model)
+        for rel in model._meta.related_objects:
+            if rel.one_to_one and issubclass(rel.related_model, model):
+                relations.append(rel.name)
+                relations.extend('{name}__{relation}'.format(name=rel.name, relation=relation)
+                                 for relation in cls._detail_relations(rel.related_model))
+        return relations
+
+    @staticmethod
+    def _prepare(distribution, related):
+        """
+        Cast a distribution and its master-detail relations so serving it runs no queries.
+
+        Args:
+            distribution (BaseDistribution): The distribution to prepare.
+            related (dict): Already cast relations keyed by primary key, shared across a bulk load.
+
+        Returns:
+            detail of BaseDistribution: The prepared distribution.
+        """
+        distribution = distribution.cast()
+        for name in ('content_guard', 'remote'):
+            obj = getattr(distribution, name)
+            if obj is None:
+                continue
+            try:
+                obj = related[obj.pk]
+            except KeyError:
+                obj = related[obj.pk] = obj.cast()
+            setattr(distribution, name, obj)
+        return distribution
+
+
+class PathIndexes:
+    """
+    In-memory indexes of the relative paths of immutable objects, built in the background.
+
+    Indexing an object scans all of its paths, which takes too long to make a request wait for it.
+    :meth:`get` therefore only returns indexes that were built already. A missing index is built
+    by a single background thread, while requests keep being answered from the database. Indexes
+    can also be built right away with :meth:`load`, e.g. during the warm-up.
+
+    The indexes of the least recently used objects are dropped once the total number of their
+    paths exceeds `max_paths`. Objects with more paths than that are never indexed.
+
+    Subclasses implement :meth:`build`.
+
+    Args:
+        max_paths (int): The maximum total number of paths of the indexes to keep.
+    """
+
+    def __init__(self, max_paths):
+        self.indexes = LRUCache(max_paths, weigh=self.weigh)
+        self._building = {}
+        self._oversized = set()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def weigh(index):
+        """
+        Args:
+            index: An index returned by :meth:`build`.
+
+        Returns:
+            int: The number of paths of `index`.
+        """
+        return len(index)
+
+    def get(self, obj):
+        """
+        Get the index of an object, and start building it in the background if it is missing.
+
+        Args:
+            obj (:class:`django.db.models.Model`): An immutable object.
+
+        Returns:
+            The index of `obj`, or None if it was not built yet.
+        """
+        index = self.indexes.get(obj.pk)
+        if index is None:
+            self._build_in_background(obj)
+        return index
+
+    def load(self, obj):
+        """
+        Get the index of an object, building it right away if it is missing.
+
+        Args:
+            obj (:class:`django.db.models.Model`): An immutable object.
+
+        Returns:
+            The index of `obj`, or None if it has too many paths to be kept.
+        """
+        index = self.indexes.get(obj.pk)
+        if index is None and obj.pk not in self._oversized:
+            index = self.build(obj)
+            if not self.indexes.set(obj.pk, index):
+                log.warning(_('{obj} has {count} paths, more than the {name} can hold').format(
+                    obj=obj, count=self.weigh(index), name=type(self).__name__
+                ))
+                self._oversized.add(obj.pk)
+                index = None
+        return index
+
+    def build(self, obj):
+        """
+        Query the relative paths of an object.
+
+        Args:
+            obj (:class:`django.db.models.Model`): An immutable object.
+
+        Returns:
+            The index of the paths of `obj`.
+        """
+        raise NotImplementedError()
+
+    def _build_in_background(self, obj):
+        with self._lock:
+            if obj.pk in self._building or obj.pk in self._oversized:
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1,
+                                                    thread_name_prefix='pulp-content-index')
+            self._building[obj.pk] = self._executor.submit(self._load_in_background, obj)
+
+    def _load_in_background(self, obj):
+        close_old_connections()
+        try:
+            self.load(obj)
+        except Exception:
+            log.exception(_('Indexing the paths of {obj} failed').format(obj=obj))
+        finally:
+            with self._lock:
+                self._building.pop(obj.pk, None)
+            close_old_connections()
+
+
+class RepositoryVersionPaths(PathIndexes):
+    """
+    In-memory indexes of the relative paths of complete repository versions.
+
+    Matching a path of a repository version in the database means joining its content artifacts
+    with the content of the version, which gets slow for large repositories. The content of a
+    complete version never changes though, so its paths are indexed once, with a single query, and
+    every later match is a lookup in a dict.
+
+    Args:
+        max_paths (int): The maximum total number of paths of the indexes to keep.
+    """
+
+    MULTIPLE = object()
+    NOT_INDEXED = object()
+
+    def match(self, repository_version, relative_path):
+        """
+        Look up the content artifact of a complete repository version at a relative path.
+
+        Args:
+            repository_version (:class:`~pulpcore.plugin.models.RepositoryVersion`): A complete
+                repository version.
+            relative_path (str): The relative path to look up.
+
+        Returns:
+            int: The primary key of the :class:`~pulpcore.plugin.models.ContentArtifact` at
+                `relative_path`, None if there is none, or :attr:`NOT_INDEXED` if the version is
+                not indexed yet.
+
+        Raises:
+            MultipleObjectsReturned: When more than one content artifact is at `relative_path`.
+        """
+        index = self.get(repository_version)
+        if index is None:
+            return self.NOT_INDEXED
+        pk = index.get(relative_path)
+        if pk is self.MULTIPLE:
+            raise MultipleObjectsReturned()
+        return pk
+
+    def build(self, repository_version):
+        """
+        Query the relative paths of a repository version.
+
+        Args:
+            repository_version (:class:`~pulpcore.plugin.models.RepositoryVersion`): A repository
+                version.
+
+        Returns:
+            dict: Maps the relative paths of the version to content artifact primary keys.
+        """
+        index = {}
+        content_artifacts = ContentArtifact.objects.filter(
+            content__in=repository_version.content
+        ).values_list('relative_path', 'pk')
+        for relative_path, pk in content_artifacts.iterator():
+            index[relative_path] = self.MULTIPLE if relative_path in index else pk
+        return index
+
+
+class BloomFilter:
+    """
+    A set of strings that answers membership tests in constant memory, with false positives.
+
+    A string that was added is always reported as contained. A string that was not added is
+    reported as contained with a probability of about `error_rate`.
+
+    Args:
+        capacity (int): The number of strings that will be added.
+        error_rate (float): The probability of false positives when `capacity` strings were added.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        capacity = max(capacity, 1)
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'big')
+        second = int.from_bytes(digest[8:], 'big') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, value):
+        """
+        Args:
+            value (str): The string to add.
+        """
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self._bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(value))
+
+
+class PublishedPathFilters(PathIndexes):
+    """
+    In-memory Bloom filters of the relative paths served by complete publications.
+
+    Clients probing paths that don't exist cause a database query for every path, since a miss
+    can't be told apart from a path that was not cached yet. The paths of a complete publication
+    never change though, so they are added to a :class:`BloomFilter` once, and paths the filter
+    does not contain are known not to exist without a query. For pass-through publications, the
+    paths of the repository version are added as well.
+
+    Args:
+        max_paths (int): The maximum total number of paths of the filters to keep.
+    """
+
+    ERROR_RATE = 0.01
+
+    @staticmethod
+    def weigh(paths):
+        """
+        Args:
+            paths (:class:`BloomFilter`): A filter returned by :meth:`build`.
+
+        Returns:
+            int: The number of paths in `paths`.
+        """
+        return paths.capacity
+
+    def build(self, publication):
+        """
+        Query the relative paths served by a publication.
+
+        Args:
+            publication (:class:`~pulpcore.plugin.models.Publication`): A publication.
+
+        Returns:
+            :class:`BloomFilter`: The filter of the paths served by `publication`.
+        """
+        relative_paths = list(
+            publication.published_artifact.values_list('relative_path', flat=True).iterator()
+        )
+        relative_paths.extend(
+            publication.published_metadata.values_list('relative_path', flat=True).iterator()
+        )
+        if publication.pass_through:
+            relative_paths.extend(ContentArtifact.objects.filter(
+                content__in=publication.repository_version.content
+            ).values_list('relative_path', flat=True).iterator())
+
+        paths = BloomFilter(len(relative_paths), self.ERROR_RATE)
+        for relative_path in relative_paths:
+            paths.add(relative_path)
+        return paths
+
+
+class StreamedCache:
+    """
+    A size-bounded local disk cache for the files of ``streamed`` remotes.
+
+    Files are content-addressed by the expected SHA-256 digest of their remote artifact. Files
+    without one are not cached, since nothing tells whether the upstream file changed, e.g. for
+    metadata served from a remote directly. A file is only added to the cache once it was
+    downloaded completely and its digest was verified. The `Content-Type` of the upstream response
+    is kept next to it, so it can be sent again.
+
+    The modification time of a file records when it was last used. When the cache grows beyond
+    its maximum size, the least recently used files are removed until it is filled to
+    :attr:`LOW_WATER` of its size, so the directory does not need to be walked for every file
+    added. The size of the cache is tracked in memory between the walks. All Content App
+    processes of a host can share the same directory.
+
+    Cached files are never saved as Artifacts.
+
+    Args:
+        path (str): The directory of the cache.
+        max_size (int): The maximum total size of the cached files in bytes.
+    """
+
+    CONTENT_TYPE_SUFFIX = '.content-type'
+    LOW_WATER = 0.9
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        # The total size of the cached files, or None until the directory was walked.
+        self._size = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(remote_artifact):
+        """
+        Args:
+            remote_artifact (:class:`~pulpcore.plugin.models.RemoteArtifact`): A remote artifact.
+
+        Returns:
+            str: The key of the cached file of `remote_artifact`, or None if it can't be cached.
+        """
+        return remote_artifact.sha256 or None
+
+    def _path(self, key):
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def get(self, key):
+        """
+        Get the path of a cached file and mark it as recently used.
+
+        Args:
+            key (str): The key of the file.
+
+        Returns:
+            str: The path of the file, or None if it is not cached.
+        """
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def content_type(self, path):
+        """
+        Args:
+            path (str): The path of a cached file, as returned by :meth:`get`.
+
+        Returns:
+            str: The `Content-Type` the file was downloaded with, or None if it is not known.
+        """
+        try:
+            with open(path + self.CONTENT_TYPE_SUFFIX) as f:
+                return f.read() or None
+        except FileNotFoundError:
+            return None
+
+    def writer(self, key, sha256=None):
+        """
+        Start adding a file to the cache.
+
+        Args:
+            key (str): The key of the file.
+            sha256 (str): The expected SHA-256 digest of the file, if known.
+
+        Returns:
+            :class:`StreamedCacheWriter`: The writer to write the file to.
+        """
+        return StreamedCacheWriter(self, key, sha256)
+
+    def added(self, size):
+        """
+        Account for a file added to the cache, and evict files if the cache grew too large.
+
+        Args:
+            size (int): The size of the added file in bytes.
+        """
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+                if self._size <= self.max_size:
+                    return
+            self._size = self._evict()
+
+    def evict(self):
+        """
+        Remove the least recently used files until the cache fits into its maximum size.
+        """
+        with self._lock:
+            self._size = self._evict()
+
+    def _evict(self):
+        files = []
+        total = 0
+        for shard in os.scandir(self.path):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(self.CONTENT_TYPE_SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        if total <= self.max_size:
+            return total
+        for mtime, size, path in sorted(files):
+            if total <= self.max_size * self.LOW_WATER:
+                break
+            for name in (path, path + self.CONTENT_TYPE_SUFFIX):
+                try:
+                    os.unlink(name)
+                except FileNotFoundError:
+                    pass
+            total -= size
+        return total
+
+
+class StreamedCacheWriter:
+    """
+    Writes a file to a temporary location until it is committed to a :class:`StreamedCache`.
+
+    Args:
+        cache (:class:`StreamedCache`): The cache to add the file to.
+        key (str): The key of the file.
+        sha256 (str): The expected SHA-256 digest of the file, if known.
+
+    Attributes:
+        content_type (str): The `Content-Type` to keep with the file, if any.
+    """
+
+    def __init__(self, cache, key, sha256=None):
+        self.cache = cache
+        self.key = key
+        self.sha256 = sha256
+        self.content_type = None
+        self._hasher = hashlib.sha256()
+        self._size = 0
+        os.makedirs(cache.path, exist_ok=True)
+        self._file = tempfile.NamedTemporaryFile(dir=cache.path, prefix='.', delete=False)
+
+    def write(self, data):
+        """
+        Args:
+            data (bytes): The next chunk of the file.
+        """
+        self._file.write(data)
+        self._hasher.update(data)
+        self._size += len(data)
+
+    def commit(self):
+        """
+        Add the written file to the cache, unless it doesn't match the expected digest.
+
+        Returns:
+            bool: True if the file was added.
+        """
+        self._file.close()
+        if self.sha256 and self._hasher.hexdigest() != self.sha256:
+            log.warning(_('Not caching streamed file {key}, its digest does not match').format(
+                key=self.key
+            ))
+            os.unlink(self._file.name)
+            return False
+        path = self.cache._path(self.key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if self.content_type:
+            with open(path + self.cache.CONTENT_TYPE_SUFFIX, 'w') as f:
+                f.write(self.content_type)
+        os.replace(self._file.name, path)
+        self.cache.added(self._size)
+        return True
+
+    def abort(self):
+        """
+        Discard the written file.
+        """
+        self._file.close()
+        try:
+            os.unlink(self._file.name)
+        except FileNotFoundError:
+            pass
+
+
+distribution_cache = DistributionCache()
+
+# Maps (publication pk, relative path) to what is published at that path in a complete
+# publication, or to None if nothing is.
+published_path_cache = LRUCache(
+    settings.CONTENT_APP_PATH_CACHE_SIZE, ttl=settings.CONTENT_APP_PATH_CACHE_TTL
+)
+# Maps (content guard pk, content guard last update, credential fingerprint) to the reason the
+# guard did not permit the request, or to None if it did.
+permit_cache = None
+if settings.CONTENT_APP_PERMIT_CACHE_TTL:
+    permit_cache = LRUCache(PERMIT_CACHE_SIZE, ttl=settings.CONTENT_APP_PERMIT_CACHE_TTL)
+
+repository_version_paths = None
+if settings.CONTENT_APP_REPOSITORY_VERSION_INDEX_SIZE:
+    repository_version_paths = RepositoryVersionPaths(
+        settings.CONTENT_APP_REPOSITORY_VERSION_INDEX_SIZE
+    )
+
+published_path_filters = None
+if settings.CONTENT_APP_PUBLICATION_FILTER_SIZE:
+    published_path_filters = PublishedPathFilters(settings.CONTENT_APP_PUBLICATION_FILTER_SIZE)
+
+
+def signed_url_ttl(storage):
+    """
+    Get the number of seconds the URLs of a storage can be reused.
+
+    ``CONTENT_APP_SIGNED_URL_TTL`` is used if set. Otherwise the lifetime of the presigned URLs of
+    S3 storages is derived from their ``querystring_expire``, and URLs that are not signed expire
+    like the published paths. The URLs of other storages are not reused.
+
+    Args:
+        storage (:class:`django.core.files.storage.Storage`): A storage.
+
+    Returns:
+        int: The number of seconds, or None if the URLs must not be reused.
+    """
+    if settings.CONTENT_APP_SIGNED_URL_TTL is not None:
+        return settings.CONTENT_APP_SIGNED_URL_TTL or None
+    if not hasattr(storage, 'querystring_auth'):
+        return None
+    if not storage.querystring_auth:
+        return settings.CONTENT_APP_PATH_CACHE_TTL
+    expire = storage.querystring_expire
+    ttl = expire - min(SIGNED_URL_MARGIN, expire // 2)
+    return ttl if ttl > 0 else None
+
+
+# Maps the names of stored files to the URLs the Content App redirects to, see
+# :class:`~pulpcore.content.serving.RedirectStrategy`.
+signed_url_cache = None
+if signed_url_ttl(default_storage):
+    signed_url_cache = LRUCache(
+        settings.CONTENT_APP_PATH_CACHE_SIZE, ttl=signed_url_ttl(default_storage)
+    )
+
+
+def preload_publication(publication):
+    """
+    Add every path published by a complete publication to the `published_path_cache`.
+
+    Args:
+        publication (:class:`pulpcore.plugin.models.Publication`): The publication.
+
+    Returns:
+        int: The number of paths added.
+    """
+    count = 0
+    published_artifacts = publication.published_artifact.select_related(
+        'content_artifact__artifact')
+    for published_artifact in published_artifacts.iterator():
+        content_artifact = published_artifact.content_artifact
+        if content_artifact.artifact_id:
+            published_path_cache.set((publication.pk, published_artifact.relative_path),
+                                     content_artifact)
+            count += 1
+    for published_metadata in publication.published_metadata.iterator():
+        published_path_cache.set((publication.pk, published_metadata.relative_path),
+                                 published_metadata)
+        count += 1
+    return count
+
+
+def index_repository_version(repository_version):
+    """
+    Build the `repository_version_paths` index of a complete repository version.
+
+    Args:
+        repository_version (:class:`~pulpcore.plugin.models.RepositoryVersion`): The repository
+            version, or None.
+
+    Returns:
+        int: The number of paths indexed.
+    """
+    if repository_version_paths is None or repository_version is None \
+            or not repository_version.complete:
+        return 0
+    index = repository_version_paths.load(repository_version)
+    return len(index) if index is not None else 0
+
+
+def warm_up(hot_base_paths=()):
+    """
+    Preload the caches of the Content App in bulk.
+
+    All distributions are loaded into the `distribution_cache`. For the distributions with one of
+    `hot_base_paths`, the paths of the publication or repository version they serve are loaded as
+    well.
+
+    Args:
+        hot_base_paths (list): Base paths of the distributions to preload the paths of.
+
+    Returns:
+        dict: The number of distributions and paths loaded, and of repository version paths
+            indexed.
+    """
+    distributions = {}
+    if settings.CONTENT_APP_CACHE_REFRESH_INTERVAL:
+        distributions = distribution_cache.load(BaseDistribution)
+
+    paths = 0
+    indexed = 0
+    for base_path in hot_base_paths:
+        try:
+            distribution = distributions[base_path]
+        except KeyError:
+            distribution = BaseDistribution.objects.filter(base_path=base_path).first()
+            if distribution is None:
+                log.warning(_('Hot distribution {base_path} does not exist').format(
+                    base_path=base_path
+                ))
+                continue
+            distribution = distribution.cast()
+        publication = getattr(distribution, 'publication', None)
+        if publication is not None and publication.complete:
+            paths += preload_publication(publication)
+            if published_path_filters is not None:
+                published_path_filters.load(publication)
+            if publication.pass_through:
+                indexed += index_repository_version(publication.repository_version)
+        elif getattr(distribution, 'repository', None):
+            indexed += index_repository_version(RepositoryVersion.latest(distribution.repository))
+        elif getattr(distribution, 'repository_version', None):
+            indexed += index_repository_version(distribution.repository_version)
+
+    if paths > published_path_cache.max_size:
+        log.warning(_('The hot distributions publish {paths} paths, but the path cache holds only '
+                      '{size}. Consider raising CONTENT_APP_PATH_CACHE_SIZE.').format(
+            paths=paths, size=published_path_cache.max_size
+        ))
+    return {'distributions': len(distributions), 'paths': paths, 'indexed': indexed}
+
+
+streamed_cache = None
+if settings.CONTENT_APP_STREAMED_CACHE_SIZE:
+    streamed_cache = StreamedCache(
+        settings.CONTENT_APP_STREAMED_CACHE_DIR, settings.CONTENT_APP_STREAMED_CACHE_SIZE
+    )
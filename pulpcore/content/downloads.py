@@ -0,0 +1,668 @@
+"""
+Coordination of the on-demand downloads of the Content App.
+"""
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from gettext import gettext as _
+import hashlib
+import logging
+import ssl
+import tempfile
+import time
+
+import aiohttp
+from django.db import DatabaseError, connection, connections
+
+
+log = logging.getLogger(__name__)
+
+
+class InFlightDownloads:
+    """
+    Registry of the upstream downloads in progress, so concurrent requests can share one.
+
+    The first request for a remote file leads the download and registers it with :meth:`start`.
+    Requests that arrive while it is in progress :meth:`wait` for it instead of starting their own,
+    and are served from the saved :class:`~pulpcore.plugin.models.Artifact` once it completes. When
+    the leading download does not produce an Artifact (e.g. when it fails), the waiting requests
+    download the file themselves. Downloads of ``streamed`` remotes never produce one, so they are
+    not registered at all.
+
+    Downloads are keyed by the :class:`~pulpcore.plugin.models.RemoteArtifact` they fetch, see
+    :meth:`key`.
+    """
+
+    def __init__(self):
+        self._downloads = {}
+
+    @staticmethod
+    def key(remote_artifact):
+        """
+        Args:
+            remote_artifact (:class:`~pulpcore.plugin.models.RemoteArtifact`): A remote artifact,
+                saved or not.
+
+        Returns:
+            tuple: The key identifying the downloads of `remote_artifact`.
+        """
+        return (remote_artifact.remote_id, remote_artifact.url)
+
+    def __contains__(self, key):
+        return key in self._downloads
+
+    def start(self, key):
+        """
+        Register a download as in progress, unless another one already is.
+
+        Args:
+            key (tuple): The key of the download.
+
+        Returns:
+            bool: True if the caller leads the download and must call :meth:`finish`.
+        """
+        if key in self._downloads:
+            return False
+        self._downloads[key] = asyncio.get_event_loop().create_future()
+        return True
+
+    def finish(self, key, artifact=None):
+        """
+        Unregister a download and hand its result to the requests waiting for it.
+
+        Args:
+            key (tuple): The key of the download.
+            artifact (:class:`~pulpcore.plugin.models.Artifact`): The saved artifact, or None if
+                none was saved.
+        """
+        future = self._downloads.pop(key)
+        future.set_result(artifact)
+
+    async def wait(self, key):
+        """
+        Wait for the download in progress to finish.
+
+        Args:
+            key (tuple): The key of the download.
+
+        Returns:
+            :class:`~pulpcore.plugin.models.Artifact` saved by the download, or None if there is no
+                download in progress or it saved no artifact.
+        """
+        future = self._downloads.get(key)
+        if future is None:
+            return None
+        # Shielded, so a waiting client that goes away doesn't cancel it for everybody else.
+        return await asyncio.shield(future)
+
+
+in_flight_downloads = InFlightDownloads()
+
+
+class RemoteSessions:
+    """
+    Shared instances of the remotes downloaded from, each with an HTTP session that is reused.
+
+    The session of a :class:`~pulpcore.plugin.models.Remote` is built here from the remote: its
+    connections are limited to `download_concurrency`, kept alive between downloads, and use the
+    TLS settings of the remote. The downloaders built by :meth:`get_downloader` use it instead of
+    the session of the download factory, and are sent through the proxy of the remote.
+    Downloading with the same remote instance for every request reuses the connections of the
+    session instead of connecting to the upstream (and doing a TLS handshake) again.
+
+    A remote is replaced by a new instance, with a new session, when it has been changed. The
+    session of the old instance is closed once the downloads using it are done.
+    """
+
+    # The timeouts of the sessions, large files take long to download.
+    TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=600, sock_read=600)
+
+    def __init__(self):
+        self._remotes = {}
+        # Model instances compare equal by primary key, so instances in use and their sessions are
+        # tracked by id.
+        self._users = {}
+        self._sessions = {}
+
+    def acquire(self, remote):
+        """
+        Get the shared instance of a remote to download with, and register it as in use.
+
+        Args:
+            remote (detail of :class:`~pulpcore.plugin.models.Remote`): The remote as loaded from
+                the database.
+
+        Returns:
+            detail of :class:`~pulpcore.plugin.models.Remote`: The shared instance of `remote`,
+                which must be given back to :meth:`release` once the download is done.
+        """
+        shared = self._remotes.get(remote.pk)
+        if shared is None or shared._last_updated != remote._last_updated:
+            if shared is not None and not self._users.get(id(shared)):
+                self._close(shared)
+            shared = self._remotes[remote.pk] = remote
+        self._users[id(shared)] = self._users.get(id(shared), 0) + 1
+        return shared
+
+    def release(self, remote):
+        """
+        Register a download with a shared remote instance as done.
+
+        Args:
+            remote (detail of :class:`~pulpcore.plugin.models.Remote`): The instance returned by
+                :meth:`acquire`.
+        """
+        self._users[id(remote)] -= 1
+        if not self._users[id(remote)]:
+            del self._users[id(remote)]
+            if self._remotes.get(remote.pk) is not remote:
+                self._close(remote)
+
+    def get_downloader(self, remote, **kwargs):
+        """
+        Build a downloader of a shared remote that uses the session of the remote.
+
+        Args:
+            remote (detail of :class:`~pulpcore.plugin.models.Remote`): The instance returned by
+                :meth:`acquire`.
+            kwargs (dict): Passed on to `remote.get_downloader()`.
+
+        Returns:
+            The downloader built by the download factory of `remote`. HTTP downloaders use the
+                session of `remote`.
+        """
+        downloader = remote.get_downloader(**kwargs)
+        factory_session = getattr(downloader, 'session', None)
+        if not isinstance(factory_session, aiohttp.ClientSession):
+            return downloader
+        session = self._sessions.get(id(remote))
+        if session is None:
+            session = self._sessions[id(remote)] = self._make_session(remote)
+            # The download factory of the shared instance builds no other downloaders.
+            run_in_background(factory_session.close())
+        downloader.session = session
+        downloader.proxy = remote.proxy_url or None
+        return downloader
+
+    @classmethod
+    def _make_session(cls, remote):
+        """
+        Build the HTTP session of a remote.
+
+        Args:
+            remote (detail of :class:`~pulpcore.plugin.models.Remote`): The remote.
+
+        Returns:
+            :class:`aiohttp.ClientSession`: The session.
+        """
+        connector = aiohttp.TCPConnector(limit=remote.download_concurrency or 0,
+                                         ssl=cls._make_ssl_context(remote))
+        return aiohttp.ClientSession(connector=connector, timeout=cls.TIMEOUT)
+
+    @staticmethod
+    def _make_ssl_context(remote):
+        """
+        Build the TLS settings of a remote.
+
+        Args:
+            remote (detail of :class:`~pulpcore.plugin.models.Remote`): The remote.
+
+        Returns:
+            :class:`ssl.SSLContext`: Validating the upstream with the CA certificate of the remote,
+                if it has one, and authenticating with its client certificate.
+        """
+        context = ssl.create_default_context()
+        if remote.ssl_ca_certificate:
+            context.load_verify_locations(cadata=remote.ssl_ca_certificate)
+        if remote.ssl_client_certificate:
+            # Certificates can only be loaded from files.
+            with tempfile.NamedTemporaryFile('w') as certificate, \
+                    tempfile.NamedTemporaryFile('w') as key:
+                certificate.write(remote.ssl_client_certificate)
+                certificate.flush()
+                if remote.ssl_client_key:
+                    key.write(remote.ssl_client_key)
+                    key.flush()
+                context.load_cert_chain(certificate.name,
+                                        key.name if remote.ssl_client_key else None)
+        if not remote.ssl_validation:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        return context
+
+    async def close(self):
+        """
+        Close the sessions of all shared remotes.
+        """
+        sessions, self._sessions = self._sessions, {}
+        self._remotes = {}
+        self._users.clear()
+        for session in sessions.values():
+            await session.close()
+
+    def _close(self, remote):
+        session = self._sessions.pop(id(remote), None)
+        if session is not None:
+            run_in_background(session.close())
+
+
+remote_sessions = RemoteSessions()
+
+
+class UpstreamSlots:
+    """
+    The download slots of one remote.
+
+    Unlike an :class:`asyncio.Semaphore`, the number of slots can change while slots are taken,
+    and the slots taken before still count against the new limit.
+
+    Args:
+        limit (int): The number of slots.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.taken = 0
+        self._waiters = deque()
+
+    def resize(self, limit):
+        """
+        Change the number of slots.
+
+        Args:
+            limit (int): The new number of slots.
+        """
+        self.limit = limit
+        self._wake()
+
+    async def acquire(self, timeout=None):
+        """
+        Wait for a free slot and take it.
+
+        Args:
+            timeout (float): The maximum number of seconds to wait, or None to wait indefinitely.
+
+        Raises:
+            asyncio.TimeoutError: When no slot became free within `timeout`.
+        """
+        if self.taken < self.limit and not self._waiters:
+            self.taken += 1
+            return
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except BaseException:
+            if waiter.done():
+                # The slot was handed over as the wait timed out or was cancelled.
+                self.release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self):
+        """
+        Give back a slot taken by :meth:`acquire`.
+        """
+        self.taken -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.taken < self.limit:
+            self.taken += 1
+            self._waiters.popleft().set_result(None)
+
+
+class UpstreamLimiter:
+    """
+    Limits the concurrent downloads from each remote to its `download_concurrency`.
+
+    Downloads beyond the limit wait for a slot to become free. A `download_concurrency` of 0 does
+    not limit the downloads. When `download_concurrency` changes, the downloads in progress count
+    against the new limit.
+    """
+
+    def __init__(self):
+        self._slots = {}
+
+    def _remote_slots(self, remote):
+        limit = remote.download_concurrency
+        slots = self._slots.get(remote.pk)
+        if not limit:
+            return None
+        if slots is None:
+            slots = self._slots[remote.pk] = UpstreamSlots(limit)
+        elif slots.limit != limit:
+            slots.resize(limit)
+        return slots
+
+    async def acquire(self, remote, timeout=None):
+        """
+        Wait for a slot to download from a remote.
+
+        Args:
+            remote (detail of :class:`~pulpcore.plugin.models.Remote`): The remote.
+            timeout (float): The maximum number of seconds to wait, or None to wait indefinitely.
+
+        Returns:
+            The slot, which must be given back to :meth:`release` once the download is done.
+
+        Raises:
+            asyncio.TimeoutError: When no slot became free within `timeout`.
+        """
+        slots = self._remote_slots(remote)
+        if slots is not None:
+            await slots.acquire(timeout)
+        return slots
+
+    @staticmethod
+    def release(slot):
+        """
+        Give back a slot returned by :meth:`acquire`.
+
+        Args:
+            slot: The slot.
+        """
+        if slot is not None:
+            slot.release()
+
+
+upstream_limiter = UpstreamLimiter()
+
+
+class RemoteRanking:
+    """
+    Ranks remotes by the latency and error rate of the downloads from them.
+
+    Both are tracked as exponentially weighted moving averages, so recent downloads count the most.
+    The latency of a download is the time until the headers of the upstream response arrived.
+
+    Args:
+        weight (float): The weight of the latest download in the averages.
+        error_penalty (float): How much an error rate of 1 multiplies the latency of a remote by.
+    """
+
+    def __init__(self, weight=0.2, error_penalty=10):
+        self.weight = weight
+        self.error_penalty = error_penalty
+        self._latencies = {}
+        self._error_rates = {}
+
+    def _update(self, averages, remote_id, value):
+        previous = averages.get(remote_id)
+        if previous is None:
+            averages[remote_id] = value
+        else:
+            averages[remote_id] = previous + self.weight * (value - previous)
+
+    def success(self, remote_id, latency):
+        """
+        Record a download that received the headers of the upstream response.
+
+        Args:
+            remote_id (int): The primary key of the remote.
+            latency (float): The seconds until the headers arrived.
+        """
+        self._update(self._latencies, remote_id, latency)
+        self._update(self._error_rates, remote_id, 0)
+
+    def failure(self, remote_id):
+        """
+        Record a download that failed.
+
+        Args:
+            remote_id (int): The primary key of the remote.
+        """
+        self._update(self._error_rates, remote_id, 1)
+
+    def score(self, remote_id):
+        """
+        Args:
+            remote_id (int): The primary key of the remote.
+
+        Returns:
+            float: The expected latency of the remote, penalized by its error rate. Lower is
+                better. Remotes without downloads yet score 0, so they are tried.
+        """
+        latency = self._latencies.get(remote_id, 0)
+        error_rate = self._error_rates.get(remote_id, 0)
+        if not latency and error_rate:
+            # Remotes that only failed so far rank behind the ones that responded.
+            latency = max(self._latencies.values(), default=1)
+        return latency * (1 + self.error_penalty * error_rate)
+
+    def sort(self, remote_artifacts):
+        """
+        Sort remote artifacts by the score of their remotes, best first.
+
+        Args:
+            remote_artifacts (list): Of :class:`~pulpcore.plugin.models.RemoteArtifact`.
+
+        Returns:
+            list: The sorted remote artifacts.
+        """
+        return sorted(remote_artifacts, key=lambda ra: self.score(ra.remote_id))
+
+
+remote_ranking = RemoteRanking()
+
+
+class PullThroughClaims:
+    """
+    Claims on saving the files downloaded on-demand, shared by all Content App processes.
+
+    :class:`InFlightDownloads` makes the requests of one process share a download. Processes
+    don't see each other's downloads though, so a popular file requested from many processes at
+    once would be downloaded and saved by each of them, and all but one save would fail on the
+    unique constraints of the database. Instead, a process has to :meth:`claim` a download before
+    it saves its result. Only the process holding the claim saves the artifact, the others
+    :meth:`wait` for it to be saved, or stream the file without saving it.
+
+    Claims are PostgreSQL session-level advisory locks keyed by a hash of the download key. They
+    are taken on the connection of a dedicated thread, since a session lock must be released on
+    the connection that holds it. A claim of a process that dies is released with its connection.
+    With other databases every claim succeeds.
+
+    Whether a claim was released is checked by polling, with an interval that doubles from
+    :attr:`POLL_INTERVAL` up to :attr:`MAX_POLL_INTERVAL`. All requests of a process waiting for
+    the same claim share one check.
+    """
+
+    # The number of seconds between the first checks whether a claim of another process was
+    # released, and the most the interval grows to.
+    POLL_INTERVAL = 0.05
+    MAX_POLL_INTERVAL = 1
+
+    def __init__(self):
+        self._executor = None
+        # Session locks are reentrant, so the claims held by this process are tracked as well.
+        self._held = set()
+        # The check of each claim waited for, and the deadline of the longest wait.
+        self._polls = {}
+
+    @staticmethod
+    def lock_id(key):
+        """
+        Args:
+            key (tuple): The key of a download, see :meth:`InFlightDownloads.key`.
+
+        Returns:
+            int: The signed 64-bit id of the advisory lock of `key`.
+        """
+        digest = hashlib.sha256('{0} {1}'.format(*key).encode()).digest()
+        return int.from_bytes(digest[:8], 'big', signed=True)
+
+    async def _run(self, func, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1,
+                                                thread_name_prefix='pulp-content-claims')
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
+
+    @staticmethod
+    def _query(sql, lock_id):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [lock_id])
+            return cursor.fetchone()[0]
+
+    @classmethod
+    def _execute(cls, sql, lock_id):
+        if connection.vendor != 'postgresql':
+            return True
+        # The connection holds the claims, so unlike the connections of requests it is not closed
+        # after CONN_MAX_AGE. It is only replaced once it broke, which released its claims anyway.
+        try:
+            return cls._query(sql, lock_id)
+        except DatabaseError:
+            if connection.connection is not None and connection.is_usable():
+                raise
+            connection.close()
+        return cls._query(sql, lock_id)
+
+    @classmethod
+    def _is_free(cls, lock_id):
+        if not cls._execute('SELECT pg_try_advisory_lock(%s)', lock_id):
+            return False
+        cls._execute('SELECT pg_advisory_unlock(%s)', lock_id)
+        return True
+
+    async def claim(self, key):
+        """
+        Claim saving the result of a download.
+
+        If the database can't be reached the claim succeeds, so the download is saved like without
+        claims.
+
+        Args:
+            key (tuple): The key of the download.
+
+        Returns:
+            bool: True if the caller holds the claim and must :meth:`release` it.
+        """
+        if key in self._held:
+            return False
+        self._held.add(key)
+        try:
+            claimed = await self._run(self._execute, 'SELECT pg_try_advisory_lock(%s)',
+                                      self.lock_id(key))
+        except DatabaseError:
+            log.warning(_('Claiming the download of {url} failed').format(url=key[1]),
+                        exc_info=True)
+            claimed = True
+        except BaseException:
+            self._held.discard(key)
+            raise
+        if not claimed:
+            self._held.discard(key)
+        return claimed
+
+    async def release(self, key):
+        """
+        Release a claim.
+
+        Args:
+            key (tuple): The key of the download.
+        """
+        try:
+            await self._run(self._execute, 'SELECT pg_advisory_unlock(%s)', self.lock_id(key))
+        except DatabaseError:
+            log.warning(_('Releasing the claim on {url} failed').format(url=key[1]),
+                        exc_info=True)
+        finally:
+            self._held.discard(key)
+
+    async def wait(self, key, timeout):
+        """
+        Wait for the claim of a download to be released.
+
+        Args:
+            key (tuple): The key of the download.
+            timeout (float): The maximum number of seconds to wait.
+
+        Returns:
+            bool: True if the claim was released, False if it is still held after `timeout`.
+        """
+        deadline = time.monotonic() + timeout
+        poll = self._polls.get(key)
+        if poll is None:
+            poll = self._polls[key] = [asyncio.ensure_future(self._poll(key)), deadline]
+        else:
+            poll[1] = max(poll[1], deadline)
+        try:
+            # Shielded, so the check goes on for the other requests waiting for it.
+            return await asyncio.wait_for(asyncio.shield(poll[0]), timeout)
+        except asyncio.TimeoutError:
+            return False
+
+    async def _poll(self, key):
+        """
+        Check whether a claim was released until the deadline of the longest wait for it.
+
+        Args:
+            key (tuple): The key of the download.
+
+        Returns:
+            bool: True if the claim was released, False if it is still held at the deadline.
+        """
+        interval = self.POLL_INTERVAL
+        try:
+            while True:
+                try:
+                    if key not in self._held and await self._run(self._is_free,
+                                                                 self.lock_id(key)):
+                        return True
+                except DatabaseError:
+                    log.warning(_('Checking the claim on {url} failed').format(url=key[1]),
+                                exc_info=True)
+                    return False
+                remaining = self._polls[key][1] - time.monotonic()
+                if remaining <= 0:
+                    return False
+                await asyncio.sleep(min(interval, remaining))
+                interval = min(interval * 2, self.MAX_POLL_INTERVAL)
+        finally:
+            del self._polls[key]
+
+    async def close(self):
+        """
+        Close the database connection of the claims, which releases all claims still held.
+        """
+        for future, deadline in list(self._polls.values()):
+            future.cancel()
+        if self._executor is None:
+            return
+        await self._run(connections.close_all)
+        self._executor.shutdown()
+        self._executor = None
+        self._held.clear()
+
+
+pull_through_claims = PullThroughClaims()
+
+_background_tasks = set()
+
+
+def run_in_background(coro):
+    """
+    Run a coroutine in a task that outlives the request that started it.
+
+    Args:
+        coro (coroutine): The coroutine to run.
+
+    Returns:
+        :class:`asyncio.Task`: The task running `coro`.
+    """
+    task = asyncio.ensure_future(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def wait_for_background_tasks():
+    """
+    Wait for all tasks started by :func:`run_in_background` to finish.
+    """
+    if _background_tasks:
+        await asyncio.wait(set(_background_tasks))
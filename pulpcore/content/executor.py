@@ -0,0 +1,97 @@
+"""
+A thread pool for the database access of the Content App.
+
+The Django ORM is synchronous. Calling it from a coroutine blocks the event loop, and with it every
+other request served by the same process, for as long as the query runs. The Content App runs its
+database access through :func:`run_in_database_thread` instead, so a slow query only delays the
+request that needs it.
+
+Each thread of the pool keeps its own database connection, so the size of the pool, set by
+``CONTENT_APP_DATABASE_THREADS``, is also the number of connections a Content App process opens.
+A connection that broke is closed after the call that noticed it, and the next call reconnects.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import threading
+
+from django.conf import settings
+from django.db import connections
+
+
+_executor = None
+
+
+def get_executor():
+    """
+    Get the thread pool executor used for database access, creating it on first use.
+
+    Returns:
+        :class:`concurrent.futures.ThreadPoolExecutor`: The executor.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.CONTENT_APP_DATABASE_THREADS,
+            thread_name_prefix='pulp-content-db',
+        )
+    return _executor
+
+
+async def run_in_database_thread(func, *args, **kwargs):
+    """
+    Call a function that accesses the database in the database thread pool.
+
+    Args:
+        func (callable): The function to call.
+        args (tuple): Positional arguments for `func`.
+        kwargs (dict): Keyword arguments for `func`.
+
+    Returns:
+        The return value of `func`.
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(get_executor(), partial(_call, func, *args, **kwargs))
+
+
+def _call(func, *args, **kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_broken_connections()
+
+
+def close_broken_connections():
+    """
+    Close the database connections of the current thread that broke.
+
+    Django does this at the end of every request, together with closing connections older than
+    ``CONN_MAX_AGE``. The threads of the pool keep their connections across calls though, so only
+    the connections that had an error and don't work anymore are closed.
+    """
+    for connection in connections.all():
+        if connection.connection is None or not connection.errors_occurred:
+            continue
+        if connection.is_usable():
+            connection.errors_occurred = False
+        else:
+            connection.close()
+
+
+async def close_database_connections():
+    """
+    Close the database connections held by the threads of the database thread pool.
+
+    Connections belong to the thread that opened them, so every thread has to close its own. A
+    barrier makes sure each of the closing calls occupies a different thread.
+    """
+    if _executor is None:
+        return
+    workers = settings.CONTENT_APP_DATABASE_THREADS
+    barrier = threading.Barrier(workers)
+
+    def close():
+        barrier.wait()
+        connections.close_all()
+
+    await asyncio.gather(*(run_in_database_thread(close) for _ in range(workers)))
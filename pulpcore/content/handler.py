@@ -1,13 +1,22 @@
+import asyncio
+from functools import partial
 import logging
+import math
 import os
+import time
 from gettext import gettext as _
 
 import django  # noqa otherwise E402: module level not at top of file
 django.setup()  # noqa otherwise E402: module level not at top of file
 
-from aiohttp.client_exceptions import ClientResponseError
-from aiohttp.web import FileResponse, StreamResponse
-from aiohttp.web_exceptions import HTTPForbidden, HTTPFound, HTTPNotFound
+from aiohttp.client_exceptions import ClientError
+from aiohttp.web import StreamResponse
+from aiohttp.web_exceptions import (
+    HTTPException,
+    HTTPForbidden,
+    HTTPNotFound,
+    HTTPServiceUnavailable,
+)
 from django.conf import settings
 from django.core.exceptions import MultipleObjectsReturned, ObjectDoesNotExist
 from django.db import IntegrityError, transaction
@@ -15,14 +24,41 @@ from pulpcore.app.models import (
     Artifact,
     BaseDistribution,
     ContentArtifact,
+    PublishedMetadata,
     Remote,
     RemoteArtifact,
     RepositoryVersion,
 )
 
+from .cache import (
+    distribution_cache,
+    permit_cache,
+    published_path_cache,
+    published_path_filters,
+    repository_version_paths,
+    streamed_cache,
+)
+from .downloads import (
+    in_flight_downloads,
+    pull_through_claims,
+    remote_ranking,
+    remote_sessions,
+    run_in_background,
+    upstream_limiter,
+)
+from .executor import run_in_database_thread
+from . import metrics
+from .response import ArtifactResponse
+from .serving import serving_strategy
+
 
 log = logging.getLogger(__name__)
 
+NOT_CACHED = object()
+
+# Errors of a download after which the next remote artifact of a content artifact is tried.
+FAILOVER_ERRORS = (ClientError, asyncio.TimeoutError)
+
 
 class PathNotResolved(HTTPNotFound):
     """
@@ -45,6 +81,13 @@ class ArtifactNotFound(Exception):
     pass
 
 
+class HedgeLost(Exception):
+    """
+    Another hedged download of the same content artifact is already streaming the response.
+    """
+    pass
+
+
 class Handler:
     """
     A default Handler for the Content App that also can be subclassed to create custom handlers.
@@ -94,7 +137,24 @@ class Handler:
                 back to the client.
         """
         path = request.match_info['path']
-        return await self._match_and_stream(path, request)
+        start = request[metrics.REQUEST_START] = time.monotonic()
+        try:
+            return await self._match_and_stream(path, request)
+        except HTTPException as exc:
+            if exc.status == HTTPNotFound.status_code:
+                request[metrics.OUTCOME] = 'not_found'
+            elif exc.status == HTTPForbidden.status_code:
+                request[metrics.OUTCOME] = 'forbidden'
+            elif exc.status == HTTPServiceUnavailable.status_code:
+                request[metrics.OUTCOME] = 'unavailable'
+            raise
+        except Exception:
+            request[metrics.OUTCOME] = 'error'
+            raise
+        finally:
+            outcome = request.get(metrics.OUTCOME, 'unknown')
+            metrics.REQUESTS.inc(outcome=outcome)
+            metrics.REQUEST_DURATION.observe(time.monotonic() - start, outcome=outcome)
 
     @staticmethod
     def _base_paths(path):
@@ -122,6 +182,10 @@ class Handler:
         """
         Match a distribution using a list of base paths and return its detail object.
 
+        Distributions are matched against the in-memory distribution cache first. The database is
+        only queried for distributions that are not (yet) cached. Either way, the relations used to
+        serve the distribution are loaded, so serving it runs no queries on the event loop.
+
         Args:
             path (str): The path component of the URL.
 
@@ -132,18 +196,21 @@ class Handler:
             PathNotResolved: when not matched.
         """
         base_paths = cls._base_paths(path)
+        model_class = cls.distribution_model or BaseDistribution
+        if settings.CONTENT_APP_CACHE_REFRESH_INTERVAL:
+            distro = distribution_cache.get(model_class, base_paths)
+            if distro is not None:
+                return distro
         try:
-            if cls.distribution_model is None:
-                model_class = BaseDistribution
-                return BaseDistribution.objects.get(base_path__in=base_paths).cast()
-            else:
-                model_class = cls.distribution_model
-                return cls.distribution_model.objects.get(base_path__in=base_paths)
+            distro = distribution_cache.query(model_class, base_paths)
         except ObjectDoesNotExist:
             log.debug(_('{model_name} not matched for {path} using: {base_paths}').format(
                 model_name=model_class.__name__, path=path, base_paths=base_paths
             ))
             raise PathNotResolved(path)
+        if settings.CONTENT_APP_CACHE_REFRESH_INTERVAL:
+            distribution_cache.add(model_class, distro)
+        return distro
 
     @staticmethod
     def _permit(request, distribution):
@@ -151,6 +218,10 @@ class Handler:
         Permit the request.
 
         Authorization is delegated to the optional content-guard associated with the distribution.
+        Distributions in the distribution cache hold their content-guard already cast.
+
+        Guards can opt in to having their decisions cached for a credential fingerprint, see
+        :meth:`~pulpcore.plugin.models.ContentGuard.permit_cache_key`.
 
         Args:
             request (:class:`aiohttp.web.Request`): A request for a published file.
@@ -160,20 +231,109 @@ class Handler:
         Raises:
             :class:`aiohttp.web_exceptions.HTTPForbidden`: When not permitted.
         """
-        guard = distribution.content_guard
-        if not guard:
+        if not distribution.content_guard_id:
             return
-        try:
-            guard.cast().permit(request)
-        except PermissionError as pe:
+        guard = distribution.content_guard.cast()
+
+        key = None
+        if permit_cache is not None:
+            fingerprint = guard.permit_cache_key(request)
+            if fingerprint is not None:
+                key = (guard.pk, guard._last_updated, fingerprint)
+        reason = permit_cache.get(key, NOT_CACHED) if key else NOT_CACHED
+        if reason is NOT_CACHED:
+            try:
+                guard.permit(request)
+            except PermissionError as pe:
+                reason = str(pe)
+            else:
+                reason = None
+            if key:
+                permit_cache.set(key, reason)
+
+        if reason is not None:
             log.debug(
                 _('Path: %(p)s not permitted by guard: "%(g)s" reason: %(r)s'),
                 {
                     'p': request.path,
                     'g': guard.name,
-                    'r': str(pe)
+                    'r': reason
                 })
-            raise HTTPForbidden(reason=str(pe))
+            raise HTTPForbidden(reason=reason)
+
+    @staticmethod
+    def _is_not_published(distribution, publication, rel_path):
+        """
+        Check whether a publication definitely serves nothing at a relative path.
+
+        Complete publications are checked against their
+        :class:`~pulpcore.content.cache.PublishedPathFilters` filter. Paths missing from the filter
+        are not served, so they are answered without any query. Publications without a filter yet
+        are never ruled out, their filter is built in the background. Distributions with a remote,
+        a repository, or a repository version are never ruled out either, since the content app may
+        find the path there.
+
+        Args:
+            distribution (detail of :class:`pulpcore.plugin.models.BaseDistribution`): The matched
+                distribution.
+            publication (:class:`~pulpcore.plugin.models.Publication`): The publication it serves.
+            rel_path (str): The path relative to the distribution's base path.
+
+        Returns:
+            bool: True if `publication` does not serve `rel_path`, False if it might.
+        """
+        if published_path_filters is None or not publication.complete:
+            return False
+        if distribution.remote_id or getattr(distribution, 'repository_id', None) \
+                or getattr(distribution, 'repository_version_id', None):
+            return False
+        paths = published_path_filters.get(publication)
+        return paths is not None and rel_path not in paths
+
+    @staticmethod
+    def _match_published(publication, rel_path):
+        """
+        Match a relative path against the files published by a publication.
+
+        The published artifacts are searched first, then the published metadata. The repository
+        version of pass-through publications is not searched, see :meth:`_match_content_artifact`.
+
+        Complete publications are immutable, so the results for them are cached (including when
+        nothing matched). Content artifacts that still need to be downloaded are not cached,
+        since they are expected to change once they are.
+
+        Args:
+            publication (:class:`pulpcore.plugin.models.Publication`): The publication served by
+                the distribution.
+            rel_path (str): The path relative to the distribution's base path.
+
+        Returns:
+            :class:`~pulpcore.plugin.models.ContentArtifact` or
+                :class:`~pulpcore.plugin.models.PublishedMetadata` published at `rel_path`, or None
+                when nothing is.
+        """
+        key = (publication.pk, rel_path)
+        published = published_path_cache.get(key, NOT_CACHED)
+        if published is not NOT_CACHED:
+            return published
+
+        published = None
+        try:
+            # published artifact
+            pa = publication.published_artifact.select_related(
+                'content_artifact__artifact').get(relative_path=rel_path)
+            published = pa.content_artifact
+        except ObjectDoesNotExist:
+            try:
+                # published metadata
+                published = publication.published_metadata.get(relative_path=rel_path)
+            except ObjectDoesNotExist:
+                pass
+
+        downloaded = not isinstance(published, ContentArtifact) or published.artifact_id
+        if publication.complete and downloaded:
+            published_path_cache.set(key, published)
+        return published
 
     async def _match_and_stream(self, path, request):
         """
@@ -191,8 +351,10 @@ class Handler:
             :class:`aiohttp.web.StreamResponse` or :class:`aiohttp.web.FileResponse`: The response
                 streamed back to the client.
         """
-        distro = self._match_distribution(path)
-        self._permit(request, distro)
+        with metrics.stage('distribution_match'):
+            distro = await run_in_database_thread(self._match_distribution, path)
+        with metrics.stage('guard_check'):
+            await run_in_database_thread(self._permit, request, distro)
 
         rel_path = path.lstrip('/')
         rel_path = rel_path[len(distro.base_path):]
@@ -201,91 +363,155 @@ class Handler:
         publication = getattr(distro, 'publication', None)
 
         if publication:
-            # published artifact
-            try:
-                pa = publication.published_artifact.get(relative_path=rel_path)
-                ca = pa.content_artifact
-            except ObjectDoesNotExist:
-                pass
-            else:
-                if ca.artifact:
-                    return self._handle_file_response(ca.artifact.file)
-                else:
-                    return await self._stream_content_artifact(request, StreamResponse(), ca)
-
-            # published metadata
-            try:
-                pm = publication.published_metadata.get(relative_path=rel_path)
-            except ObjectDoesNotExist:
-                pass
-            else:
-                return self._handle_file_response(pm.file)
-
-            # pass-through
-            if publication.pass_through:
-                try:
-                    ca = ContentArtifact.objects.get(
-                        content__in=publication.repository_version.content,
-                        relative_path=rel_path)
-                except MultipleObjectsReturned:
-                    log.error(
-                        _('Multiple (pass-through) matches for {b}/{p}'),
-                        {
-                            'b': distro.base_path,
-                            'p': rel_path,
-                        }
+            if self._is_not_published(distro, publication, rel_path):
+                raise PathNotResolved(path)
+            outcome = 'published_artifact'
+            with metrics.stage('database_lookup'):
+                published = await run_in_database_thread(
+                    self._match_published, publication, rel_path
+                )
+                if published is None and publication.pass_through:
+                    outcome = 'pass_through'
+                    published = await run_in_database_thread(
+                        self._match_content_artifact, distro, publication.repository_version,
+                        rel_path
                     )
-                    raise
-                except ObjectDoesNotExist:
-                    pass
+            if isinstance(published, PublishedMetadata):
+                request[metrics.OUTCOME] = 'published_metadata'
+                return await self._handle_file_response(
+                    request, published.file, encodings=settings.PUBLISHED_METADATA_COMPRESSION
+                )
+            elif published is not None:
+                request[metrics.OUTCOME] = outcome
+                artifact = published.artifact
+                if artifact:
+                    return await self._handle_file_response(request, artifact.file,
+                                                            sha256=artifact.sha256)
                 else:
-                    if ca.artifact:
-                        return self._handle_file_response(ca.artifact.file)
-                    else:
-                        return await self._stream_content_artifact(request, StreamResponse(), ca)
+                    return await self._stream_content_artifact(request, StreamResponse(),
+                                                               published)
 
         repo_version = getattr(distro, 'repository_version', None)
         repository = getattr(distro, 'repository', None)
 
         if repository or repo_version:
-            if repository:
-                repo_version = RepositoryVersion.latest(distro.repository)
-
-            try:
-                ca = ContentArtifact.objects.get(
-                    content__in=repo_version.content,
-                    relative_path=rel_path)
-            except MultipleObjectsReturned:
-                log.error(
-                    _('Multiple (pass-through) matches for {b}/{p}'),
-                    {
-                        'b': distro.base_path,
-                        'p': rel_path,
-                    }
+            with metrics.stage('database_lookup'):
+                ca = await run_in_database_thread(
+                    self._match_repository_version, distro, rel_path
                 )
-                raise
-            except ObjectDoesNotExist:
-                pass
-            else:
-                return self._handle_file_response(ca.artifact.file)
+            if ca:
+                request[metrics.OUTCOME] = 'repository_version'
+                return await self._handle_file_response(request, ca.artifact.file,
+                                                        sha256=ca.artifact.sha256)
 
         if distro.remote:
-            remote = distro.remote.cast()
-            try:
-                url = remote.get_remote_artifact_url(rel_path)
-                ra = RemoteArtifact.objects.get(remote=remote, url=url)
-                ca = ra.content_artifact
-                if ca.artifact:
-                    return self._handle_file_response(ca.artifact.file)
-                else:
-                    return await self._stream_content_artifact(request, StreamResponse(), ca)
-            except ObjectDoesNotExist:
-                ca = ContentArtifact(relative_path=rel_path)
-                ra = RemoteArtifact(remote=remote, url=url, content_artifact=ca)
+            request[metrics.OUTCOME] = 'remote'
+            with metrics.stage('database_lookup'):
+                ra = await run_in_database_thread(self._match_remote_artifact, distro, rel_path)
+            if ra._state.adding:
                 return await self._stream_remote_artifact(request, StreamResponse(), ra)
+            ca = ra.content_artifact
+            if ca.artifact:
+                return await self._handle_file_response(request, ca.artifact.file,
+                                                        sha256=ca.artifact.sha256)
+            else:
+                return await self._stream_content_artifact(request, StreamResponse(), ca)
 
         raise PathNotResolved(path)
 
+    @classmethod
+    def _match_repository_version(cls, distribution, rel_path):
+        """
+        Match a relative path against the content of the repository version of a distribution.
+
+        Args:
+            distribution (detail of :class:`pulpcore.plugin.models.BaseDistribution`): The matched
+                distribution. If it has a `repository`, its latest version is used, otherwise its
+                `repository_version`.
+            rel_path (str): The path relative to the distribution's base path.
+
+        Returns:
+            :class:`~pulpcore.plugin.models.ContentArtifact` at `rel_path`, or None when there is
+                none.
+        """
+        if getattr(distribution, 'repository', None):
+            repo_version = RepositoryVersion.latest(distribution.repository)
+        else:
+            repo_version = distribution.repository_version
+        if repo_version is None:
+            return None
+        return cls._match_content_artifact(distribution, repo_version, rel_path)
+
+    @staticmethod
+    def _match_content_artifact(distribution, repo_version, rel_path):
+        """
+        Match a relative path against the content artifacts of a repository version.
+
+        Complete repository versions are matched using the in-memory
+        :class:`~pulpcore.content.cache.RepositoryVersionPaths` index, so a match costs a single
+        lookup by primary key and a miss costs no query at all. Versions that are not indexed yet
+        are matched with a join while their index is built in the background.
+
+        Args:
+            distribution (detail of :class:`pulpcore.plugin.models.BaseDistribution`): The matched
+                distribution.
+            repo_version (:class:`~pulpcore.plugin.models.RepositoryVersion`): The repository
+                version to search.
+            rel_path (str): The path relative to the distribution's base path.
+
+        Returns:
+            :class:`~pulpcore.plugin.models.ContentArtifact` at `rel_path`, or None when there is
+                none.
+        """
+        try:
+            if repo_version.complete and repository_version_paths is not None:
+                pk = repository_version_paths.match(repo_version, rel_path)
+                if pk is None:
+                    return None
+                if pk is not repository_version_paths.NOT_INDEXED:
+                    return ContentArtifact.objects.select_related('artifact').get(pk=pk)
+            return ContentArtifact.objects.select_related('artifact').get(
+                content__in=repo_version.content,
+                relative_path=rel_path)
+        except MultipleObjectsReturned:
+            log.error(
+                _('Multiple (pass-through) matches for {b}/{p}'),
+                {
+                    'b': distribution.base_path,
+                    'p': rel_path,
+                }
+            )
+            raise
+        except ObjectDoesNotExist:
+            return None
+
+    @staticmethod
+    def _match_remote_artifact(distribution, rel_path):
+        """
+        Match a relative path against the remote artifacts of the remote of a distribution.
+
+        Args:
+            distribution (detail of :class:`pulpcore.plugin.models.BaseDistribution`): The matched
+                distribution. It must have a `remote`.
+            rel_path (str): The path relative to the distribution's base path.
+
+        Returns:
+            :class:`~pulpcore.plugin.models.RemoteArtifact`: The remote artifact at `rel_path`. If
+                there is none yet, an unsaved one with an unsaved
+                :class:`~pulpcore.plugin.models.ContentArtifact` is returned.
+        """
+        remote = distribution.remote.cast()
+        url = remote.get_remote_artifact_url(rel_path)
+        try:
+            ra = RemoteArtifact.objects.select_related('content_artifact__artifact').get(
+                remote=remote, url=url)
+        except ObjectDoesNotExist:
+            ca = ContentArtifact(relative_path=rel_path)
+            ra = RemoteArtifact(remote=remote, url=url, content_artifact=ca)
+        else:
+            ra.remote = remote
+        return ra
+
     async def _stream_content_artifact(self, request, response, content_artifact):
         """
         Stream and optionally save a ContentArtifact by requesting it using the associated remote.
@@ -296,6 +522,10 @@ class Handler:
         :class:`~pulpcore.plugin.models.RemoteArtifact` downloads raise exceptions, an HTTP 502
         error is returned to the client.
 
+        The remote artifacts are tried in the order of the
+        :class:`~pulpcore.content.downloads.RemoteRanking` of their remotes. When
+        ``CONTENT_APP_HEDGE_DELAY`` is set, they are raced instead, see :meth:`_stream_hedged`.
+
         Args:
             request(:class:`~aiohttp.web.Request`): The request to prepare a response for.
             response (:class:`~aiohttp.web.StreamResponse`): The response to stream data to.
@@ -308,15 +538,89 @@ class Handler:
                 :class:`~pulpcore.plugin.models.ContentArtifact` returned the binary data needed for
                 the client.
         """
-        for remote_artifact in content_artifact.remoteartifact_set.all():
+        remote_artifacts = await run_in_database_thread(
+            list, content_artifact.remoteartifact_set.select_related('remote')
+        )
+        remote_artifacts = remote_ranking.sort(remote_artifacts)
+        if settings.CONTENT_APP_HEDGE_DELAY is not None and len(remote_artifacts) > 1:
+            return await self._stream_hedged(request, response, remote_artifacts)
+
+        for remote_artifact in remote_artifacts:
             try:
-                response = await self._stream_remote_artifact(request, response, remote_artifact)
+                return await self._stream_remote_artifact(request, response, remote_artifact)
 
-            except ClientResponseError:
+            except FAILOVER_ERRORS:
+                if response.prepared:
+                    raise
                 continue
 
         raise HTTPNotFound()
 
+    async def _stream_hedged(self, request, response, remote_artifacts):
+        """
+        Race the downloads of remote artifacts of the same content and stream the fastest one.
+
+        The first remote artifact is downloaded first. Whenever no download received the headers
+        of its upstream response within ``CONTENT_APP_HEDGE_DELAY`` seconds, or a download failed,
+        the download of the next remote artifact is started as well. The first download to receive
+        headers streams the response, the others are cancelled.
+
+        Args:
+            request(:class:`~aiohttp.web.Request`): The request to prepare a response for.
+            response (:class:`~aiohttp.web.StreamResponse`): The response to stream data to.
+            remote_artifacts (list): The :class:`~pulpcore.plugin.models.RemoteArtifact` objects
+                to download, in the order to try them.
+
+        Raises:
+            :class:`~aiohttp.web.HTTPNotFound` when all downloads failed.
+        """
+        delay = settings.CONTENT_APP_HEDGE_DELAY
+        claim = asyncio.get_event_loop().create_future()
+        remaining = iter(remote_artifacts)
+        attempts = {}
+
+        def start_next():
+            remote_artifact = next(remaining, None)
+            if remote_artifact is None:
+                return
+            task = asyncio.ensure_future(
+                self._stream_remote_artifact(request, response, remote_artifact, claim=claim)
+            )
+            # Retrieve the errors of the attempts that lost, so they are not logged as unhandled.
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            attempts[task] = remote_artifact
+
+        start_next()
+        try:
+            while attempts:
+                waiting = set(attempts)
+                if not claim.done():
+                    waiting.add(claim)
+                done, pending = await asyncio.wait(waiting, timeout=delay,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if claim.done():
+                    winner = next(task for task, remote_artifact in attempts.items()
+                                  if remote_artifact is claim.result())
+                    for task in attempts:
+                        if task is not winner:
+                            task.cancel()
+                    return await winner
+                if not done:
+                    start_next()
+                    continue
+                for task in done:
+                    del attempts[task]
+                    if task.exception() is None:
+                        # Served without downloading, e.g. from an artifact saved meanwhile.
+                        return task.result()
+                    if not isinstance(task.exception(), FAILOVER_ERRORS):
+                        raise task.exception()
+                    start_next()
+            raise HTTPNotFound()
+        finally:
+            for task in attempts:
+                task.cancel()
+
     def _save_artifact(self, download_result, remote_artifact):
         """
         Create/Get an Artifact and associate it to a RemoteArtifact and/or ContentArtifact.
@@ -384,39 +688,61 @@ class Handler:
                 content_artifact.save()
         return artifact
 
-    def _handle_file_response(self, file):
+    async def _handle_file_response(self, request, file, sha256=None, encodings=()):
         """
         Handle response for file.
 
-        Depending on where the file storage (e.g. filesystem, S3, etc) this could be responding with
-        the file (filesystem) or a redirect (S3).
+        Depending on ``CONTENT_APP_STORAGE_SERVING``, the file is sent from the filesystem,
+        redirected to, or streamed from the storage, see :mod:`pulpcore.content.serving`.
+
+        Files served from the filesystem support range, conditional and `HEAD` requests, see
+        :class:`~pulpcore.content.response.ArtifactResponse`.
 
         Args:
+            request(:class:`~aiohttp.web.Request`): The request for the file.
             file (:class:`django.db.models.fields.files.FieldFile`): File to respond with
+            sha256 (str): The SHA-256 digest of the file, used as its strong ETag, if known.
+            encodings (list): The content-codings of the precompressed variants the file may have.
 
         Raises:
             :class:`aiohttp.web_exceptions.HTTPFound`: When we need to redirect to the file
-            NotImplementedError: If file is stored in a file storage we can't handle
 
         Returns:
-            The :class:`aiohttp.web.FileResponse` for the file.
+            The :class:`~aiohttp.web.StreamResponse` for the file.
         """
-        if settings.DEFAULT_FILE_STORAGE == 'pulpcore.app.models.storage.FileSystem':
-            return FileResponse(os.path.join(settings.MEDIA_ROOT, file.name))
-        elif settings.DEFAULT_FILE_STORAGE == 'storages.backends.s3boto3.S3Boto3Storage':
-            raise HTTPFound(file.url)
-        else:
-            raise NotImplementedError()
+        return await serving_strategy.serve(request, file, sha256=sha256, encodings=encodings)
 
-    async def _stream_remote_artifact(self, request, response, remote_artifact):
+    async def _stream_remote_artifact(self, request, response, remote_artifact, claim=None):
         """
         Stream and save a RemoteArtifact.
 
+        Concurrent requests for the same RemoteArtifact share a single download. Requests arriving
+        while it is in progress wait for it and are served from the saved Artifact, see
+        :class:`~pulpcore.content.downloads.InFlightDownloads`. Downloads of ``streamed`` remotes
+        are not shared, since they don't save an Artifact to serve the waiting requests from.
+
+        Downloads from the same remote share its HTTP session and connections, see
+        :class:`~pulpcore.content.downloads.RemoteSessions`.
+
+        Files of ``streamed`` remotes with a known digest are kept in the local
+        :class:`~pulpcore.content.cache.StreamedCache`, when it is enabled, and served from there.
+
+        The digests of the data are computed by the downloader while it is streamed. The Artifact
+        is saved in the background once the download is complete, so saving it does not delay the
+        response. Only one Content App process saves the Artifact of a RemoteArtifact: the others
+        wait up to ``CONTENT_APP_PULL_THROUGH_WAIT`` seconds for it to be saved and serve it, or
+        stream the file without saving it, see
+        :class:`~pulpcore.content.downloads.PullThroughClaims`.
+
         Args:
             request(:class:`~aiohttp.web.Request`): The request to prepare a response for.
             response (:class:`~aiohttp.web.StreamResponse`): The response to stream data to.
             content_artifact (:class:`~pulpcore.plugin.models.ContentArtifact`): The ContentArtifact
                 to fetch and then stream back to the client
+            claim (:class:`asyncio.Future`): Shared by hedged downloads of the same content, see
+                :meth:`_stream_hedged`. The first download to receive headers sets its
+                RemoteArtifact as the result and streams the response, the others raise
+                :class:`HedgeLost`.
 
         Raises:
             :class:`~aiohttp.web.HTTPNotFound` when no
@@ -425,32 +751,232 @@ class Handler:
                 the client.
 
         """
-        remote = remote_artifact.remote.cast()
+        key = in_flight_downloads.key(remote_artifact)
+        remote = await run_in_database_thread(lambda: remote_artifact.remote.cast())
+        coalesce = remote.policy != Remote.STREAMED
+
+        if coalesce and key in in_flight_downloads:
+            artifact = await in_flight_downloads.wait(key)
+            if artifact is not None:
+                return await self._handle_file_response(request, artifact.file,
+                                                        sha256=artifact.sha256)
+
+        cache_writer = None
+        cache_key = None
+        if remote.policy == Remote.STREAMED and streamed_cache is not None:
+            cache_key = streamed_cache.key(remote_artifact)
+        if cache_key:
+            loop = asyncio.get_event_loop()
+            cached = await loop.run_in_executor(None, self._get_streamed_file, cache_key)
+            if cached:
+                return cached
+            cache_writer = await loop.run_in_executor(
+                None, partial(streamed_cache.writer, cache_key, sha256=remote_artifact.sha256)
+            )
+
+        # Only the process holding the claim saves the download, see PullThroughClaims.
+        save = False
+        if remote.policy != Remote.STREAMED:
+            save = await pull_through_claims.claim(key)
+            if not save:
+                artifact = await self._wait_for_saved_artifact(key, remote_artifact)
+                if artifact is not None:
+                    return await self._handle_file_response(request, artifact.file,
+                                                            sha256=artifact.sha256)
+                # The claim was released without saving the artifact, or is still held.
+                save = await pull_through_claims.claim(key)
 
         async def handle_headers(headers):
+            remote_ranking.success(remote.pk, time.monotonic() - start)
+            if claim is not None:
+                if claim.done():
+                    raise HedgeLost()
+                claim.set_result(remote_artifact)
             for name, value in headers.items():
                 if name.lower() in self.hop_by_hop_headers:
                     continue
                 response.headers[name] = value
+            if cache_writer:
+                cache_writer.content_type = headers.get('Content-Type')
             await response.prepare(request)
 
         async def handle_data(data):
             await response.write(data)
-            if remote.policy != Remote.STREAMED:
+            metrics.BYTES_SERVED.inc(len(data), outcome=request.get(metrics.OUTCOME, 'unknown'))
+            if save:
                 await original_handle_data(data)
+            elif cache_writer:
+                cache_writer.write(data)
 
         async def finalize():
-            if remote.policy != Remote.STREAMED:
+            if save:
                 await original_finalize()
-        downloader = remote.get_downloader(remote_artifact=remote_artifact,
-                                           headers_ready_callback=handle_headers)
-        original_handle_data = downloader.handle_data
-        downloader.handle_data = handle_data
-        original_finalize = downloader.finalize
-        downloader.finalize = finalize
-        download_result = await downloader.run()
+        shared_remote = remote_sessions.acquire(remote)
+        try:
+            slot = await self._acquire_upstream_slot(shared_remote)
+        except BaseException:
+            remote_sessions.release(shared_remote)
+            if cache_writer:
+                cache_writer.abort()
+            if save:
+                run_in_background(pull_through_claims.release(key))
+            raise
+        try:
+            downloader = remote_sessions.get_downloader(shared_remote,
+                                                        remote_artifact=remote_artifact,
+                                                        headers_ready_callback=handle_headers)
+            original_handle_data = downloader.handle_data
+            downloader.handle_data = handle_data
+            original_finalize = downloader.finalize
+            downloader.finalize = finalize
+
+            leader = coalesce and in_flight_downloads.start(key)
+            start = time.monotonic()
+            try:
+                download_result = await downloader.run()
+            except BaseException as exc:
+                metrics.UPSTREAM_DURATION.observe(time.monotonic() - start, result='error')
+                if isinstance(exc, FAILOVER_ERRORS):
+                    remote_ranking.failure(remote.pk)
+                if cache_writer:
+                    cache_writer.abort()
+                if leader:
+                    in_flight_downloads.finish(key)
+                if save:
+                    run_in_background(pull_through_claims.release(key))
+                raise
+        finally:
+            upstream_limiter.release(slot)
+            remote_sessions.release(shared_remote)
+        metrics.UPSTREAM_DURATION.observe(time.monotonic() - start, result='success')
+
+        # Saved even if the client goes away before the response is completed.
+        if save:
+            run_in_background(self._finalize_download(key, leader, download_result,
+                                                      remote_artifact))
+        elif leader:
+            in_flight_downloads.finish(key)
 
-        if remote.policy != Remote.STREAMED:
-            self._save_artifact(download_result, remote_artifact)
         await response.write_eof()
+
+        if cache_writer:
+            await asyncio.get_event_loop().run_in_executor(None, cache_writer.commit)
         return response
+
+    @staticmethod
+    def _get_streamed_file(key):
+        """
+        Prepare the response for a file of a ``streamed`` remote from the
+        :class:`~pulpcore.content.cache.StreamedCache`.
+
+        Args:
+            key (str): The key of the file in the cache.
+
+        Returns:
+            :class:`~pulpcore.content.response.ArtifactResponse` for the cached file, with the
+                `Content-Type` it was downloaded with, or None if the file is not cached.
+        """
+        path = streamed_cache.get(key)
+        if path is None:
+            return None
+        content_type = streamed_cache.content_type(path)
+        headers = {'Content-Type': content_type} if content_type else None
+        return ArtifactResponse(path, sha256=key, headers=headers)
+
+    async def _wait_for_saved_artifact(self, key, remote_artifact):
+        """
+        Wait for another process to save the artifact of a remote artifact it is downloading.
+
+        Args:
+            key (tuple): The key of the download, see
+                :class:`~pulpcore.content.downloads.PullThroughClaims`.
+            remote_artifact (:class:`~pulpcore.plugin.models.RemoteArtifact`): The remote artifact.
+
+        Returns:
+            :class:`~pulpcore.plugin.models.Artifact` saved by the other process, or None if it
+                was not saved within ``CONTENT_APP_PULL_THROUGH_WAIT`` seconds.
+        """
+        # Even if the wait timed out, the artifact may have been saved in the meantime.
+        await pull_through_claims.wait(key, settings.CONTENT_APP_PULL_THROUGH_WAIT)
+        return await run_in_database_thread(self._match_saved_artifact, remote_artifact)
+
+    @staticmethod
+    def _match_saved_artifact(remote_artifact):
+        """
+        Find the artifact saved for a remote artifact.
+
+        Args:
+            remote_artifact (:class:`~pulpcore.plugin.models.RemoteArtifact`): The remote artifact,
+                saved or not.
+
+        Returns:
+            :class:`~pulpcore.plugin.models.Artifact` of `remote_artifact`, or None if none was
+                saved.
+        """
+        if remote_artifact.sha256:
+            return Artifact.objects.filter(sha256=remote_artifact.sha256).first()
+        saved = RemoteArtifact.objects.select_related('content_artifact__artifact').filter(
+            remote_id=remote_artifact.remote_id,
+            url=remote_artifact.url,
+            content_artifact__artifact__isnull=False,
+        ).first()
+        return saved.content_artifact.artifact if saved else None
+
+    @staticmethod
+    async def _acquire_upstream_slot(remote):
+        """
+        Wait for a slot to download from a remote, see
+        :class:`~pulpcore.content.downloads.UpstreamLimiter`.
+
+        Args:
+            remote (detail of :class:`~pulpcore.plugin.models.Remote`): The remote to download
+                from.
+
+        Returns:
+            The slot, which must be given back to
+                :meth:`~pulpcore.content.downloads.UpstreamLimiter.release`.
+
+        Raises:
+            :class:`aiohttp.web_exceptions.HTTPServiceUnavailable`: When no slot became free within
+                ``CONTENT_APP_UPSTREAM_MAX_WAIT`` seconds.
+        """
+        max_wait = settings.CONTENT_APP_UPSTREAM_MAX_WAIT
+        start = time.monotonic()
+        try:
+            return await upstream_limiter.acquire(remote, timeout=max_wait)
+        except asyncio.TimeoutError:
+            metrics.UPSTREAM_REJECTED.inc()
+            log.warning(_('Remote {name} has no free download slot after {max_wait} seconds')
+                        .format(name=remote.name, max_wait=max_wait))
+            raise HTTPServiceUnavailable(headers={'Retry-After': str(math.ceil(max_wait))})
+        finally:
+            metrics.UPSTREAM_QUEUE_WAIT.observe(time.monotonic() - start)
+
+    async def _finalize_download(self, key, leader, download_result, remote_artifact):
+        """
+        Save a downloaded RemoteArtifact after its response has been sent, then release the claim
+        on saving it.
+
+        Args:
+            key (tuple): The key of the download in
+                :class:`~pulpcore.content.downloads.InFlightDownloads` and
+                :class:`~pulpcore.content.downloads.PullThroughClaims`.
+            leader (bool): Whether the download was the leading one for `key`.
+            download_result (:class:`~pulpcore.plugin.download.DownloadResult`): The result of the
+                download.
+            remote_artifact (:class:`~pulpcore.plugin.models.RemoteArtifact`): The downloaded
+                RemoteArtifact.
+        """
+        artifact = None
+        try:
+            artifact = await run_in_database_thread(
+                self._save_artifact, download_result, remote_artifact
+            )
+        except Exception:
+            log.exception(_('Saving the artifact downloaded from {url} failed').format(
+                url=remote_artifact.url
+            ))
+        finally:
+            if leader:
+                in_flight_downloads.finish(key, artifact)
+            await pull_through_claims.release(key)
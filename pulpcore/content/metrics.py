@@ -0,0 +1,387 @@
+"""
+Metrics of the Content App, exposed in the Prometheus text format.
+
+The metrics are kept in memory by each Content App process and are only updated from its event
+loop. They are served at ``CONTENT_APP_METRICS_PATH`` by :func:`metrics_view`, to local clients
+only. Processes don't share their metrics, each one serves its own.
+"""
+from collections import OrderedDict
+import ipaddress
+import math
+import time
+
+from aiohttp import hdrs
+from aiohttp.web import FileResponse, Response
+from aiohttp.web_exceptions import HTTPForbidden
+
+from .cache import (
+    distribution_cache,
+    permit_cache,
+    published_path_cache,
+    published_path_filters,
+    repository_version_paths,
+    signed_url_cache,
+)
+
+
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Keys of the values the handler stores on the request.
+REQUEST_START = 'pulp_request_start'
+OUTCOME = 'pulp_outcome'
+
+_registry = OrderedDict()
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ('{name}="{value}"'.format(
+        name=name,
+        value=str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"'),
+    ) for name, value in labels)
+    return '{' + ','.join(pairs) + '}'
+
+
+class Metric:
+    """
+    A metric with optional labels, registered for :func:`render`.
+
+    Args:
+        name (str): The name of the metric.
+        documentation (str): The help text of the metric.
+        labelnames (tuple): The names of the labels of the metric.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = OrderedDict()
+        _registry[name] = self
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError('{name} has the labels {labelnames}'.format(
+                name=self.name, labelnames=', '.join(self.labelnames)
+            ))
+        return tuple(labels[name] for name in self.labelnames)
+
+    def clear(self):
+        """
+        Drop all recorded values.
+        """
+        self._values.clear()
+
+    def samples(self):
+        """
+        Returns:
+            list: Of (name, labels, value) tuples, where labels is a tuple of (name, value) pairs.
+        """
+        raise NotImplementedError()
+
+    def render(self):
+        """
+        Returns:
+            str: The metric in the Prometheus text format.
+        """
+        lines = [
+            '# HELP {name} {doc}'.format(name=self.name, doc=self.documentation),
+            '# TYPE {name} {type}'.format(name=self.name, type=self.type),
+        ]
+        for name, labels, value in self.samples():
+            lines.append('{name}{labels} {value}'.format(
+                name=name, labels=_format_labels(labels), value=_format_value(value)
+            ))
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    """
+    A value that only goes up, like the number of requests served.
+    """
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """
+        Increment the counter.
+
+        Args:
+            amount (int): The amount to add.
+            labels (dict): The values of the labels of the counter.
+        """
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        """
+        Returns:
+            int: The value of the counter with `labels`.
+        """
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        return [(self.name, tuple(zip(self.labelnames, key)), value)
+                for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """
+    A value that can go up and down, like the number of entries of a cache.
+    """
+
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        """
+        Set the gauge.
+
+        Args:
+            value (float): The value.
+            labels (dict): The values of the labels of the gauge.
+        """
+        self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    """
+    The distribution of observed values, like request durations, counted in cumulative buckets.
+
+    Args:
+        name (str): The name of the metric.
+        documentation (str): The help text of the metric.
+        labelnames (tuple): The names of the labels of the metric.
+        buckets (tuple): The upper bounds of the buckets, in increasing order.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        """
+        Record an observed value.
+
+        Args:
+            value (float): The observed value.
+            labels (dict): The values of the labels of the histogram.
+        """
+        key = self._key(labels)
+        counts, total = self._values.get(key, ([0] * len(self.buckets), 0))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        """
+        Returns:
+            int: The number of values observed with `labels`.
+        """
+        counts, total = self._values.get(self._key(labels), ([0], 0))
+        return counts[-1]
+
+    def samples(self):
+        samples = []
+        for key, (counts, total) in self._values.items():
+            labels = tuple(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, counts):
+                samples.append((self.name + '_bucket', labels + (('le', _format_value(bound)),),
+                                count))
+            samples.append((self.name + '_sum', labels, total))
+            samples.append((self.name + '_count', labels, counts[-1]))
+        return samples
+
+
+def render():
+    """
+    Returns:
+        str: All registered metrics in the Prometheus text format.
+    """
+    return ''.join(metric.render() for metric in _registry.values())
+
+
+REQUESTS = Counter(
+    'pulp_content_requests_total',
+    'Requests served by the Content App, by outcome.',
+    ['outcome'],
+)
+REQUEST_DURATION = Histogram(
+    'pulp_content_request_duration_seconds',
+    'Time from receiving a request until the handler returned its response, by outcome.',
+    ['outcome'],
+)
+STAGE_DURATION = Histogram(
+    'pulp_content_stage_duration_seconds',
+    'Time spent in each stage of serving a request.',
+    ['stage'],
+)
+UPSTREAM_DURATION = Histogram(
+    'pulp_content_upstream_download_duration_seconds',
+    'Duration of the downloads from remotes, by result.',
+    ['result'],
+)
+UPSTREAM_QUEUE_WAIT = Histogram(
+    'pulp_content_upstream_queue_wait_seconds',
+    'Time downloads from remotes waited for one of the download_concurrency slots of the remote.',
+)
+UPSTREAM_REJECTED = Counter(
+    'pulp_content_upstream_rejected_total',
+    'Requests answered with 503 because no download slot of the remote became free in time.',
+)
+BYTES_SERVED = Counter(
+    'pulp_content_bytes_served_total',
+    'Bytes of files sent to clients, by outcome.',
+    ['outcome'],
+)
+CACHE_ENTRIES = Gauge(
+    'pulp_content_cache_entries',
+    'Entries of the in-memory caches of the Content App.',
+    ['cache'],
+)
+CACHE_HITS = Gauge(
+    'pulp_content_cache_hits',
+    'Lookups answered by the in-memory caches of the Content App.',
+    ['cache'],
+)
+CACHE_MISSES = Gauge(
+    'pulp_content_cache_misses',
+    'Lookups not answered by the in-memory caches of the Content App.',
+    ['cache'],
+)
+
+
+class Timer:
+    """
+    A context manager observing the time spent in it with a :class:`Histogram`.
+
+    Args:
+        histogram (:class:`Histogram`): The histogram to observe the duration with.
+        labels (dict): The values of the labels of the histogram.
+    """
+
+    def __init__(self, histogram, **labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.monotonic() - self.start, **self.labels)
+
+
+def stage(name):
+    """
+    Time a stage of serving a request.
+
+    Args:
+        name (str): The name of the stage.
+
+    Returns:
+        :class:`Timer`: Observing the duration of the stage with `STAGE_DURATION`.
+    """
+    return Timer(STAGE_DURATION, stage=name)
+
+
+async def on_response_prepare(request, response):
+    """
+    Record the time to the first byte of the response, and the bytes of files sent.
+
+    Responses without a body, i.e. to `HEAD` requests or with a status other than 200 (OK) and 206
+    (Partial Content), don't count as bytes sent.
+
+    Connected to the `on_response_prepare` signal of the application, which is sent right before
+    the headers of a response are sent.
+
+    Args:
+        request (:class:`aiohttp.web.Request`): The request being responded to.
+        response (:class:`aiohttp.web.StreamResponse`): The response about to be sent.
+    """
+    start = request.get(REQUEST_START)
+    if start is None:
+        return
+    STAGE_DURATION.observe(time.monotonic() - start, stage='first_byte')
+    if not isinstance(response, FileResponse) or request.method == hdrs.METH_HEAD:
+        return
+    if response.status in (200, 206) and response.content_length:
+        BYTES_SERVED.inc(response.content_length, outcome=request.get(OUTCOME, 'unknown'))
+
+
+def _collect_cache_stats():
+    caches = {'path': published_path_cache}
+    if permit_cache is not None:
+        caches['permit'] = permit_cache
+    if repository_version_paths is not None:
+        caches['repository_version_paths'] = repository_version_paths.indexes
+    if published_path_filters is not None:
+        caches['published_path_filters'] = published_path_filters.indexes
+    if signed_url_cache is not None:
+        caches['signed_url'] = signed_url_cache
+    for name, cache in caches.items():
+        stats = cache.stats()
+        CACHE_ENTRIES.set(stats['size'], cache=name)
+        CACHE_HITS.set(stats['hits'], cache=name)
+        CACHE_MISSES.set(stats['misses'], cache=name)
+    CACHE_ENTRIES.set(len(distribution_cache), cache='distribution')
+
+
+def _is_local(request):
+    """
+    Check whether a request comes from the loopback interface or a unix socket.
+
+    Args:
+        request (:class:`aiohttp.web.Request`): The request.
+
+    Returns:
+        bool: True if the client is local.
+    """
+    if not request.remote:
+        # Unix sockets have no address.
+        return True
+    try:
+        address = ipaddress.ip_address(request.remote)
+    except ValueError:
+        return False
+    if getattr(address, 'ipv4_mapped', None):
+        address = address.ipv4_mapped
+    return address.is_loopback
+
+
+async def metrics_view(request):
+    """
+    Serve the metrics of this Content App process to local clients.
+
+    Args:
+        request (:class:`aiohttp.web.Request`): The request for the metrics.
+
+    Returns:
+        :class:`aiohttp.web.Response`: The metrics in the Prometheus text format.
+
+    Raises:
+        :class:`aiohttp.web_exceptions.HTTPForbidden`: When the client is not local.
+    """
+    if not _is_local(request):
+        raise HTTPForbidden()
+    _collect_cache_stats()
+    return Response(body=render().encode(), headers={
+        'Content-Type': CONTENT_TYPE,
+        'Cache-Control': 'no-cache',
+    })
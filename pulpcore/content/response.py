@@ -0,0 +1,219 @@
+import asyncio
+import mimetypes
+from pathlib import Path
+
+from aiohttp import hdrs
+from aiohttp.web import FileResponse, StreamResponse
+from aiohttp.web_exceptions import HTTPNotModified, HTTPPreconditionFailed
+from multidict import CIMultiDict
+
+from pulpcore.app.compression import negotiate_encoding, variant_path
+
+
+def parse_etags(header):
+    """
+    Parse the list of entity-tags of an `If-Match`, `If-None-Match` or `If-Range` header.
+
+    Args:
+        header (str): The header value.
+
+    Returns:
+        list: Of (weak, opaque-tag) tuples. A `*` is returned as (False, '*').
+    """
+    etags = []
+    for etag in header.split(','):
+        etag = etag.strip()
+        weak = etag.startswith('W/')
+        if weak:
+            etag = etag[2:]
+        if etag:
+            etags.append((weak, etag))
+    return etags
+
+
+def etag_matches(etag, header, weak=False):
+    """
+    Check whether a strong entity-tag matches a conditional request header.
+
+    Args:
+        etag (str): The (quoted) strong entity-tag of the response.
+        header (str): The value of the conditional request header.
+        weak (bool): Use the weak comparison function, which also accepts weak entity-tags.
+            `If-None-Match` uses the weak and `If-Match` and `If-Range` the strong comparison.
+
+    Returns:
+        bool: True if `etag` matches.
+    """
+    for is_weak, other in parse_etags(header):
+        if other == '*' or (other == etag and (weak or not is_weak)):
+            return True
+    return False
+
+
+class ArtifactResponse(FileResponse):
+    """
+    A :class:`aiohttp.web.FileResponse` for an artifact, identified by its SHA-256 digest.
+
+    The digest is known from the database, so it is used as a strong ETag without hashing the file
+    again. Files without a known digest get an ETag derived from their modification time and size.
+    It is sent with every response, including `Range` requests, and conditional requests are
+    evaluated against it in the order required by RFC 7232:
+
+    * `If-Match` that does not match responds with 412 (Precondition Failed).
+    * `If-None-Match` that matches responds with 304 (Not Modified). If it is present but does not
+      match, `If-Modified-Since` is ignored.
+    * `If-Range` with an entity-tag that does not match causes the `Range` to be ignored, so the
+      whole file is sent.
+
+    `Range`, and `If-Modified-Since` and `If-Unmodified-Since` without an entity-tag condition
+    are handled by
+    :class:`aiohttp.web.FileResponse`, which sends the file with `sendfile()` whenever the transport
+    allows it. `HEAD` requests are answered with the headers of a `GET` request only.
+
+    Files with precompressed variants (see :mod:`pulpcore.app.compression`) are sent compressed
+    with the encoding negotiated by `Accept-Encoding`. The variant keeps the `Content-Type` of the
+    file and is marked by its `Content-Encoding` (and ETag) only.
+
+    Args:
+        path (str): The path of the file.
+        sha256 (str): The SHA-256 digest of the file, or None if it is not known.
+        encodings (list): The content-codings of the precompressed variants the file may have.
+        kwargs (dict): Passed on to :class:`aiohttp.web.FileResponse`.
+    """
+
+    def __init__(self, path, sha256=None, encodings=(), **kwargs):
+        super().__init__(path, **kwargs)
+        self._encodings = encodings
+        self._etag = '"{sha256}"'.format(sha256=sha256) if sha256 else None
+        if self._etag:
+            self.headers[hdrs.ETAG] = self._etag
+        if self._encodings:
+            self.headers[hdrs.VARY] = hdrs.ACCEPT_ENCODING
+
+    @property
+    def etag(self):
+        """
+        The ETag of the response.
+        """
+        return StreamResponse.etag.fget(self)
+
+    @etag.setter
+    def etag(self, value):
+        # FileResponse derives its own ETag when it sends the file, which is not the one the
+        # conditional requests were evaluated against.
+        if self._etag is None:
+            StreamResponse.etag.fset(self, value)
+
+    async def prepare(self, request):
+        """
+        Evaluate the conditional request headers and send the response.
+
+        Args:
+            request (:class:`aiohttp.web.BaseRequest`): The request to respond to.
+
+        Returns:
+            The payload writer of the response.
+        """
+        encoding = negotiate_encoding(request.headers.get(hdrs.ACCEPT_ENCODING), self._encodings)
+        if encoding:
+            await self._select_variant(encoding)
+
+        if not self._etag:
+            await self._stat_etag()
+
+        # The encoding is negotiated above, not by FileResponse.
+        ignored = {hdrs.ACCEPT_ENCODING}
+        if self._etag:
+            # The entity-tag conditions are evaluated here, FileResponse only knows its own ETag.
+            ignored |= {hdrs.IF_MATCH, hdrs.IF_NONE_MATCH}
+            if_match = request.headers.get(hdrs.IF_MATCH)
+            if if_match is not None and not etag_matches(self._etag, if_match):
+                self.set_status(HTTPPreconditionFailed.status_code)
+                return await StreamResponse.prepare(self, request)
+            if if_match is not None:
+                ignored.add(hdrs.IF_UNMODIFIED_SINCE)
+
+            if_none_match = request.headers.get(hdrs.IF_NONE_MATCH)
+            if if_none_match is not None:
+                if etag_matches(self._etag, if_none_match, weak=True):
+                    self.set_status(HTTPNotModified.status_code)
+                    self._length_check = False
+                    return await StreamResponse.prepare(self, request)
+                ignored.add(hdrs.IF_MODIFIED_SINCE)
+
+            if_range = request.headers.get(hdrs.IF_RANGE, '')
+            if if_range.startswith(('"', 'W/')):
+                ignored.add(hdrs.IF_RANGE)
+                if not etag_matches(self._etag, if_range):
+                    ignored.add(hdrs.RANGE)
+
+        ignored &= set(request.headers)
+        if ignored:
+            headers = CIMultiDict((name, value) for name, value in request.headers.items()
+                                  if name not in ignored)
+            request = request.clone(headers=headers)
+
+        if request.method == hdrs.METH_HEAD:
+            return await self._prepare_head(request)
+        return await super().prepare(request)
+
+    async def _select_variant(self, encoding):
+        """
+        Send the variant of the file compressed with `encoding`, if it exists.
+
+        Args:
+            encoding (str): The content-coding of the variant.
+        """
+        variant = Path(variant_path(str(self._path), encoding))
+        loop = asyncio.get_event_loop()
+        if not await loop.run_in_executor(None, variant.is_file):
+            return
+        if hdrs.CONTENT_TYPE not in self.headers:
+            self.content_type = mimetypes.guess_type(str(self._path))[0] or \
+                'application/octet-stream'
+        self._path = variant
+        self.headers[hdrs.CONTENT_ENCODING] = encoding
+        if self._etag:
+            # A strong ETag identifies the exact bytes sent, so each variant needs its own.
+            self._etag = '{etag}+{encoding}"'.format(etag=self._etag[:-1], encoding=encoding)
+            self.headers[hdrs.ETAG] = self._etag
+
+    async def _stat_etag(self):
+        """
+        Derive the ETag of a file without a known digest from its modification time and size.
+        """
+        loop = asyncio.get_event_loop()
+        try:
+            st = await loop.run_in_executor(None, self._path.stat)
+        except OSError:
+            # FileResponse responds with an error.
+            return
+        self._etag = '"{mtime:x}-{size:x}"'.format(mtime=st.st_mtime_ns, size=st.st_size)
+        self.headers[hdrs.ETAG] = self._etag
+
+    async def _prepare_head(self, request):
+        """
+        Send the headers a `GET` request of the whole file would be answered with.
+
+        Args:
+            request (:class:`aiohttp.web.BaseRequest`): The `HEAD` request to respond to.
+
+        Returns:
+            The payload writer of the response.
+        """
+        loop = asyncio.get_event_loop()
+        st = await loop.run_in_executor(None, self._path.stat)
+
+        modified_since = request.if_modified_since
+        if modified_since is not None and st.st_mtime <= modified_since.timestamp():
+            self.set_status(HTTPNotModified.status_code)
+            self._length_check = False
+            return await StreamResponse.prepare(self, request)
+
+        if hdrs.CONTENT_TYPE not in self.headers:
+            self.content_type = mimetypes.guess_type(str(self._path))[0] or \
+                'application/octet-stream'
+        self.last_modified = st.st_mtime
+        self.content_length = st.st_size
+        self.headers[hdrs.ACCEPT_RANGES] = 'bytes'
+        return await StreamResponse.prepare(self, request)
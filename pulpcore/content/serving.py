@@ -0,0 +1,262 @@
+"""
+Strategies for serving the files of the storage backend.
+
+Artifacts and published metadata are stored by the Django storage backend set by
+``DEFAULT_FILE_STORAGE``. How the Content App sends them to clients is decided by a
+:class:`ServingStrategy`, selected by ``CONTENT_APP_STORAGE_SERVING``:
+
+* ``file`` sends the file from the local file system. Only storages with local paths support it.
+* ``redirect`` redirects the client to the URL of the file in the storage, e.g. a presigned S3 URL.
+  URLs are reused from the ``signed_url_cache`` until shortly before they expire.
+* ``proxy`` streams the file from the storage through the Content App.
+* ``local-cache`` copies the file from the storage to a local disk cache first and sends it from
+  there, so files requested again are sent without accessing the storage.
+
+Any other value is the dotted path of a :class:`ServingStrategy` subclass. Strategies only use the
+API of :class:`django.core.files.storage.Storage`, so any storage backend can be served by
+``redirect``, ``proxy`` and ``local-cache``.
+"""
+import asyncio
+from functools import partial
+import hashlib
+import mimetypes
+
+from aiohttp import hdrs
+from aiohttp.web import StreamResponse
+from aiohttp.web_exceptions import HTTPFound, HTTPNotModified
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils.module_loading import import_string
+
+from . import metrics
+from .cache import StreamedCache, signed_url_cache
+from .response import ArtifactResponse, etag_matches
+
+
+# The size of the chunks read from the storage.
+CHUNK_SIZE = 1024 * 1024
+
+
+async def run_in_storage_thread(func, *args, **kwargs):
+    """
+    Call a function that accesses the storage in a thread, so it does not block the event loop.
+
+    Args:
+        func (callable): The function to call.
+        args (tuple): Positional arguments for `func`.
+        kwargs (dict): Keyword arguments for `func`.
+
+    Returns:
+        The return value of `func`.
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, partial(func, *args, **kwargs))
+
+
+class ServingStrategy:
+    """
+    Sends the files of a storage backend to the clients of the Content App.
+
+    Args:
+        storage (:class:`django.core.files.storage.Storage`): The storage of the files.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    async def serve(self, request, file, sha256=None, encodings=()):
+        """
+        Respond to a request with a stored file.
+
+        Args:
+            request (:class:`aiohttp.web.Request`): The request for the file.
+            file (:class:`django.db.models.fields.files.FieldFile`): The file to respond with.
+            sha256 (str): The SHA-256 digest of the file, used as its strong ETag, if known.
+            encodings (list): The content-codings of the precompressed variants the file may have.
+
+        Raises:
+            :class:`aiohttp.web_exceptions.HTTPException`: When the request is answered by an
+                exception, e.g. a redirect.
+
+        Returns:
+            :class:`aiohttp.web.StreamResponse`: The response.
+        """
+        raise NotImplementedError()
+
+
+class FileStrategy(ServingStrategy):
+    """
+    Sends files from the local file system.
+
+    See :class:`~pulpcore.content.response.ArtifactResponse`.
+    """
+
+    async def serve(self, request, file, sha256=None, encodings=()):
+        return ArtifactResponse(self.storage.path(file.name), sha256=sha256, encodings=encodings)
+
+
+class RedirectStrategy(ServingStrategy):
+    """
+    Redirects clients to the URLs of files in the storage.
+
+    Generating a presigned URL takes a signature computation for every request, so the URLs are
+    reused from the ``signed_url_cache`` for as long as they stay valid.
+    """
+
+    def url(self, name):
+        """
+        Args:
+            name (str): The name of a stored file.
+
+        Returns:
+            str: The URL of the file.
+        """
+        if signed_url_cache is None:
+            return self.storage.url(name)
+        url = signed_url_cache.get(name)
+        if url is None:
+            url = self.storage.url(name)
+            signed_url_cache.set(name, url)
+        return url
+
+    async def serve(self, request, file, sha256=None, encodings=()):
+        raise HTTPFound(self.url(file.name))
+
+
+class ProxyStrategy(ServingStrategy):
+    """
+    Streams files from the storage through the Content App.
+
+    The storage is read in a thread, one chunk at a time. `HEAD` requests are answered with the
+    headers only, and an `If-None-Match` matching the SHA-256 digest is answered with 304.
+    """
+
+    async def serve(self, request, file, sha256=None, encodings=()):
+        headers = {}
+        if sha256:
+            etag = '"{sha256}"'.format(sha256=sha256)
+            headers[hdrs.ETAG] = etag
+            if_none_match = request.headers.get(hdrs.IF_NONE_MATCH)
+            if if_none_match is not None and etag_matches(etag, if_none_match, weak=True):
+                raise HTTPNotModified(headers=headers)
+
+        response = StreamResponse(headers=headers)
+        response.content_type = mimetypes.guess_type(file.name)[0] or 'application/octet-stream'
+        response.content_length = await run_in_storage_thread(self.storage.size, file.name)
+        await response.prepare(request)
+        if request.method == hdrs.METH_HEAD:
+            return response
+
+        stored = await run_in_storage_thread(self.storage.open, file.name, 'rb')
+        try:
+            while True:
+                data = await run_in_storage_thread(stored.read, CHUNK_SIZE)
+                if not data:
+                    break
+                await response.write(data)
+                metrics.BYTES_SERVED.inc(len(data),
+                                         outcome=request.get(metrics.OUTCOME, 'unknown'))
+        finally:
+            stored.close()
+        await response.write_eof()
+        return response
+
+
+class LocalCacheStrategy(ProxyStrategy):
+    """
+    Copies files from the storage to a local disk cache and sends them from there.
+
+    The cache is a :class:`~pulpcore.content.cache.StreamedCache` in
+    ``CONTENT_APP_STORAGE_CACHE_DIR``, bounded by ``CONTENT_APP_STORAGE_CACHE_SIZE``. Files are
+    keyed by their SHA-256 digest, which is verified while they are copied, or by their name when
+    the digest is not known. Files that can't be cached are streamed like by
+    :class:`ProxyStrategy`.
+    """
+
+    def __init__(self, storage):
+        super().__init__(storage)
+        self.cache = StreamedCache(
+            settings.CONTENT_APP_STORAGE_CACHE_DIR, settings.CONTENT_APP_STORAGE_CACHE_SIZE
+        )
+
+    async def serve(self, request, file, sha256=None, encodings=()):
+        key = sha256 or hashlib.sha256(file.name.encode()).hexdigest()
+        path = self.cache.get(key)
+        if path is None:
+            path = await run_in_storage_thread(self.fetch, file.name, key, sha256)
+        if path is None:
+            return await super().serve(request, file, sha256=sha256)
+        return ArtifactResponse(path, sha256=sha256)
+
+    def fetch(self, name, key, sha256=None):
+        """
+        Copy a file from the storage to the cache.
+
+        Args:
+            name (str): The name of the stored file.
+            key (str): The key to cache the file by.
+            sha256 (str): The expected SHA-256 digest of the file, if known.
+
+        Returns:
+            str: The path of the cached file, or None if it was not cached.
+        """
+        writer = self.cache.writer(key, sha256=sha256)
+        try:
+            with self.storage.open(name, 'rb') as stored:
+                for chunk in stored.chunks(CHUNK_SIZE):
+                    writer.write(chunk)
+        except BaseException:
+            writer.abort()
+            raise
+        if not writer.commit():
+            return None
+        # The file is evicted right away when it is larger than the whole cache.
+        return self.cache.get(key)
+
+
+STRATEGIES = {
+    'file': FileStrategy,
+    'redirect': RedirectStrategy,
+    'proxy': ProxyStrategy,
+    'local-cache': LocalCacheStrategy,
+}
+
+
+def has_local_paths(storage):
+    """
+    Args:
+        storage (:class:`django.core.files.storage.Storage`): A storage.
+
+    Returns:
+        bool: True if the files of `storage` are accessible on the local file system.
+    """
+    try:
+        storage.path('')
+    except NotImplementedError:
+        return False
+    return True
+
+
+def get_serving_strategy(name=None, storage=default_storage):
+    """
+    Create the strategy to serve the files of a storage with.
+
+    Args:
+        name (str): One of :data:`STRATEGIES`, or the dotted path of a :class:`ServingStrategy`
+            subclass. If None, storages with local paths are served by ``file`` and all others by
+            ``redirect``.
+        storage (:class:`django.core.files.storage.Storage`): The storage to serve.
+
+    Returns:
+        :class:`ServingStrategy`: The strategy.
+    """
+    if name is None:
+        name = 'file' if has_local_paths(storage) else 'redirect'
+    try:
+        strategy_class = STRATEGIES[name]
+    except KeyError:
+        strategy_class = import_string(name)
+    return strategy_class(storage)
+
+
+serving_strategy = get_serving_strategy(settings.CONTENT_APP_STORAGE_SERVING)
@@ -0,0 +1,227 @@
+"""
+A pre-forking supervisor running the Content App in several worker processes.
+
+One Content App process serves all of its requests on a single core. The :class:`Supervisor` runs
+as many worker processes as requested, which all accept connections on the same port, either on a
+listening socket created before they are forked or, with ``reuse_port``, on sockets of their own
+bound with ``SO_REUSEPORT``. Each worker writes its own ``ContentAppStatus`` heartbeat.
+
+The supervisor replaces workers that exit unexpectedly and handles these signals:
+
+* ``SIGTERM`` and ``SIGINT`` shut the workers down gracefully, then the supervisor exits.
+* ``SIGHUP`` restarts the workers gracefully: new workers are started first, then the old ones are
+  asked to finish the requests they are serving and exit.
+"""
+import argparse
+import asyncio
+from gettext import gettext as _
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+from aiohttp import web
+
+from pulpcore.content import server
+
+
+log = logging.getLogger(__name__)
+
+# Workers exiting sooner than this after starting are respawned after a delay, so a worker that
+# can't start does not keep the supervisor busy.
+MIN_WORKER_LIFETIME = 1
+
+
+class Supervisor:
+    """
+    Runs the Content App in a number of worker processes.
+
+    Args:
+        workers (int): The number of worker processes.
+        host (str): The host to listen on, or None for all interfaces (IPv4 and IPv6).
+        port (int): The port to listen on.
+        reuse_port (bool): If True, every worker binds its own socket with ``SO_REUSEPORT`` and the
+            kernel balances connections between them. Otherwise the workers share one socket.
+        shutdown_timeout (float): The number of seconds a worker waits for the requests it serves
+            to finish when it shuts down.
+    """
+
+    def __init__(self, workers, host=None, port=24816, reuse_port=False,
+                 shutdown_timeout=60.0):
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.reuse_port = reuse_port
+        self.shutdown_timeout = shutdown_timeout
+        self.sockets = []
+        self.stopping = False
+        # Maps the pids of the current workers to when they were started.
+        self._current = {}
+        # The pids of the workers that are shutting down.
+        self._retiring = set()
+
+    def run(self):
+        """
+        Start the workers and supervise them until the supervisor is asked to stop.
+
+        Returns:
+            int: The exit status of the supervisor.
+        """
+        if not self.reuse_port:
+            self.sockets = self._bind()
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGHUP, self._restart)
+
+        log.info(_('Starting {workers} Content App workers on {host}:{port}').format(
+            workers=self.workers, host=self.host or '*', port=self.port
+        ))
+        for _i in range(self.workers):
+            self._spawn()
+
+        while self._current or self._retiring:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            self._reap(pid, status)
+        return 0
+
+    def _bind(self):
+        """
+        Create the listening sockets shared by the workers.
+
+        Like :meth:`asyncio.AbstractEventLoop.create_server`, one socket is bound for every address
+        of the host, so a host of None listens on all IPv4 and IPv6 interfaces.
+
+        Returns:
+            list: Of :class:`socket.socket`.
+        """
+        sockets = []
+        infos = socket.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM,
+                                   flags=socket.AI_PASSIVE)
+        for family, type_, proto, _canonname, address in sorted(set(infos)):
+            sock = socket.socket(family, type_, proto)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if family == socket.AF_INET6:
+                # Otherwise the IPv6 socket also takes the IPv4 addresses of the IPv4 socket.
+                sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+            sock.bind(address)
+            sock.listen(128)
+            sock.set_inheritable(True)
+            sockets.append(sock)
+        return sockets
+
+    def _spawn(self):
+        """
+        Fork a worker process.
+        """
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                self._run_worker()
+                code = 0
+            except Exception:
+                log.exception(_('Content App worker {pid} failed').format(pid=os.getpid()))
+            finally:
+                logging.shutdown()
+                os._exit(code)
+        self._current[pid] = time.monotonic()
+
+    def _run_worker(self):
+        """
+        Run the Content App in a worker process until it is asked to stop.
+        """
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, signal.SIG_DFL)
+        asyncio.set_event_loop(asyncio.new_event_loop())
+
+        if self.reuse_port:
+            web.run_app(server(), host=self.host, port=self.port, reuse_port=True,
+                        shutdown_timeout=self.shutdown_timeout, print=None)
+        else:
+            web.run_app(server(), sock=self.sockets, shutdown_timeout=self.shutdown_timeout,
+                        print=None)
+
+    def _reap(self, pid, status):
+        """
+        Handle the exit of a worker, replacing it if it was not asked to exit.
+
+        Args:
+            pid (int): The pid of the worker.
+            status (int): The exit status of the worker, as returned by :func:`os.wait`.
+        """
+        self._retiring.discard(pid)
+        started = self._current.pop(pid, None)
+        if started is None or self.stopping:
+            return
+        log.error(_('Content App worker {pid} exited unexpectedly with status {status}').format(
+            pid=pid, status=status
+        ))
+        if time.monotonic() - started < MIN_WORKER_LIFETIME:
+            time.sleep(MIN_WORKER_LIFETIME)
+        self._spawn()
+
+    def _stop(self, signum, frame):
+        """
+        Ask all workers to shut down gracefully.
+        """
+        log.info(_('Stopping the Content App workers'))
+        self.stopping = True
+        self._retire(list(self._current) + list(self._retiring))
+
+    def _restart(self, signum, frame):
+        """
+        Replace all workers, starting the new ones before the old ones are asked to shut down.
+        """
+        if self.stopping:
+            return
+        log.info(_('Restarting the Content App workers'))
+        old = list(self._current)
+        for _i in range(self.workers):
+            self._spawn()
+        self._retire(old)
+
+    def _retire(self, pids):
+        """
+        Ask workers to shut down gracefully.
+
+        Args:
+            pids (list): The pids of the workers.
+        """
+        for pid in pids:
+            self._current.pop(pid, None)
+            self._retiring.add(pid)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self._retiring.discard(pid)
+
+
+def main(argv=None):
+    """
+    Run the Content App, in several worker processes if requested.
+
+    Args:
+        argv (list): The command line arguments, defaults to ``sys.argv[1:]``.
+    """
+    parser = argparse.ArgumentParser(description=_('Run the Pulp Content App.'))
+    parser.add_argument('--host', help=_('The host to listen on, all interfaces by default.'))
+    parser.add_argument('--port', type=int, default=24816, help=_('The port to listen on.'))
+    parser.add_argument('--workers', type=int, default=1,
+                        help=_('The number of worker processes to run.'))
+    parser.add_argument('--reuse-port', action='store_true',
+                        help=_('Let every worker bind its own socket with SO_REUSEPORT, instead '
+                               'of sharing one.'))
+    args = parser.parse_args(argv)
+
+    if args.workers > 1:
+        supervisor = Supervisor(args.workers, host=args.host, port=args.port,
+                                reuse_port=args.reuse_port)
+        sys.exit(supervisor.run())
+
+    web.run_app(server(), host=args.host, port=args.port)
@@ -0,0 +1,335 @@
+"""
+Throughput, latency and database queries of the content app, for each way it serves a path.
+
+Run with ``django-admin test pulpcore.tests.performance.test_content_app``. PostgreSQL is
+required, and a plugin providing a publication distribution (e.g. pulp_file). Scenarios that need
+a repository distribution or a remote are skipped when no installed plugin provides one.
+
+The benchmark seeds ``DISTRIBUTIONS`` publications of ``ARTIFACTS`` synthetic files each, starts
+the content app and a local upstream server for on-demand and streamed remotes, and requests
+every path of each scenario from ``CLIENTS`` concurrent clients, twice: once with cold caches and
+once with warm ones. The clients, the upstream and the content app share one event loop, so the
+numbers are only comparable between runs on the same machine.
+"""
+import asyncio
+from collections import Counter, OrderedDict
+import hashlib
+import socket
+from tempfile import TemporaryDirectory
+import time
+
+from aiohttp import ClientSession, TCPConnector, web
+from django.apps import apps
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TransactionTestCase, override_settings
+
+from pulpcore.content import server
+from pulpcore.content.executor import close_database_connections
+from pulpcore.plugin.models import (
+    Artifact,
+    Content,
+    ContentArtifact,
+    Publication,
+    PublicationDistribution,
+    PublishedArtifact,
+    PublishedMetadata,
+    Remote,
+    RemoteArtifact,
+    Repository,
+    RepositoryVersion,
+    RepositoryVersionDistribution,
+)
+
+from .utils import QueryCounter, format_throughput, install_in_database_threads
+
+
+DISTRIBUTIONS = 4
+ARTIFACTS = 500
+METADATA_FILES = 20
+REMOTE_ARTIFACTS = 100
+FILE_SIZE = 4096
+CLIENTS = 32
+
+# The maximum number of queries per request with warm caches, for the scenarios that are served
+# from the in-memory caches. Heartbeats of the content app account for the fraction.
+QUERY_BUDGETS = {
+    'published_artifact': 0.1,
+    'published_metadata': 0.1,
+    'pass_through': 1.1,
+    'not_found': 0.1,
+}
+
+
+def detail_model(master):
+    """
+    Find a concrete model of an installed plugin.
+
+    Args:
+        master (class): A model class of pulpcore.
+
+    Returns:
+        class: The first concrete subclass of `master` provided by a plugin, or None.
+    """
+    for model in apps.get_models():
+        if issubclass(model, master) and model._meta.app_label != 'core':
+            return model
+    return None
+
+
+def file_data(name):
+    """
+    Args:
+        name (str): The name of a synthetic file.
+
+    Returns:
+        bytes: The content of the file.
+    """
+    return hashlib.sha256(name.encode()).digest() * (FILE_SIZE // 32)
+
+
+async def upstream_file(request):
+    return web.Response(body=file_data(request.match_info['name']))
+
+
+async def start(app):
+    """
+    Serve an application on a free local port.
+
+    Args:
+        app (:class:`aiohttp.web.Application`): The application.
+
+    Returns:
+        tuple: The :class:`aiohttp.web.AppRunner` serving `app` and the URL it is served at.
+    """
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.SockSite(runner, sock).start()
+    return runner, 'http://127.0.0.1:{port}'.format(port=sock.getsockname()[1])
+
+
+async def drive(session, urls):
+    """
+    Request each URL once from ``CLIENTS`` concurrent clients.
+
+    Args:
+        session (:class:`aiohttp.ClientSession`): The session to request with.
+        urls (list): The URLs to request.
+
+    Returns:
+        tuple: The latency of each request in seconds, the duration of the whole run in seconds,
+            and a :class:`collections.Counter` of the response statuses.
+    """
+    latencies = []
+    statuses = Counter()
+    pending = iter(urls)
+
+    async def client():
+        for url in pending:
+            issued = time.monotonic()
+            async with session.get(url, allow_redirects=False) as response:
+                await response.read()
+            latencies.append(time.monotonic() - issued)
+            statuses[response.status] += 1
+
+    started = time.monotonic()
+    await asyncio.gather(*(client() for _ in range(CLIENTS)))
+    return latencies, time.monotonic() - started, statuses
+
+
+class ContentAppBenchmark(TransactionTestCase):
+
+    def setUp(self):
+        self.publication_distribution = detail_model(PublicationDistribution)
+        if self.publication_distribution is None:
+            self.skipTest('No installed plugin provides a publication distribution.')
+        self.repository_distribution = detail_model(RepositoryVersionDistribution)
+        self.remote = detail_model(Remote)
+        self.media_root = TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+
+    def create_content_artifacts(self, relative_paths, artifacts=None):
+        """
+        Create a content unit with a content artifact for each relative path.
+
+        Args:
+            relative_paths (list): The relative paths of the content artifacts.
+            artifacts (list): The artifacts of the content artifacts, or None.
+
+        Returns:
+            list: The content artifacts.
+        """
+        content_type = '{app_label}.{type}'.format(app_label=Content._meta.app_label,
+                                                   type=Content.TYPE)
+        contents = Content.objects.bulk_create(Content(_type=content_type) for _ in relative_paths)
+        artifacts = artifacts or [None] * len(relative_paths)
+        return ContentArtifact.objects.bulk_create(
+            ContentArtifact(content=content, artifact=artifact, relative_path=relative_path)
+            for content, artifact, relative_path in zip(contents, artifacts, relative_paths)
+        )
+
+    def create_publication(self, name, content_artifacts):
+        """
+        Create a repository version and a pass-through publication of content artifacts.
+
+        Content artifacts are published at ``published/<relative path>``.
+
+        Args:
+            name (str): The name of the repository.
+            content_artifacts (list): The content artifacts.
+
+        Returns:
+            tuple: The repository and the publication.
+        """
+        repository = Repository.objects.create(name=name)
+        version = RepositoryVersion.objects.create(repository=repository, number=1)
+        version.add_content(Content.objects.filter(
+            pk__in=[ca.content_id for ca in content_artifacts]
+        ))
+        version.complete = True
+        version.save()
+        publication = Publication.objects.create(repository_version=version, complete=True,
+                                                 pass_through=True)
+        PublishedArtifact.objects.bulk_create(
+            PublishedArtifact(publication=publication, content_artifact=ca,
+                              relative_path='published/' + ca.relative_path)
+            for ca in content_artifacts
+        )
+        return repository, publication
+
+    def seed(self, upstream_url):
+        """
+        Create the distributions served by the benchmark.
+
+        Args:
+            upstream_url (str): The URL of the upstream server of the remotes.
+
+        Returns:
+            OrderedDict: Maps the name of each scenario to the paths it requests, relative to
+                ``CONTENT_PATH_PREFIX``.
+        """
+        scenarios = OrderedDict((name, []) for name in (
+            'published_artifact', 'published_metadata', 'pass_through', 'repository_version',
+            'not_found', Remote.ON_DEMAND, Remote.STREAMED,
+        ))
+
+        artifacts = []
+        for j in range(ARTIFACTS):
+            data = file_data('artifact-{j}'.format(j=j))
+            digests = {name: hashlib.new(name, data).hexdigest() for name in Artifact.DIGEST_FIELDS}
+            artifacts.append(Artifact.objects.create(
+                file=SimpleUploadedFile('artifact-{j}'.format(j=j), data), size=len(data),
+                **digests
+            ))
+        relative_paths = ['content/{j}'.format(j=j) for j in range(ARTIFACTS)]
+
+        for i in range(DISTRIBUTIONS):
+            content_artifacts = self.create_content_artifacts(relative_paths, artifacts)
+            repository, publication = self.create_publication(
+                'benchmark-{i}'.format(i=i), content_artifacts
+            )
+            for j in range(METADATA_FILES):
+                PublishedMetadata.objects.create(
+                    publication=publication, relative_path='metadata/{j}.xml'.format(j=j),
+                    file=SimpleUploadedFile('{j}.xml'.format(j=j), file_data(str(j)))
+                )
+
+            base_path = 'benchmark/publication/{i}/'.format(i=i)
+            self.publication_distribution.objects.create(
+                name=base_path, base_path=base_path, publication=publication
+            )
+            scenarios['published_artifact'].extend(base_path + 'published/' + relative_path
+                                                   for relative_path in relative_paths)
+            scenarios['published_metadata'].extend(base_path + 'metadata/{j}.xml'.format(j=j)
+                                                   for j in range(METADATA_FILES))
+            scenarios['pass_through'].extend(base_path + relative_path
+                                             for relative_path in relative_paths)
+            scenarios['not_found'].extend(base_path + 'missing/{j}'.format(j=j)
+                                          for j in range(ARTIFACTS))
+
+            if self.repository_distribution is not None:
+                base_path = 'benchmark/repository/{i}/'.format(i=i)
+                self.repository_distribution.objects.create(
+                    name=base_path, base_path=base_path, repository=repository
+                )
+                scenarios['repository_version'].extend(base_path + relative_path
+                                                       for relative_path in relative_paths)
+
+        for policy in (Remote.ON_DEMAND, Remote.STREAMED):
+            if self.remote is None:
+                break
+            remote = self.remote.objects.create(name='benchmark-' + policy, url=upstream_url,
+                                                policy=policy)
+            relative_paths = ['{policy}/{j}'.format(policy=policy, j=j)
+                              for j in range(REMOTE_ARTIFACTS)]
+            content_artifacts = self.create_content_artifacts(relative_paths)
+            RemoteArtifact.objects.bulk_create(
+                RemoteArtifact(remote=remote, content_artifact=ca,
+                               url='{url}/files/{path}'.format(url=upstream_url,
+                                                               path=ca.relative_path))
+                for ca in content_artifacts
+            )
+            _repository, publication = self.create_publication('benchmark-' + policy,
+                                                               content_artifacts)
+            base_path = 'benchmark/{policy}/'.format(policy=policy)
+            self.publication_distribution.objects.create(
+                name=base_path, base_path=base_path, publication=publication
+            )
+            scenarios[policy].extend(base_path + 'published/' + relative_path
+                                     for relative_path in relative_paths)
+
+        return OrderedDict((name, paths) for name, paths in scenarios.items() if paths)
+
+    async def run_scenarios(self):
+        upstream_app = web.Application()
+        upstream_app.add_routes([web.get('/files/{name:.+}', upstream_file)])
+        upstream, upstream_url = await start(upstream_app)
+
+        scenarios = self.seed(upstream_url)
+
+        content_app, content_url = await start(await server())
+        queries = QueryCounter()
+        await install_in_database_threads(queries)
+
+        results = {}
+        try:
+            async with ClientSession(connector=TCPConnector(limit=CLIENTS)) as session:
+                for name, paths in scenarios.items():
+                    urls = [content_url + settings.CONTENT_PATH_PREFIX + path for path in paths]
+                    for temperature in ('cold', 'warm'):
+                        before = queries.count
+                        latencies, seconds, statuses = await drive(session, urls)
+                        results[name, temperature] = (latencies, seconds,
+                                                      queries.count - before, statuses)
+        finally:
+            await content_app.cleanup()
+            await upstream.cleanup()
+            await close_database_connections()
+        return results
+
+    def test_content_app(self):
+        """Report the throughput of each scenario and check the queries of the cached ones."""
+        # The content app starts its background tasks on the current event loop.
+        previous_loop = asyncio.get_event_loop()
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            with override_settings(MEDIA_ROOT=self.media_root.name):
+                results = loop.run_until_complete(self.run_scenarios())
+        finally:
+            loop.close()
+            asyncio.set_event_loop(previous_loop)
+
+        print()
+        for (name, temperature), (latencies, seconds, queries, statuses) in results.items():
+            print(format_throughput('{name} ({temperature})'.format(
+                name=name, temperature=temperature
+            ), latencies, seconds, queries), dict(statuses))
+
+        for (name, temperature), (latencies, seconds, queries, statuses) in results.items():
+            expected = 404 if name == 'not_found' else 200
+            self.assertEqual(set(statuses), {expected}, name)
+            if temperature == 'warm' and name in QUERY_BUDGETS:
+                self.assertLessEqual(queries / len(latencies), QUERY_BUDGETS[name], name)
@@ -0,0 +1,79 @@
+"""
+Tail latency of content app database access while slow queries are running.
+
+Run with ``django-admin test pulpcore.tests.performance.test_content_executor``. PostgreSQL is
+required for ``pg_sleep()``.
+"""
+import asyncio
+import time
+
+from django.db import connection
+from django.test import TransactionTestCase
+
+from pulpcore.content.executor import close_database_connections, run_in_database_thread
+
+from .utils import format_latencies, percentile
+
+
+SLOW_QUERIES = 4
+SLOW_QUERY_SECONDS = 0.5
+FAST_QUERIES = 200
+FAST_QUERY_INTERVAL = 0.005
+
+
+def slow_query():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_sleep(%s)', [SLOW_QUERY_SECONDS])
+
+
+def fast_query():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+
+
+async def run_on_event_loop(func, *args, **kwargs):
+    """Run the database access on the event loop, as the content app did before."""
+    return func(*args, **kwargs)
+
+
+async def measure(run):
+    """
+    Start the slow queries, then issue fast queries at a steady rate while they run.
+
+    Args:
+        run (coroutine function): Runs the database access, like
+            :func:`~pulpcore.content.executor.run_in_database_thread`.
+
+    Returns:
+        list: The latency of each fast query in seconds, measured from when it was issued.
+    """
+    latencies = []
+
+    async def fast(issued):
+        await run(fast_query)
+        latencies.append(time.monotonic() - issued)
+
+    tasks = [asyncio.ensure_future(run(slow_query)) for _ in range(SLOW_QUERIES)]
+    for _ in range(FAST_QUERIES):
+        tasks.append(asyncio.ensure_future(fast(time.monotonic())))
+        await asyncio.sleep(FAST_QUERY_INTERVAL)
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+class ContentAppExecutorBenchmark(TransactionTestCase):
+
+    def test_tail_latency(self):
+        """Slow queries no longer delay unrelated requests once they run in the thread pool."""
+        loop = asyncio.new_event_loop()
+        try:
+            before = loop.run_until_complete(measure(run_on_event_loop))
+            after = loop.run_until_complete(measure(run_in_database_thread))
+            loop.run_until_complete(close_database_connections())
+        finally:
+            loop.close()
+
+        print()
+        print(format_latencies('on the event loop', before))
+        print(format_latencies('in the database thread pool', after))
+        self.assertLess(percentile(after, 99), percentile(before, 99))
@@ -0,0 +1,120 @@
+"""
+Time and database queries to finish repository versions of a large repository.
+
+Run with ``django-admin test pulpcore.tests.performance.test_repository_version``. PostgreSQL is
+required.
+
+The benchmark seeds a repository with a first version of ``UNITS`` synthetic content units of
+``CONTENT_TYPES`` types, then creates a version that adds and removes ``CHANGED`` units. It
+reports how long it takes to add the content and to count the content of each version, both from
+the previous version and over the whole version.
+"""
+from collections import Counter
+import time
+
+from django.db import connection
+from django.test import TestCase
+
+from pulpcore.app.models import Content, Repository, RepositoryVersion
+
+from .utils import QueryCounter
+
+
+UNITS = 1000000
+CONTENT_TYPES = 4
+CHANGED = 1
+BATCH_SIZE = 10000
+
+
+def measure(name, func, *args, **kwargs):
+    """
+    Call a function and print how long it took and how many queries it ran.
+
+    Args:
+        name (str): The name of what is measured.
+        func (callable): The function to call.
+        args (tuple): Positional arguments for `func`.
+        kwargs (dict): Keyword arguments for `func`.
+
+    Returns:
+        The return value of `func`.
+    """
+    queries = QueryCounter()
+    started = time.monotonic()
+    with connection.execute_wrapper(queries):
+        result = func(*args, **kwargs)
+    print('{name}: {seconds:.3f}s {queries} queries'.format(
+        name=name, seconds=time.monotonic() - started, queries=queries.count
+    ))
+    return result
+
+
+class RepositoryVersionBenchmark(TestCase):
+
+    def create_content(self, count, prefix='benchmark'):
+        """
+        Create synthetic content units.
+
+        Args:
+            count (int): The number of content units.
+            prefix (str): The prefix of the types of the content units.
+
+        Returns:
+            django.db.models.QuerySet: The content units.
+        """
+        for start in range(0, count, BATCH_SIZE):
+            Content.objects.bulk_create(
+                Content(_type='{prefix}.type{i}'.format(prefix=prefix, i=i % CONTENT_TYPES))
+                for i in range(start, min(start + BATCH_SIZE, count))
+            )
+        return Content.objects.filter(_type__startswith=prefix + '.')
+
+    def create_version(self, repository, add, remove):
+        """
+        Create a complete repository version.
+
+        Args:
+            repository (pulpcore.app.models.Repository): The repository.
+            add (django.db.models.QuerySet): The content units to add.
+            remove (django.db.models.QuerySet): The content units to remove.
+
+        Returns:
+            pulpcore.app.models.RepositoryVersion: The version.
+        """
+        version = RepositoryVersion.objects.create(
+            repository=repository, number=repository.last_version + 1
+        )
+        repository.last_version = version.number
+        repository.save()
+        measure('add_content (version {number})'.format(number=version.number),
+                version.add_content, add)
+        version.remove_content(remove)
+        version.complete = True
+        version.save()
+        return version
+
+    def assert_counts(self, version):
+        """
+        Count the content of a version from the previous version and over the whole version.
+
+        Args:
+            version (pulpcore.app.models.RepositoryVersion): The version.
+        """
+        name = 'compute_counts (version {number}, {mode})'
+        measure(name.format(number=version.number, mode='incremental'), version.compute_counts)
+        incremental = Counter(version.counts.values_list('count_type', 'content_type', 'count'))
+        measure(name.format(number=version.number, mode='full'), version.compute_counts, full=True)
+        full = Counter(version.counts.values_list('count_type', 'content_type', 'count'))
+        self.assertEqual(incremental, full)
+
+    def test_compute_counts(self):
+        """Report the time to count each version and check the counts agree."""
+        repository = Repository.objects.create(name='benchmark')
+        print()
+        content = measure('create content ({n} units)'.format(n=UNITS),
+                          self.create_content, UNITS)
+        self.assert_counts(self.create_version(repository, content, Content.objects.none()))
+
+        added = self.create_content(CHANGED, prefix='changed')
+        removed = content.values('pk')[:CHANGED]
+        self.assert_counts(self.create_version(repository, added, removed))
@@ -0,0 +1,104 @@
+import asyncio
+import math
+import threading
+
+from django.conf import settings
+from django.db import connection
+
+from pulpcore.content.executor import run_in_database_thread
+
+
+def percentile(values, p):
+    """
+    Get the p-th percentile of a list of values using the nearest-rank method.
+
+    Args:
+        values (list): The values, in any order.
+        p (float): The percentile to get, between 0 and 100.
+
+    Returns:
+        The p-th percentile of `values`.
+    """
+    ordered = sorted(values)
+    rank = max(math.ceil(p / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def format_latencies(name, latencies):
+    """
+    Format a one-line summary of a list of latencies.
+
+    Args:
+        name (str): The name of what was measured.
+        latencies (list): Latencies in seconds.
+
+    Returns:
+        str: The number of samples and the p50, p99 and maximum latency in milliseconds.
+    """
+    return '{name}: n={n} p50={p50:.1f}ms p99={p99:.1f}ms max={max:.1f}ms'.format(
+        name=name,
+        n=len(latencies),
+        p50=percentile(latencies, 50) * 1000,
+        p99=percentile(latencies, 99) * 1000,
+        max=max(latencies) * 1000,
+    )
+
+
+def format_throughput(name, latencies, seconds, queries):
+    """
+    Format a one-line summary of a load test.
+
+    Args:
+        name (str): The name of what was measured.
+        latencies (list): The latency of each request in seconds.
+        seconds (float): The duration of the load test in seconds.
+        queries (int): The number of database queries run during the load test.
+
+    Returns:
+        str: The number of requests per second, the p50 and p99 latency in milliseconds and the
+            number of queries per request.
+    """
+    template = '{name}: n={n} {rps:.0f} req/s p50={p50:.1f}ms p99={p99:.1f}ms {qpr:.2f} queries/req'
+    return template.format(
+        name=name,
+        n=len(latencies),
+        rps=len(latencies) / seconds,
+        p50=percentile(latencies, 50) * 1000,
+        p99=percentile(latencies, 99) * 1000,
+        qpr=queries / len(latencies),
+    )
+
+
+class QueryCounter:
+    """
+    Counts the queries run on the database connections it is installed on.
+
+    It is a database execute wrapper, see :meth:`django.db.backends.base.base.BaseDatabaseWrapper
+    .execute_wrapper`, and can be installed on the connections of several threads at once.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+
+async def install_in_database_threads(wrapper):
+    """
+    Install an execute wrapper on the connection of every thread of the content app thread pool.
+
+    Args:
+        wrapper (callable): The execute wrapper.
+    """
+    workers = settings.CONTENT_APP_DATABASE_THREADS
+    barrier = threading.Barrier(workers)
+
+    def install():
+        barrier.wait()
+        connection.execute_wrappers.append(wrapper)
+
+    await asyncio.gather(*(run_in_database_thread(install) for _ in range(workers)))
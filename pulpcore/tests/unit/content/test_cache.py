@@ -0,0 +1,392 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest.mock import Mock, patch
+
+from django.core.exceptions import MultipleObjectsReturned
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase
+
+from pulpcore.content.cache import (
+    BloomFilter,
+    DistributionCache,
+    LRUCache,
+    PathIndexes,
+    PublishedPathFilters,
+    RepositoryVersionPaths,
+    StreamedCache,
+    preload_publication,
+    published_path_cache,
+)
+from pulpcore.plugin.models import (
+    Artifact,
+    BaseDistribution,
+    Content,
+    ContentArtifact,
+    Publication,
+    PublishedArtifact,
+    Repository,
+    RepositoryVersion,
+)
+
+
+class DistributionCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.distribution = BaseDistribution.objects.create(name='foo', base_path='foo/bar')
+        self.cache = DistributionCache()
+
+    def test_get(self):
+        """The distribution with the longest matching base path is returned."""
+        distribution = self.cache.get(BaseDistribution, ['foo/bar/baz', 'foo/bar', 'foo'])
+        self.assertEqual(distribution.pk, self.distribution.pk)
+
+    def test_get_no_match(self):
+        """None is returned when no base path matches."""
+        self.assertIsNone(self.cache.get(BaseDistribution, ['foo']))
+
+    def test_get_cached(self):
+        """Matching a cached distribution does not query the database."""
+        self.cache.get(BaseDistribution, ['foo/bar'])
+        with self.assertNumQueries(0):
+            distribution = self.cache.get(BaseDistribution, ['foo/bar'])
+        self.assertEqual(distribution.pk, self.distribution.pk)
+
+    def test_refresh_unchanged(self):
+        """The cache is kept while nothing changed."""
+        self.cache.get(BaseDistribution, ['foo/bar'])
+        self.assertFalse(self.cache.refresh())
+        with self.assertNumQueries(0):
+            self.cache.get(BaseDistribution, ['foo/bar'])
+
+    def test_refresh_changed(self):
+        """The cache is dropped when a distribution changes."""
+        self.cache.get(BaseDistribution, ['foo/bar'])
+        self.distribution.base_path = 'foo/baz'
+        self.distribution.save()
+        self.assertTrue(self.cache.refresh())
+        self.assertIsNone(self.cache.get(BaseDistribution, ['foo/bar']))
+        self.assertEqual(self.cache.get(BaseDistribution, ['foo/baz']).pk, self.distribution.pk)
+
+    def test_clear_during_load(self):
+        """Distributions loaded while the cache is dropped are not cached."""
+        detail_models = DistributionCache._detail_models
+
+        def clear_then_detail_models(model):
+            self.cache.clear()
+            return detail_models(model)
+
+        with patch.object(self.cache, '_detail_models', side_effect=clear_then_detail_models):
+            distribution = self.cache.get(BaseDistribution, ['foo/bar'])
+        self.assertEqual(distribution.pk, self.distribution.pk)
+        self.assertEqual(len(self.cache), 0)
+
+        self.cache.get(BaseDistribution, ['foo/bar'])
+        self.distribution.save()
+        self.assertTrue(self.cache.refresh())
+
+    def test_query(self):
+        """A distribution is queried with its relations in a single query."""
+        with self.assertNumQueries(1):
+            distribution = DistributionCache.query(BaseDistribution, ['foo/bar/baz', 'foo/bar'])
+            self.assertIsNone(distribution.content_guard)
+            self.assertIsNone(distribution.remote)
+        self.assertEqual(distribution.pk, self.distribution.pk)
+        with self.assertRaises(BaseDistribution.DoesNotExist):
+            DistributionCache.query(BaseDistribution, ['foo'])
+
+
+class PreloadPublicationTestCase(TestCase):
+
+    def setUp(self):
+        repository = Repository.objects.create(name='foo')
+        version = RepositoryVersion.objects.create(repository=repository, number=1, complete=True)
+        self.publication = Publication.objects.create(repository_version=version, complete=True)
+        digests = {digest_type: 'abc123' for digest_type in Artifact.DIGEST_FIELDS}
+        artifact = Artifact.objects.create(file=SimpleUploadedFile('c1', b''), size=0, **digests)
+        for relative_path, artifact in (('c1', artifact), ('c2', None)):
+            ca = ContentArtifact.objects.create(artifact=artifact, content=Content.objects.create(),
+                                                relative_path=relative_path)
+            PublishedArtifact.objects.create(publication=self.publication, content_artifact=ca,
+                                             relative_path=relative_path)
+        published_path_cache.clear()
+
+    def test_preload_publication(self):
+        """The paths of downloaded published artifacts are cached."""
+        self.assertEqual(preload_publication(self.publication), 1)
+        ca = published_path_cache.get((self.publication.pk, 'c1'))
+        self.assertEqual(ca.relative_path, 'c1')
+        self.assertIsNone(published_path_cache.get((self.publication.pk, 'c2')))
+
+
+class PublishedPathFiltersTestCase(TestCase):
+
+    def setUp(self):
+        repository = Repository.objects.create(name='foo')
+        version = RepositoryVersion.objects.create(repository=repository, number=1)
+        ca = ContentArtifact.objects.create(content=Content.objects.create(), relative_path='c1')
+        version.add_content(Content.objects.filter(pk=ca.content_id))
+        version.complete = True
+        version.save()
+        self.publication = Publication.objects.create(repository_version=version, complete=True)
+        PublishedArtifact.objects.create(publication=self.publication, content_artifact=ca,
+                                         relative_path='published/c1')
+        self.filters = PublishedPathFilters(10)
+
+    def test_load(self):
+        """The published paths are in the filter, which is built once."""
+        paths = self.filters.load(self.publication)
+        self.assertIn('published/c1', paths)
+        self.assertNotIn('c1', paths)
+        with self.assertNumQueries(0):
+            self.assertIs(self.filters.load(self.publication), paths)
+
+    def test_pass_through(self):
+        """The paths of the repository version of pass-through publications are added."""
+        self.publication.pass_through = True
+        self.assertIn('c1', self.filters.load(self.publication))
+
+    @patch.object(PublishedPathFilters, '_build_in_background')
+    def test_get(self, build_in_background):
+        """Filters that were not built yet are built in the background, not by get()."""
+        with self.assertNumQueries(0):
+            self.assertIsNone(self.filters.get(self.publication))
+        build_in_background.assert_called_once_with(self.publication)
+        paths = self.filters.load(self.publication)
+        self.assertIs(self.filters.get(self.publication), paths)
+
+    def test_evict_and_rebuild(self):
+        """Filters are dropped beyond the total number of paths, and built again."""
+        other = Publication.objects.create(repository_version=self.publication.repository_version,
+                                           complete=True)
+        for relative_path in ('o1', 'o2'):
+            ca = ContentArtifact.objects.create(content=Content.objects.create(),
+                                                relative_path=relative_path)
+            PublishedArtifact.objects.create(publication=other, content_artifact=ca,
+                                             relative_path=relative_path)
+        filters = PublishedPathFilters(2)
+        filters.load(self.publication)
+        filters.load(other)
+        self.assertIsNone(filters.indexes.get(self.publication.pk))
+
+        with patch.object(PublishedPathFilters, '_build_in_background') as build_in_background:
+            self.assertIsNone(filters.get(self.publication))
+        build_in_background.assert_called_once_with(self.publication)
+        self.assertIn('published/c1', filters.load(self.publication))
+        self.assertIsNone(filters.indexes.get(other.pk))
+
+
+class BloomFilterTestCase(SimpleTestCase):
+
+    def test_contains(self):
+        """Added values are contained, others only rarely."""
+        paths = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            paths.add('path/{i}'.format(i=i))
+        self.assertTrue(all('path/{i}'.format(i=i) in paths for i in range(1000)))
+        false_positives = sum('other/{i}'.format(i=i) in paths for i in range(1000))
+        self.assertLess(false_positives, 50)
+
+    def test_empty(self):
+        """An empty filter contains nothing."""
+        self.assertNotIn('path', BloomFilter(0, 0.01))
+
+
+class RepositoryVersionPathsTestCase(TestCase):
+
+    def setUp(self):
+        repository = Repository.objects.create(name='foo')
+        self.version = RepositoryVersion.objects.create(repository=repository, number=1)
+        self.content_artifacts = {}
+        for relative_path in ('c1', 'c2', 'c2'):
+            ca = ContentArtifact.objects.create(content=Content.objects.create(),
+                                                relative_path=relative_path)
+            self.content_artifacts[relative_path] = ca
+        ContentArtifact.objects.create(content=Content.objects.create(), relative_path='c3')
+        self.version.add_content(
+            Content.objects.filter(contentartifact__relative_path__in=['c1', 'c2'])
+        )
+        self.version.complete = True
+        self.version.save()
+        self.paths = RepositoryVersionPaths(10)
+
+    def test_match(self):
+        """Paths of an indexed version are matched to their content artifact without a query."""
+        self.paths.load(self.version)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.paths.match(self.version, 'c1'),
+                             self.content_artifacts['c1'].pk)
+            self.assertIsNone(self.paths.match(self.version, 'c3'))
+
+    def test_multiple(self):
+        """A path of more than one content artifact can't be matched."""
+        self.paths.load(self.version)
+        with self.assertRaises(MultipleObjectsReturned):
+            self.paths.match(self.version, 'c2')
+
+    @patch.object(RepositoryVersionPaths, '_build_in_background')
+    def test_not_indexed(self, build_in_background):
+        """Versions that are not indexed yet are indexed in the background."""
+        with self.assertNumQueries(0):
+            self.assertIs(self.paths.match(self.version, 'c1'), RepositoryVersionPaths.NOT_INDEXED)
+        build_in_background.assert_called_once_with(self.version)
+
+    def test_oversized(self):
+        """Versions with more paths than the indexes can hold are not indexed."""
+        paths = RepositoryVersionPaths(1)
+        self.assertIsNone(paths.load(self.version))
+        with self.assertNumQueries(0):
+            self.assertIsNone(paths.load(self.version))
+            self.assertIs(paths.match(self.version, 'c1'), RepositoryVersionPaths.NOT_INDEXED)
+
+
+class PathIndexesTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.indexes = PathIndexes(3)
+        self.indexes.build = Mock(side_effect=lambda obj: {obj.pk: obj.pk})
+
+    def test_build_in_background(self):
+        """Missing indexes are built in the background and returned once they are."""
+        obj = Mock(pk='a')
+        self.assertIsNone(self.indexes.get(obj))
+        self.indexes._building['a'].result()
+        self.assertEqual(self.indexes.get(obj), {'a': 'a'})
+        self.indexes.build.assert_called_once_with(obj)
+
+    def test_evict_and_rebuild(self):
+        """The least recently used indexes are dropped beyond the paths, and built again."""
+        objs = [Mock(pk=pk) for pk in 'abcd']
+        for obj in objs:
+            self.indexes.load(obj)
+        self.assertEqual(len(self.indexes.indexes), 3)
+        self.assertIsNone(self.indexes.get(objs[0]))
+        self.indexes._building['a'].result()
+        self.assertEqual(self.indexes.get(objs[0]), {'a': 'a'})
+        self.assertIsNone(self.indexes.indexes.get('b'))
+        self.assertEqual(self.indexes.build.call_count, 5)
+
+
+class LRUCacheTestCase(SimpleTestCase):
+
+    def test_get(self):
+        """Cached values are returned and counted as hits."""
+        cache = LRUCache(2)
+        cache.set('a', None)
+        self.assertIsNone(cache.get('a', 'missing'))
+        self.assertEqual(cache.get('b', 'missing'), 'missing')
+        self.assertEqual(cache.stats(), {'size': 1, 'hits': 1, 'misses': 1})
+
+    def test_evict_least_recently_used(self):
+        """The least recently used entry is evicted beyond the size bound."""
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_weigh(self):
+        """Entries count as much as they weigh, values heavier than the cache are not cached."""
+        cache = LRUCache(3, weigh=len)
+        cache.set('a', 'aa')
+        cache.set('b', 'b')
+        self.assertTrue(cache.set('c', 'c'))
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.weight, 2)
+        self.assertFalse(cache.set('d', 'dddd'))
+        self.assertIsNone(cache.get('d'))
+        self.assertEqual(cache.weight, 2)
+
+    @patch('pulpcore.content.cache.time.monotonic')
+    def test_ttl(self, monotonic):
+        """Entries expire after the time to live."""
+        monotonic.return_value = 100
+        cache = LRUCache(2, ttl=10)
+        cache.set('a', 1)
+        monotonic.return_value = 110
+        self.assertEqual(cache.get('a'), 1)
+        monotonic.return_value = 111
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+
+class StreamedCacheTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.cache = StreamedCache(self.directory.name, 10)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def add(self, key, data, sha256=None):
+        writer = self.cache.writer(key, sha256=sha256)
+        writer.write(data)
+        return writer.commit()
+
+    def test_key(self):
+        """Files are keyed by the expected digest, files without one are not cached."""
+        url = 'http://example.com/foo'
+        self.assertEqual(StreamedCache.key(Mock(sha256='abc', url=url)), 'abc')
+        self.assertIsNone(StreamedCache.key(Mock(sha256=None, url=url)))
+
+    def test_get(self):
+        """Committed files are cached."""
+        self.assertIsNone(self.cache.get('abcd'))
+        self.assertTrue(self.add('abcd', b'1234'))
+        with open(self.cache.get('abcd'), 'rb') as f:
+            self.assertEqual(f.read(), b'1234')
+
+    def test_digest_mismatch(self):
+        """Files that do not match the expected digest are not cached."""
+        self.assertFalse(self.add('abcd', b'1234', sha256='abcd'))
+        self.assertIsNone(self.cache.get('abcd'))
+
+    def test_abort(self):
+        """Aborted files are not cached."""
+        writer = self.cache.writer('abcd')
+        writer.write(b'1234')
+        writer.abort()
+        self.assertIsNone(self.cache.get('abcd'))
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_evict(self):
+        """The least recently used files are removed beyond the maximum size."""
+        self.add('aaaa', b'1234')
+        os.utime(self.cache.get('aaaa'), (0, 0))
+        self.add('bbbb', b'1234')
+        os.utime(self.cache.get('bbbb'), (1, 1))
+        self.add('cccc', b'1234')
+        self.assertIsNone(self.cache.get('aaaa'))
+        self.assertIsNotNone(self.cache.get('bbbb'))
+        self.assertIsNotNone(self.cache.get('cccc'))
+
+    def test_content_type(self):
+        """The Content-Type of a file is kept with it, and removed with it."""
+        writer = self.cache.writer('aaaa')
+        writer.content_type = 'text/xml'
+        writer.write(b'1234')
+        writer.commit()
+        self.assertEqual(self.cache.content_type(self.cache.get('aaaa')), 'text/xml')
+        self.add('bbbb', b'1234')
+        self.assertIsNone(self.cache.content_type(self.cache.get('bbbb')))
+
+        os.utime(self.cache.get('aaaa'), (0, 0))
+        self.add('cccc', b'1234')
+        self.assertIsNone(self.cache.get('aaaa'))
+        self.assertEqual(os.listdir(os.path.join(self.directory.name, 'aa')), [])
+
+    def test_size_tracked(self):
+        """The directory is walked once, then only when the cache grew too large."""
+        with patch.object(StreamedCache, '_evict', wraps=self.cache._evict) as evict:
+            self.add('aaaa', b'12')
+            os.utime(self.cache.get('aaaa'), (0, 0))
+            self.add('bbbb', b'12')
+            self.assertEqual(evict.call_count, 1)
+            self.add('cccc', b'1234567')
+            self.assertEqual(evict.call_count, 2)
+        self.assertIsNone(self.cache.get('aaaa'))
+        self.assertIsNotNone(self.cache.get('cccc'))
@@ -0,0 +1,302 @@
+import asyncio
+import ssl
+import time
+from types import SimpleNamespace
+from unittest import skipUnless
+from unittest.mock import Mock, patch
+
+import aiohttp
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+
+from pulpcore.content.downloads import (
+    InFlightDownloads,
+    PullThroughClaims,
+    RemoteRanking,
+    RemoteSessions,
+    UpstreamLimiter,
+    wait_for_background_tasks,
+)
+
+
+class InFlightDownloadsTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.downloads = InFlightDownloads()
+        self.key = InFlightDownloads.key(Mock(remote_id=1, url='http://example.com/foo'))
+
+    def test_start(self):
+        """Only the first download of a key leads."""
+        self.assertTrue(self.downloads.start(self.key))
+        self.assertIn(self.key, self.downloads)
+        self.assertFalse(self.downloads.start(self.key))
+
+    def test_wait(self):
+        """Waiting requests get the artifact saved by the leading download."""
+        artifact = Mock()
+
+        async def lead():
+            self.downloads.start(self.key)
+            await asyncio.sleep(0)
+            self.downloads.finish(self.key, artifact)
+
+        async def run():
+            waiting = asyncio.ensure_future(lead())
+            await asyncio.sleep(0)
+            result = await self.downloads.wait(self.key)
+            await waiting
+            return result
+
+        self.assertIs(asyncio.get_event_loop().run_until_complete(run()), artifact)
+        self.assertNotIn(self.key, self.downloads)
+
+    def test_wait_not_in_flight(self):
+        """Waiting for a download that is not in progress returns None."""
+        result = asyncio.get_event_loop().run_until_complete(self.downloads.wait(self.key))
+        self.assertIsNone(result)
+
+
+class RemoteSessionsTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.sessions = RemoteSessions()
+        self.addCleanup(self.run_until_complete, wait_for_background_tasks())
+        self.addCleanup(self.run_until_complete, self.sessions.close())
+
+    def remote(self, last_updated, **kwargs):
+        fields = dict(pk=1, _last_updated=last_updated, download_concurrency=5, proxy_url=None,
+                      ssl_ca_certificate=None, ssl_client_certificate=None, ssl_client_key=None,
+                      ssl_validation=True)
+        fields.update(kwargs)
+        remote = SimpleNamespace(**fields)
+        factory = SimpleNamespace(session=None)
+
+        def get_downloader(**kwargs):
+            # Like a download factory, which builds the downloaders with one session.
+            if factory.session is None:
+                factory.session = aiohttp.ClientSession()
+            return SimpleNamespace(session=factory.session, proxy=None, **kwargs)
+
+        remote.get_downloader = get_downloader
+        return remote
+
+    def run_until_complete(self, coro):
+        return asyncio.get_event_loop().run_until_complete(coro)
+
+    def get_downloader(self, remote):
+        async def get_downloader():
+            return self.sessions.get_downloader(remote, url='http://example.com/')
+
+        return self.run_until_complete(get_downloader())
+
+    def test_shared(self):
+        """The same instance of an unchanged remote is used for every download."""
+        remote = self.sessions.acquire(self.remote(1))
+        self.sessions.release(remote)
+        self.assertIs(self.sessions.acquire(self.remote(1)), remote)
+
+    def test_session(self):
+        """The downloaders of a remote share a session configured from the remote."""
+        remote = self.sessions.acquire(self.remote(1, proxy_url='http://proxy.example.com/'))
+        downloader = self.get_downloader(remote)
+        self.assertEqual(downloader.url, 'http://example.com/')
+        self.assertEqual(downloader.proxy, 'http://proxy.example.com/')
+        self.assertEqual(downloader.session.connector.limit, 5)
+        self.assertFalse(downloader.session.connector.force_close)
+        self.assertIs(self.get_downloader(remote).session, downloader.session)
+
+    def test_ssl_validation(self):
+        """Remotes without SSL validation don't verify the upstream."""
+        remote = self.sessions.acquire(self.remote(1, ssl_validation=False))
+        context = self.get_downloader(remote).session.connector._ssl
+        self.assertEqual(context.verify_mode, ssl.CERT_NONE)
+        self.assertFalse(context.check_hostname)
+
+    def test_changed(self):
+        """A changed remote gets a new instance, the session of the old one is closed."""
+        old = self.sessions.acquire(self.remote(1))
+        session = self.get_downloader(old).session
+        new = self.sessions.acquire(self.remote(2))
+        self.assertIsNot(new, old)
+        self.assertIsNot(self.get_downloader(new).session, session)
+        self.assertFalse(session.closed)
+
+        self.sessions.release(old)
+        self.run_until_complete(wait_for_background_tasks())
+        self.assertTrue(session.closed)
+
+
+class UpstreamLimiterTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.limiter = UpstreamLimiter()
+        self.remote = SimpleNamespace(pk=1, download_concurrency=1)
+
+    def run_until_complete(self, coro):
+        return asyncio.get_event_loop().run_until_complete(coro)
+
+    def test_limit(self):
+        """Downloads beyond download_concurrency time out waiting for a slot."""
+        slot = self.run_until_complete(self.limiter.acquire(self.remote, timeout=0.01))
+        with self.assertRaises(asyncio.TimeoutError):
+            self.run_until_complete(self.limiter.acquire(self.remote, timeout=0.01))
+        self.limiter.release(slot)
+        slot = self.run_until_complete(self.limiter.acquire(self.remote, timeout=0.01))
+        self.assertIsNotNone(slot)
+
+    def test_timeout_handed_over(self):
+        """A slot handed over to a download as it times out is given back."""
+        slot = self.run_until_complete(self.limiter.acquire(self.remote))
+
+        async def run():
+            waiting = asyncio.ensure_future(self.limiter.acquire(self.remote))
+            await asyncio.sleep(0)
+            self.limiter.release(slot)
+            waiting.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiting
+
+        self.run_until_complete(run())
+        self.assertEqual(slot.taken, 0)
+        self.assertIsNotNone(self.run_until_complete(self.limiter.acquire(self.remote, 0.01)))
+
+    def test_resize(self):
+        """Downloads in progress count against a changed download_concurrency."""
+        self.remote.download_concurrency = 2
+        first = self.run_until_complete(self.limiter.acquire(self.remote, timeout=0.01))
+        self.run_until_complete(self.limiter.acquire(self.remote, timeout=0.01))
+        self.remote.download_concurrency = 1
+        with self.assertRaises(asyncio.TimeoutError):
+            self.run_until_complete(self.limiter.acquire(self.remote, timeout=0.01))
+        self.limiter.release(first)
+        with self.assertRaises(asyncio.TimeoutError):
+            self.run_until_complete(self.limiter.acquire(self.remote, timeout=0.01))
+        self.remote.download_concurrency = 3
+        self.run_until_complete(self.limiter.acquire(self.remote, timeout=0.01))
+        self.assertEqual(first.taken, 2)
+
+    def test_unlimited(self):
+        """A download_concurrency of 0 does not limit downloads."""
+        self.remote.download_concurrency = 0
+        self.assertIsNone(self.run_until_complete(self.limiter.acquire(self.remote)))
+
+
+class RemoteRankingTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.ranking = RemoteRanking()
+        self.remote_artifacts = [Mock(remote_id=remote_id) for remote_id in (1, 2, 3)]
+
+    def sorted_remote_ids(self):
+        return [ra.remote_id for ra in self.ranking.sort(self.remote_artifacts)]
+
+    def test_latency(self):
+        """Remotes that respond faster rank first, unknown remotes are tried first."""
+        self.ranking.success(1, 2.0)
+        self.ranking.success(2, 0.5)
+        self.assertEqual(self.sorted_remote_ids(), [3, 2, 1])
+
+    def test_errors(self):
+        """Remotes that keep failing rank behind the ones that respond."""
+        self.ranking.success(1, 2.0)
+        self.ranking.success(2, 0.5)
+        for _ in range(3):
+            self.ranking.failure(2)
+        self.ranking.failure(3)
+        self.assertEqual(self.sorted_remote_ids(), [1, 2, 3])
+
+
+@patch.object(PullThroughClaims, 'POLL_INTERVAL', 0.01)
+class PullThroughClaimsWaitTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.claims = PullThroughClaims()
+        self.key = (1, 'http://example.com/foo')
+        self.addCleanup(self.run_until_complete, self.claims.close())
+
+    def run_until_complete(self, coro):
+        return asyncio.get_event_loop().run_until_complete(coro)
+
+    def wait(self, *timeouts):
+        async def run():
+            return await asyncio.gather(*(self.claims.wait(self.key, timeout)
+                                          for timeout in timeouts))
+
+        return self.run_until_complete(run())
+
+    @patch.object(PullThroughClaims, '_is_free', side_effect=[False, False, True])
+    def test_shared(self, is_free):
+        """Requests waiting for the same claim share the checks."""
+        self.assertEqual(self.wait(1, 1, 1), [True, True, True])
+        self.assertEqual(is_free.call_count, 3)
+
+    @patch.object(PullThroughClaims, '_is_free', return_value=False)
+    def test_backoff(self, is_free):
+        """The interval between the checks doubles up to MAX_POLL_INTERVAL."""
+        now = [0]
+        delays = []
+
+        async def sleep(delay):
+            delays.append(delay)
+            now[0] += delay
+
+        with patch('pulpcore.content.downloads.asyncio.sleep', sleep), \
+                patch('pulpcore.content.downloads.time.monotonic', lambda: now[0]):
+            self.assertEqual(self.wait(10), [False])
+        self.assertEqual(delays[:4], [0.01, 0.02, 0.04, 0.08])
+        self.assertEqual(max(delays), PullThroughClaims.MAX_POLL_INTERVAL)
+        self.assertEqual(is_free.call_count, len(delays) + 1)
+
+    @patch.object(PullThroughClaims, '_is_free', return_value=False)
+    def test_timeout(self, is_free):
+        """Each request stops waiting at its own timeout."""
+        start = time.monotonic()
+        self.assertEqual(self.wait(0.05, 0.2), [False, False])
+        self.assertLess(time.monotonic() - start, 1)
+        # The check stops at the longest timeout.
+        self.run_until_complete(asyncio.sleep(0.1))
+        self.assertNotIn(self.key, self.claims._polls)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Claims are advisory locks of PostgreSQL')
+class PullThroughClaimsTestCase(TestCase):
+
+    def setUp(self):
+        # Each instance claims on its own connection, like separate processes do.
+        self.claims = PullThroughClaims()
+        self.other_process = PullThroughClaims()
+        self.key = (1, 'http://example.com/foo')
+
+    def tearDown(self):
+        self.run_until_complete(self.claims.close())
+        self.run_until_complete(self.other_process.close())
+
+    def run_until_complete(self, coro):
+        return asyncio.get_event_loop().run_until_complete(coro)
+
+    def test_claim(self):
+        """A download can only be claimed once until the claim is released."""
+        self.assertTrue(self.run_until_complete(self.claims.claim(self.key)))
+        self.assertFalse(self.run_until_complete(self.claims.claim(self.key)))
+        self.assertFalse(self.run_until_complete(self.other_process.claim(self.key)))
+
+        self.run_until_complete(self.claims.release(self.key))
+        self.assertTrue(self.run_until_complete(self.other_process.claim(self.key)))
+
+    def test_wait(self):
+        """Waiting for a claim returns when it is released, or times out."""
+        self.run_until_complete(self.claims.claim(self.key))
+        self.assertFalse(self.run_until_complete(self.other_process.wait(self.key, 0.2)))
+
+        self.run_until_complete(self.claims.release(self.key))
+        self.assertTrue(self.run_until_complete(self.other_process.wait(self.key, 1)))
+
+    def test_claims_held_together(self):
+        """Taking another claim keeps the claims already held."""
+        other_key = (1, 'http://example.com/bar')
+        self.assertTrue(self.run_until_complete(self.claims.claim(self.key)))
+        self.assertTrue(self.run_until_complete(self.claims.claim(other_key)))
+
+        self.assertFalse(self.run_until_complete(self.other_process.claim(self.key)))
+        self.assertFalse(self.run_until_complete(self.other_process.wait(self.key, 0)))
+        self.assertFalse(self.run_until_complete(self.other_process.claim(other_key)))
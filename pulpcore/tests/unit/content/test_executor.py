@@ -0,0 +1,41 @@
+import asyncio
+from unittest.mock import Mock, patch
+
+from django.test import SimpleTestCase
+
+from pulpcore.content.executor import close_broken_connections, run_in_database_thread
+
+
+class CloseBrokenConnectionsTestCase(SimpleTestCase):
+
+    def connection(self, errors_occurred, usable):
+        connection = Mock(errors_occurred=errors_occurred)
+        connection.is_usable.return_value = usable
+        return connection
+
+    @patch('pulpcore.content.executor.connections')
+    def test_close_broken(self, connections):
+        """Only connections that had an error and don't work anymore are closed."""
+        healthy = self.connection(errors_occurred=False, usable=True)
+        recovered = self.connection(errors_occurred=True, usable=True)
+        broken = self.connection(errors_occurred=True, usable=False)
+        connections.all.return_value = [healthy, recovered, broken]
+
+        close_broken_connections()
+        healthy.close.assert_not_called()
+        healthy.is_usable.assert_not_called()
+        recovered.close.assert_not_called()
+        self.assertFalse(recovered.errors_occurred)
+        broken.close.assert_called_once_with()
+
+    @patch('pulpcore.content.executor.close_broken_connections')
+    def test_run_in_database_thread(self, close_broken_connections):
+        """Broken connections are closed after every call, also when it fails."""
+        def fail():
+            raise RuntimeError()
+
+        loop = asyncio.get_event_loop()
+        self.assertEqual(loop.run_until_complete(run_in_database_thread(abs, -1)), 1)
+        with self.assertRaises(RuntimeError):
+            loop.run_until_complete(run_in_database_thread(fail))
+        self.assertEqual(close_broken_connections.call_count, 2)
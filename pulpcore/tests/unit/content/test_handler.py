@@ -1,10 +1,22 @@
-from unittest.mock import Mock
+import asyncio
+import threading
+from tempfile import TemporaryDirectory
+from unittest.mock import Mock, patch
 
+from aiohttp.web_exceptions import HTTPForbidden
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase, override_settings
 
 from pulpcore.content import Handler
-from pulpcore.plugin.models import Artifact, Content, ContentArtifact
+from pulpcore.content.cache import DistributionCache, LRUCache, StreamedCache
+from pulpcore.content.downloads import InFlightDownloads, wait_for_background_tasks
+from pulpcore.plugin.models import (
+    Artifact,
+    BaseDistribution,
+    Content,
+    ContentArtifact,
+    Remote,
+)
 
 
 class HandlerSaveContentTestCase(TestCase):
@@ -44,3 +56,267 @@ class HandlerSaveContentTestCase(TestCase):
         c2 = Content.objects.get(pk=self.c2.pk)
         self.assertEqual(existing_artifact.pk, new_artifact.pk)
         self.assertEqual(c2._artifacts.get().pk, existing_artifact.pk)
+
+
+class HandlerMatchDistributionTestCase(TestCase):
+
+    def setUp(self):
+        self.remote = Remote.objects.create(name='foo', url='http://example.com/')
+        self.distribution = BaseDistribution.objects.create(name='foo', base_path='foo/bar',
+                                                            remote=self.remote)
+
+    def assert_prepared(self, distribution):
+        self.assertEqual(distribution.pk, self.distribution.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(distribution.remote.pk, self.remote.pk)
+            self.assertIsNone(distribution.content_guard)
+
+    @override_settings(CONTENT_APP_CACHE_REFRESH_INTERVAL=0)
+    def test_not_cached(self):
+        """Distributions matched in the database have their relations loaded."""
+        with self.assertNumQueries(1):
+            distribution = Handler._match_distribution('foo/bar/baz')
+        self.assert_prepared(distribution)
+
+    @patch('pulpcore.content.handler.distribution_cache')
+    def test_added_to_cache(self, distribution_cache):
+        """Distributions missing from the cache have their relations loaded before caching."""
+        distribution_cache.get.return_value = None
+        distribution_cache.query.side_effect = DistributionCache.query
+        distribution = Handler._match_distribution('foo/bar/baz')
+        self.assert_prepared(distribution)
+        distribution_cache.add.assert_called_once_with(BaseDistribution, distribution)
+
+
+class HandlerPermitTestCase(SimpleTestCase):
+
+    def setUp(self):
+        patcher = patch('pulpcore.content.handler.permit_cache', LRUCache(10))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.guard = Mock(pk=1, _last_updated=None)
+        self.guard.cast.return_value = self.guard
+        self.distribution = Mock(content_guard_id=1, content_guard=self.guard)
+
+    def test_cached(self):
+        """Decisions of guards that opt in are cached for the credentials."""
+        self.guard.permit_cache_key.return_value = 'abc'
+        Handler._permit(Mock(), self.distribution)
+        Handler._permit(Mock(), self.distribution)
+        self.assertEqual(self.guard.permit.call_count, 1)
+
+    def test_cached_denied(self):
+        """Denials are cached as well."""
+        self.guard.permit_cache_key.return_value = 'abc'
+        self.guard.permit.side_effect = PermissionError('denied')
+        for _ in range(2):
+            with self.assertRaises(HTTPForbidden):
+                Handler._permit(Mock(), self.distribution)
+        self.assertEqual(self.guard.permit.call_count, 1)
+
+    def test_not_cached(self):
+        """Decisions of other guards are not cached."""
+        self.guard.permit_cache_key.return_value = None
+        Handler._permit(Mock(), self.distribution)
+        Handler._permit(Mock(), self.distribution)
+        self.assertEqual(self.guard.permit.call_count, 2)
+
+
+class HandlerIsNotPublishedTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.publication = Mock(pk=1, complete=True)
+        self.filters = Mock()
+        self.filters.get.return_value = {'published'}
+        patcher = patch('pulpcore.content.handler.published_path_filters', self.filters)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def distribution(self, **kwargs):
+        fields = dict(remote_id=None, repository_id=None, repository_version_id=None)
+        fields.update(kwargs)
+        return Mock(spec=list(fields), **fields)
+
+    def test_not_published(self):
+        """Paths missing from the filter of the publication are ruled out."""
+        distribution = self.distribution()
+        self.assertTrue(Handler._is_not_published(distribution, self.publication, 'missing'))
+        self.assertFalse(Handler._is_not_published(distribution, self.publication, 'published'))
+
+    def test_not_built(self):
+        """Paths are not ruled out while the filter is not built yet."""
+        self.filters.get.return_value = None
+        self.assertFalse(Handler._is_not_published(self.distribution(), self.publication,
+                                                   'missing'))
+
+    def test_other_sources(self):
+        """Paths of distributions that serve more than the publication are not ruled out."""
+        for field in ('remote_id', 'repository_id', 'repository_version_id'):
+            distribution = self.distribution(**{field: 1})
+            self.assertFalse(Handler._is_not_published(distribution, self.publication, 'missing'))
+
+    def test_publication_distribution(self):
+        """Distributions without repository fields are ruled out by the filter alone."""
+        distribution = Mock(spec=['remote_id'], remote_id=None)
+        self.assertTrue(Handler._is_not_published(distribution, self.publication, 'missing'))
+
+
+class HandlerStreamRemoteArtifactTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.remote = Mock(pk=1, policy=Remote.STREAMED, download_concurrency=0)
+        self.remote.cast.return_value = self.remote
+        self.remote_artifact = Mock(remote_id=1, url='http://example.com/foo', remote=self.remote,
+                                    sha256=None)
+
+        async def run():
+            self.registered = InFlightDownloads.key(self.remote_artifact) in self.downloads
+            return Mock()
+
+        self.remote.get_downloader.return_value.run = run
+        self.response = Mock()
+
+        async def write_eof():
+            pass
+
+        self.response.write_eof = write_eof
+        self.downloads = InFlightDownloads()
+        patcher = patch('pulpcore.content.handler.in_flight_downloads', self.downloads)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stream(self):
+        coro = Handler()._stream_remote_artifact(Mock(), self.response, self.remote_artifact)
+        return asyncio.get_event_loop().run_until_complete(asyncio.wait_for(coro, 1))
+
+    def test_streamed_not_coalesced(self):
+        """Downloads of streamed remotes don't wait for a download in progress."""
+        key = InFlightDownloads.key(self.remote_artifact)
+        self.downloads.start(key)
+        self.assertIs(self.stream(), self.response)
+        self.remote.get_downloader.assert_called_once()
+        # The download in progress was neither joined nor finished.
+        self.assertIn(key, self.downloads)
+
+    def test_streamed_not_registered(self):
+        """Downloads of streamed remotes are not registered for others to wait for."""
+        self.stream()
+        self.assertFalse(self.registered)
+
+
+class HandlerFinalizeDownloadTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.remote = Mock(pk=1, policy=Remote.ON_DEMAND, download_concurrency=0)
+        self.remote.cast.return_value = self.remote
+        self.remote_artifact = Mock(remote_id=1, url='http://example.com/foo', remote=self.remote,
+                                    sha256=None)
+        self.key = InFlightDownloads.key(self.remote_artifact)
+
+        async def run():
+            return Mock()
+
+        self.remote.get_downloader.return_value.run = run
+        self.response = Mock()
+        self.completed = False
+
+        async def write_eof():
+            self.completed = True
+
+        self.response.write_eof = write_eof
+        self.released = []
+        self.claims = []
+
+        async def claim(key):
+            return self.claims.pop(0) if self.claims else True
+
+        async def release(key):
+            self.released.append(key)
+
+        claims = Mock(claim=claim, release=release)
+        self.downloads = InFlightDownloads()
+        for patcher in (patch('pulpcore.content.handler.pull_through_claims', claims),
+                        patch('pulpcore.content.handler.in_flight_downloads', self.downloads)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_until_complete(self, coro):
+        return asyncio.get_event_loop().run_until_complete(asyncio.wait_for(coro, 1))
+
+    def stream(self):
+        return self.run_until_complete(
+            Handler()._stream_remote_artifact(Mock(), self.response, self.remote_artifact)
+        )
+
+    def test_response_before_save(self):
+        """The response is completed without waiting for the artifact to be saved."""
+        saving = threading.Event()
+        saved = threading.Event()
+
+        def save_artifact(download_result, remote_artifact):
+            saving.wait(1)
+            saved.set()
+            return Mock()
+
+        with patch.object(Handler, '_save_artifact', side_effect=save_artifact) as save:
+            self.assertIs(self.stream(), self.response)
+            self.assertTrue(self.completed)
+            self.assertFalse(saved.is_set())
+            self.assertIn(self.key, self.downloads)
+            saving.set()
+            self.run_until_complete(wait_for_background_tasks())
+        save.assert_called_once()
+        self.assertTrue(saved.is_set())
+        self.assertNotIn(self.key, self.downloads)
+        self.assertEqual(self.released, [self.key])
+
+    def test_claimed_after_wait(self):
+        """The download is saved if the claim was released without saving the artifact."""
+        self.claims = [False, True]
+
+        async def wait_for_saved_artifact(key, remote_artifact):
+            return None
+
+        with patch.object(Handler, '_wait_for_saved_artifact',
+                          side_effect=wait_for_saved_artifact) as wait, \
+                patch.object(Handler, '_save_artifact', return_value=Mock()) as save:
+            self.assertIs(self.stream(), self.response)
+            self.run_until_complete(wait_for_background_tasks())
+        wait.assert_called_once()
+        save.assert_called_once()
+        self.assertEqual(self.released, [self.key])
+
+    def test_save_failed(self):
+        """A failed save is logged, not raised, and the download is finished."""
+        with patch.object(Handler, '_save_artifact', side_effect=RuntimeError()), \
+                self.assertLogs('pulpcore.content.handler', 'ERROR'):
+            self.assertIs(self.stream(), self.response)
+            self.run_until_complete(wait_for_background_tasks())
+        self.assertTrue(self.completed)
+        self.assertNotIn(self.key, self.downloads)
+        self.assertEqual(self.released, [self.key])
+
+
+class HandlerStreamedCacheTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.cache = StreamedCache(self.directory.name, 100)
+        patcher = patch('pulpcore.content.handler.streamed_cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_content_type(self):
+        """Cached files are sent with the Content-Type they were downloaded with."""
+        writer = self.cache.writer('abcd')
+        writer.content_type = 'text/xml'
+        writer.write(b'<xml/>')
+        writer.commit()
+        response = Handler._get_streamed_file('abcd')
+        self.assertEqual(response.headers['Content-Type'], 'text/xml')
+        self.assertEqual(response.headers['ETag'], '"abcd"')
+
+    def test_not_cached(self):
+        """Files that are not cached are downloaded."""
+        self.assertIsNone(Handler._get_streamed_file('abcd'))
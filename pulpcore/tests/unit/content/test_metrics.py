@@ -0,0 +1,106 @@
+import asyncio
+from tempfile import NamedTemporaryFile
+from unittest.mock import patch
+
+from aiohttp.test_utils import make_mocked_request
+from aiohttp.web import FileResponse
+from aiohttp.web_exceptions import HTTPForbidden
+from django.test import SimpleTestCase
+
+from pulpcore.content.metrics import (
+    BYTES_SERVED,
+    OUTCOME,
+    REQUEST_START,
+    Counter,
+    Histogram,
+    metrics_view,
+    on_response_prepare,
+)
+
+
+class CounterTestCase(SimpleTestCase):
+
+    def test_render(self):
+        """Counters are rendered with their labels."""
+        counter = Counter('test_counter_total', 'A test counter.', ['outcome'])
+        counter.inc(outcome='hit')
+        counter.inc(2, outcome='hit')
+        self.assertEqual(counter.get(outcome='hit'), 3)
+        self.assertEqual(counter.render(), (
+            '# HELP test_counter_total A test counter.\n'
+            '# TYPE test_counter_total counter\n'
+            'test_counter_total{outcome="hit"} 3\n'
+        ))
+
+    def test_labels(self):
+        """All labels of a counter must be given."""
+        counter = Counter('test_labels_total', 'A test counter.', ['outcome'])
+        with self.assertRaises(ValueError):
+            counter.inc()
+
+
+class HistogramTestCase(SimpleTestCase):
+
+    def test_render(self):
+        """Histograms are rendered as cumulative buckets, sum and count."""
+        histogram = Histogram('test_seconds', 'A test histogram.', buckets=(0.1, 1.0))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+        self.assertEqual(histogram.count(), 3)
+        self.assertEqual(histogram.render(), (
+            '# HELP test_seconds A test histogram.\n'
+            '# TYPE test_seconds histogram\n'
+            'test_seconds_bucket{le="0.1"} 1\n'
+            'test_seconds_bucket{le="1.0"} 2\n'
+            'test_seconds_bucket{le="+Inf"} 3\n'
+            'test_seconds_sum 5.55\n'
+            'test_seconds_count 3\n'
+        ))
+
+
+class MetricsViewTestCase(SimpleTestCase):
+
+    def view(self, remote):
+        request = make_mocked_request('GET', '/metrics').clone(remote=remote)
+        return asyncio.get_event_loop().run_until_complete(metrics_view(request))
+
+    def test_local(self):
+        """Local clients get the metrics."""
+        for remote in ('127.0.0.1', '::1', '::ffff:127.0.0.1', ''):
+            self.assertEqual(self.view(remote).status, 200)
+
+    def test_remote(self):
+        """Other clients are denied."""
+        for remote in ('10.0.0.1', '2001:db8::1'):
+            with self.assertRaises(HTTPForbidden):
+                self.view(remote)
+
+
+class OnResponsePrepareTestCase(SimpleTestCase):
+
+    def setUp(self):
+        patcher = patch.object(BYTES_SERVED, '_values', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.file = NamedTemporaryFile()
+        self.addCleanup(self.file.close)
+
+    def prepare(self, method, status):
+        request = make_mocked_request(method, '/')
+        request[REQUEST_START] = 0
+        request[OUTCOME] = 'test'
+        response = FileResponse(self.file.name, status=status)
+        response.content_length = 10
+        asyncio.get_event_loop().run_until_complete(on_response_prepare(request, response))
+        return BYTES_SERVED.get(outcome='test')
+
+    def test_body(self):
+        """The bytes of file bodies are counted."""
+        self.assertEqual(self.prepare('GET', 200), 10)
+        self.assertEqual(self.prepare('GET', 206), 20)
+
+    def test_no_body(self):
+        """Responses without a body are not counted."""
+        self.assertEqual(self.prepare('HEAD', 200), 0)
+        self.assertEqual(self.prepare('GET', 304), 0)
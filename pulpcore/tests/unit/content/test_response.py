@@ -0,0 +1,145 @@
+import asyncio
+from tempfile import NamedTemporaryFile
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer, make_mocked_request
+from django.test import SimpleTestCase
+
+from pulpcore.content.response import ArtifactResponse, etag_matches
+
+
+class EtagMatchesTestCase(SimpleTestCase):
+
+    def test_strong(self):
+        """Strong comparison only matches strong entity-tags."""
+        self.assertTrue(etag_matches('"abc"', '"xyz", "abc"'))
+        self.assertFalse(etag_matches('"abc"', 'W/"abc"'))
+        self.assertFalse(etag_matches('"abc"', '"xyz"'))
+
+    def test_weak(self):
+        """Weak comparison also matches weak entity-tags."""
+        self.assertTrue(etag_matches('"abc"', 'W/"abc"', weak=True))
+
+    def test_any(self):
+        """A `*` matches any entity-tag."""
+        self.assertTrue(etag_matches('"abc"', '*'))
+
+
+class ArtifactResponseTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.file = NamedTemporaryFile()
+        self.file.write(b'0123456789')
+        self.file.flush()
+
+    def tearDown(self):
+        self.file.close()
+
+    def prepare(self, method, headers):
+        response = ArtifactResponse(self.file.name, sha256='abc')
+        request = make_mocked_request(method, '/', headers=headers)
+        asyncio.get_event_loop().run_until_complete(response.prepare(request))
+        return response
+
+    def test_etag(self):
+        """The SHA-256 digest is the ETag of the response."""
+        response = self.prepare('HEAD', {})
+        self.assertEqual(response.headers['ETag'], '"abc"')
+
+    def test_if_none_match(self):
+        """A matching If-None-Match is answered with 304."""
+        response = self.prepare('GET', {'If-None-Match': '"abc"'})
+        self.assertEqual(response.status, 304)
+
+    def test_if_match(self):
+        """An If-Match that does not match is answered with 412."""
+        response = self.prepare('GET', {'If-Match': '"xyz"'})
+        self.assertEqual(response.status, 412)
+
+    def test_head(self):
+        """HEAD is answered with the headers of the whole file."""
+        response = self.prepare('HEAD', {})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.content_length, 10)
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+
+    def fetch(self, method, headers, sha256='abc'):
+        async def handler(request):
+            return ArtifactResponse(self.file.name, sha256=sha256)
+
+        async def run():
+            app = web.Application()
+            app.router.add_route('*', '/', handler)
+            async with TestClient(TestServer(app)) as client:
+                async with client.request(method, '/', headers=headers) as response:
+                    return response.status, response.headers, await response.read()
+
+        return asyncio.get_event_loop().run_until_complete(run())
+
+    def test_range(self):
+        """A Range is answered with 206 and the requested bytes."""
+        status, headers, body = self.fetch('GET', {'Range': 'bytes=2-4'})
+        self.assertEqual(status, 206)
+        self.assertEqual(headers['Content-Range'], 'bytes 2-4/10')
+        self.assertEqual(body, b'234')
+
+    def test_range_not_satisfiable(self):
+        """A Range beyond the end of the file is answered with 416."""
+        status, headers, body = self.fetch('GET', {'Range': 'bytes=20-'})
+        self.assertEqual(status, 416)
+        self.assertEqual(headers['Content-Range'], 'bytes */10')
+
+    def test_if_range(self):
+        """A Range is only honoured if the If-Range entity-tag matches."""
+        status, headers, body = self.fetch('GET', {'Range': 'bytes=2-4', 'If-Range': '"abc"'})
+        self.assertEqual(status, 206)
+        self.assertEqual(headers['ETag'], '"abc"')
+        self.assertEqual(body, b'234')
+
+        status, _headers, body = self.fetch('GET', {'Range': 'bytes=2-4', 'If-Range': '"xyz"'})
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b'0123456789')
+
+    def test_if_modified_since(self):
+        """An If-Modified-Since after the modification of the file is answered with 304."""
+        status, _headers, body = self.fetch('GET', {
+            'If-Modified-Since': 'Fri, 31 Dec 2100 23:59:59 GMT'
+        })
+        self.assertEqual(status, 304)
+        self.assertEqual(body, b'')
+
+        status, _headers, body = self.fetch('GET', {
+            'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'
+        })
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b'0123456789')
+
+    def test_head_without_body(self):
+        """HEAD is answered without a body."""
+        status, headers, body = self.fetch('HEAD', {})
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['Content-Length'], '10')
+        self.assertEqual(headers['ETag'], '"abc"')
+        self.assertEqual(body, b'')
+
+    def test_resume(self):
+        """A download is resumed with the ETag of the response it started with."""
+        for sha256 in ('abc', None):
+            status, headers, body = self.fetch('GET', {}, sha256=sha256)
+            self.assertEqual(status, 200)
+            etag = headers['ETag']
+            if sha256:
+                self.assertEqual(etag, '"abc"')
+
+            status, headers, body = self.fetch('GET', {'Range': 'bytes=4-', 'If-Range': etag},
+                                               sha256=sha256)
+            self.assertEqual(status, 206)
+            self.assertEqual(headers['ETag'], etag)
+            self.assertEqual(body, b'456789')
+
+    def test_if_match_matches(self):
+        """A matching If-Match sends the file."""
+        status, headers, body = self.fetch('GET', {'If-Match': '"abc"'})
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['ETag'], '"abc"')
+        self.assertEqual(body, b'0123456789')
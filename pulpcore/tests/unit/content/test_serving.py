@@ -0,0 +1,129 @@
+import asyncio
+from itertools import count
+from tempfile import TemporaryDirectory
+from unittest.mock import Mock, patch
+
+from aiohttp.test_utils import make_mocked_coro, make_mocked_request
+from aiohttp.web_exceptions import HTTPFound
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, Storage
+from django.test import SimpleTestCase, override_settings
+
+from pulpcore.content.cache import LRUCache, signed_url_ttl
+from pulpcore.content.response import ArtifactResponse
+from pulpcore.content.serving import (
+    FileStrategy,
+    LocalCacheStrategy,
+    ProxyStrategy,
+    RedirectStrategy,
+    get_serving_strategy,
+)
+
+
+class ObjectStorage(Storage):
+    """
+    An in-memory stand-in for an object store like S3, which signs the URLs of its files.
+    """
+
+    querystring_auth = True
+    querystring_expire = 3600
+
+    def __init__(self):
+        self.objects = {}
+        self.signatures = count()
+
+    def _open(self, name, mode='rb'):
+        return ContentFile(self.objects[name], name=name)
+
+    def _save(self, name, content):
+        self.objects[name] = content.read()
+        return name
+
+    def delete(self, name):
+        del self.objects[name]
+
+    def exists(self, name):
+        return name in self.objects
+
+    def size(self, name):
+        return len(self.objects[name])
+
+    def url(self, name):
+        return 'https://objects.example.com/{name}?Signature={signature}'.format(
+            name=name, signature=next(self.signatures)
+        )
+
+
+class StorageServingTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+        self.storage = ObjectStorage()
+        self.file = Mock()
+        self.file.name = self.storage.save('artifact/ab/cdef', ContentFile(b'0123456789'))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def serve(self, strategy, method='GET', writer=None, **kwargs):
+        request = make_mocked_request(method, '/', **({'writer': writer} if writer else {}))
+        return asyncio.get_event_loop().run_until_complete(
+            strategy.serve(request, self.file, **kwargs)
+        )
+
+    def test_default(self):
+        """Storages with local paths are served from files, others by redirects."""
+        self.assertIsInstance(get_serving_strategy(storage=self.storage), RedirectStrategy)
+        local = FileSystemStorage(location=self.dir.name)
+        self.assertIsInstance(get_serving_strategy(storage=local), FileStrategy)
+        self.assertIsInstance(get_serving_strategy('proxy', storage=local), ProxyStrategy)
+
+    def test_redirect(self):
+        """Signed URLs are reused while they are valid."""
+        strategy = RedirectStrategy(self.storage)
+        with patch('pulpcore.content.serving.signed_url_cache', LRUCache(10, ttl=60)):
+            with self.assertRaises(HTTPFound) as first:
+                self.serve(strategy)
+            with self.assertRaises(HTTPFound) as second:
+                self.serve(strategy)
+        self.assertEqual(first.exception.location, second.exception.location)
+
+    def test_redirect_not_cached(self):
+        """Without the cache every request gets a newly signed URL."""
+        strategy = RedirectStrategy(self.storage)
+        with patch('pulpcore.content.serving.signed_url_cache', None):
+            self.assertNotEqual(strategy.url(self.file.name), strategy.url(self.file.name))
+
+    @override_settings(CONTENT_APP_SIGNED_URL_TTL=None, CONTENT_APP_PATH_CACHE_TTL=3600)
+    def test_signed_url_ttl(self):
+        """Signed URLs expire from the cache shortly before they expire in the storage."""
+        self.assertEqual(signed_url_ttl(self.storage), 3540)
+        self.storage.querystring_expire = 10
+        self.assertEqual(signed_url_ttl(self.storage), 5)
+        self.storage.querystring_auth = False
+        self.assertEqual(signed_url_ttl(self.storage), 3600)
+        self.assertIsNone(signed_url_ttl(FileSystemStorage(location=self.dir.name)))
+
+    def test_proxy(self):
+        """Files are streamed from the storage."""
+        writer = Mock(write=make_mocked_coro(None), write_eof=make_mocked_coro(None),
+                      write_headers=make_mocked_coro(None), drain=make_mocked_coro(None))
+        response = self.serve(ProxyStrategy(self.storage), writer=writer, sha256='abc')
+        self.assertEqual(response.content_length, 10)
+        self.assertEqual(response.headers['ETag'], '"abc"')
+        data = b''.join(call[0][0] for call in writer.write.call_args_list)
+        self.assertEqual(data, b'0123456789')
+
+    def test_local_cache(self):
+        """Files are copied to the local cache and sent from there."""
+        with TemporaryDirectory() as cache_dir, \
+                self.settings(CONTENT_APP_STORAGE_CACHE_DIR=cache_dir,
+                              CONTENT_APP_STORAGE_CACHE_SIZE=1024):
+            strategy = LocalCacheStrategy(self.storage)
+            response = self.serve(strategy)
+            self.assertIsInstance(response, ArtifactResponse)
+            with open(response._path, 'rb') as cached:
+                self.assertEqual(cached.read(), b'0123456789')
+
+            self.storage.delete(self.file.name)
+            self.assertEqual(self.serve(strategy)._path, response._path)
@@ -0,0 +1,112 @@
+import signal
+import time
+from unittest.mock import Mock, patch
+
+from django.test import SimpleTestCase
+
+from pulpcore.content.supervisor import Supervisor, main
+
+
+@patch('pulpcore.content.supervisor.os.kill')
+@patch('pulpcore.content.supervisor.os.fork')
+class SupervisorTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.supervisor = Supervisor(2, reuse_port=True)
+
+    @patch('pulpcore.content.supervisor.signal.signal')
+    @patch('pulpcore.content.supervisor.os.wait', side_effect=ChildProcessError)
+    def test_run(self, wait, signal_, fork, kill):
+        """The workers are forked when the supervisor starts."""
+        fork.side_effect = [101, 102]
+        self.assertEqual(self.supervisor.run(), 0)
+        self.assertEqual(fork.call_count, 2)
+        self.assertEqual(set(self.supervisor._current), {101, 102})
+        signal_.assert_any_call(signal.SIGHUP, self.supervisor._restart)
+
+    @patch('pulpcore.content.supervisor.logging.shutdown')
+    @patch('pulpcore.content.supervisor.os._exit')
+    def test_worker(self, exit, shutdown, fork, kill):
+        """Forked workers run the Content App and exit with its status."""
+        fork.return_value = 0
+        with patch.object(Supervisor, '_run_worker') as run_worker:
+            self.supervisor._spawn()
+            run_worker.assert_called_once_with()
+            exit.assert_called_once_with(0)
+
+            exit.reset_mock()
+            run_worker.side_effect = RuntimeError()
+            with self.assertLogs('pulpcore.content.supervisor', 'ERROR'):
+                self.supervisor._spawn()
+            exit.assert_called_once_with(1)
+
+    def test_respawn(self, fork, kill):
+        """Workers that exit unexpectedly are replaced."""
+        self.supervisor._current = {101: time.monotonic() - 10, 102: time.monotonic() - 10}
+        fork.return_value = 103
+        self.supervisor._reap(101, 256)
+        fork.assert_called_once_with()
+        self.assertEqual(set(self.supervisor._current), {102, 103})
+
+    @patch('pulpcore.content.supervisor.time.sleep')
+    def test_respawn_delayed(self, sleep, fork, kill):
+        """Workers that exit right after starting are replaced after a delay."""
+        self.supervisor._current = {101: time.monotonic()}
+        fork.return_value = 102
+        self.supervisor._reap(101, 256)
+        sleep.assert_called_once()
+        self.assertEqual(set(self.supervisor._current), {102})
+
+    def test_restart(self, fork, kill):
+        """SIGHUP starts new workers, then asks the old ones to exit without replacing them."""
+        self.supervisor._current = {101: time.monotonic(), 102: time.monotonic()}
+        fork.side_effect = [201, 202]
+        self.supervisor._restart(signal.SIGHUP, None)
+        self.assertEqual(set(self.supervisor._current), {201, 202})
+        self.assertEqual(self.supervisor._retiring, {101, 102})
+        kill.assert_any_call(101, signal.SIGTERM)
+        kill.assert_any_call(102, signal.SIGTERM)
+
+        self.supervisor._reap(101, 0)
+        self.assertEqual(fork.call_count, 2)
+        self.assertEqual(self.supervisor._retiring, {102})
+
+    def test_stop(self, fork, kill):
+        """SIGTERM asks all workers to exit without replacing them."""
+        self.supervisor._current = {101: time.monotonic()}
+        self.supervisor._stop(signal.SIGTERM, None)
+        kill.assert_called_once_with(101, signal.SIGTERM)
+        self.supervisor._reap(101, 0)
+        fork.assert_not_called()
+        self.assertFalse(self.supervisor._current or self.supervisor._retiring)
+
+
+class SupervisorBindTestCase(SimpleTestCase):
+
+    def test_bind(self):
+        """The shared listening sockets are inherited by the workers."""
+        sockets = Supervisor(2, host='127.0.0.1', port=0)._bind()
+        try:
+            self.assertEqual(len(sockets), 1)
+            self.assertTrue(sockets[0].get_inheritable())
+        finally:
+            for sock in sockets:
+                sock.close()
+
+
+@patch('pulpcore.content.supervisor.server', new_callable=Mock)
+@patch('pulpcore.content.supervisor.web.run_app')
+class MainTestCase(SimpleTestCase):
+
+    def test_single_worker(self, run_app, server):
+        """A single worker listens on all interfaces by default, without a supervisor."""
+        main([])
+        run_app.assert_called_once_with(server.return_value, host=None, port=24816)
+
+    @patch.object(Supervisor, 'run', return_value=0)
+    def test_workers(self, run, run_app, server):
+        """Several workers are run by a supervisor."""
+        with self.assertRaises(SystemExit):
+            main(['--workers', '4'])
+        run.assert_called_once_with()
+        run_app.assert_not_called()
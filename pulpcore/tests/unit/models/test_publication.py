@@ -0,0 +1,45 @@
+import os
+from tempfile import TemporaryDirectory
+
+from django.test import TestCase, override_settings
+
+from pulpcore.app.compression import compress_file
+from pulpcore.app.models import Publication, PublishedMetadata, Repository, RepositoryVersion
+
+
+class PublishedMetadataTestCase(TestCase):
+
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        settings = override_settings(MEDIA_ROOT=self.dir.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        repository = Repository.objects.create(name='test')
+        version = RepositoryVersion.objects.create(repository=repository, number=0)
+        self.publication = Publication.objects.create(repository_version=version)
+
+    def create_metadata(self):
+        path = os.path.join(self.dir.name, 'repomd.xml')
+        with open(path, 'wb') as f:
+            f.write(b'<repomd>' * 1000)
+        compress_file(path, ['gzip'])
+        PublishedMetadata.objects.create(
+            relative_path='repomd.xml', publication=self.publication, file='repomd.xml'
+        )
+        return path
+
+    def test_delete(self):
+        """The file and its compressed variants are deleted with the published metadata."""
+        path = self.create_metadata()
+        PublishedMetadata.objects.get(publication=self.publication).delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(path + '.gz'))
+
+    def test_delete_publication(self):
+        """The files of the published metadata are deleted with the publication."""
+        path = self.create_metadata()
+        self.publication.delete()
+        self.assertFalse(PublishedMetadata.objects.exists())
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(path + '.gz'))
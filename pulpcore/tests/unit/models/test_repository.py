@@ -0,0 +1,167 @@
+from unittest.mock import patch
+
+from django.db import NotSupportedError, connection
+from django.db.models import QuerySet
+from django.test import TestCase
+
+from pulpcore.app.models import (
+    Content,
+    Repository,
+    RepositoryContent,
+    RepositoryVersion,
+    RepositoryVersionContentDetails,
+)
+
+
+class RepositoryVersionTestCase(TestCase):
+
+    def setUp(self):
+        self.repository = Repository.objects.create(name='test')
+        self.contents = [Content.objects.create() for _ in range(4)]
+
+    def create_version(self, number):
+        self.repository.last_version = number
+        self.repository.save()
+        return RepositoryVersion.objects.create(repository=self.repository, number=number)
+
+    def content(self, *indexes):
+        return Content.objects.filter(pk__in=[self.contents[i].pk for i in indexes])
+
+    def test_add_content(self):
+        """Only content that is not in the version yet is added."""
+        version = self.create_version(1)
+        self.assertEqual(version.add_content(self.content(0, 1)), 2)
+        self.assertEqual(version.add_content(self.content(0, 1, 2)), 1)
+        self.assertEqual(version.add_content(self.content(0, 1, 2)), 0)
+        self.assertEqual(set(version.content), set(self.contents[:3]))
+
+    def test_add_content_in_batches(self):
+        """All content is added when it takes several batches."""
+        version = self.create_version(1)
+        version.ADD_CONTENT_BATCH_SIZE = 1
+        version.add_content(self.content(0))
+        # PostgreSQL inserts all content at once, the batches are used by the other databases.
+        with patch.object(connection, 'vendor', 'sqlite'), \
+                patch.object(RepositoryContent.objects, 'bulk_create',
+                             wraps=RepositoryContent.objects.bulk_create) as bulk_create:
+            self.assertEqual(version.add_content(Content.objects.all()), 3)
+        self.assertEqual(bulk_create.call_count, 3)
+        self.assertEqual(version.content.count(), 4)
+
+    def test_add_content_removed(self):
+        """Content removed from the repository can be added back."""
+        first = self.create_version(1)
+        first.add_content(self.content(0, 1))
+        first.complete = True
+        first.save()
+
+        second = self.create_version(2)
+        second.remove_content(self.content(0))
+        self.assertEqual(second.add_content(self.content(0, 1)), 1)
+        self.assertEqual(set(second.content), set(self.contents[:2]))
+        self.assertEqual(set(first.content), set(self.contents[:2]))
+
+    def test_version_numbers(self):
+        """The version numbers of the relations follow their versions when a version is deleted."""
+        versions = []
+        for number, (added, removed) in enumerate([((0, 1), ()), ((2,), (0,)), ((3,), (1,))], 1):
+            version = self.create_version(number)
+            version.add_content(self.content(*added))
+            version.remove_content(self.content(*removed))
+            version.complete = True
+            version.save()
+            versions.append(version)
+
+        versions[1].delete()
+        relations = RepositoryContent.objects.filter(repository=self.repository)
+        self.assertEqual(
+            set(relations.values_list('content', 'number_added', 'number_removed')),
+            {(self.contents[0].pk, 1, 3), (self.contents[1].pk, 1, 3),
+             (self.contents[2].pk, 3, None), (self.contents[3].pk, 3, None)}
+        )
+        self.assertEqual(set(versions[0].content), set(self.contents[:2]))
+        self.assertEqual(set(versions[2].content), set(self.contents[2:]))
+
+    def test_compute_counts(self):
+        """Counts computed from the previous version match counts over the whole version."""
+        for number, (added, removed) in enumerate([((0, 1, 2), ()), ((3,), (0, 1))], 1):
+            version = self.create_version(number)
+            version.add_content(self.content(*added))
+            version.remove_content(self.content(*removed))
+            version.complete = True
+            version.save()
+            version.compute_counts()
+            counts = set(version.counts.values_list('count_type', 'content_type', 'count'))
+            version.compute_counts(full=True)
+            self.assertEqual(
+                set(version.counts.values_list('count_type', 'content_type', 'count')), counts
+            )
+
+        content_type = self.contents[0]._type
+        self.assertEqual(counts, {(RepositoryVersionContentDetails.ADDED, content_type, 1),
+                                  (RepositoryVersionContentDetails.PRESENT, content_type, 2),
+                                  (RepositoryVersionContentDetails.REMOVED, content_type, 2)})
+
+    def test_diff(self):
+        """The content in only one of two versions is listed, across repositories too."""
+        first = self.create_version(1)
+        first.add_content(self.content(0, 1))
+        first.complete = True
+        first.save()
+        second = self.create_version(2)
+        second.remove_content(self.content(0))
+        second.add_content(self.content(1, 2))
+
+        other = RepositoryVersion.objects.create(
+            repository=Repository.objects.create(name='other'), number=1
+        )
+        other.add_content(self.content(1, 3))
+
+        def diff(version, base_version):
+            return {(row['content_id'], row['in_version'], row['in_base'])
+                    for row in version.diff(base_version)}
+
+        self.assertEqual(diff(second, first), {(self.contents[0].pk, 0, 1),
+                                               (self.contents[2].pk, 1, 0)})
+        self.assertEqual(diff(first, first), set())
+        self.assertEqual(diff(second, other), {(self.contents[2].pk, 1, 0),
+                                               (self.contents[3].pk, 0, 1)})
+
+    def test_copy_content(self):
+        """The content of a version is replaced by the content of the base version."""
+        self.assert_content_copied()
+
+    def test_copy_content_without_difference(self):
+        """The content is replaced on databases without EXCEPT, e.g. MySQL."""
+        with patch.object(connection.features, 'supports_select_difference', False), \
+                patch.object(QuerySet, 'difference', side_effect=NotSupportedError):
+            self.assert_content_copied()
+
+    def assert_content_copied(self):
+        first = self.create_version(1)
+        first.add_content(self.content(0, 1))
+        first.complete = True
+        first.save()
+
+        base_version = RepositoryVersion.objects.create(
+            repository=Repository.objects.create(name='base'), number=1
+        )
+        base_version.add_content(self.content(1, 2, 3))
+
+        second = self.create_version(2)
+        second._copy_content(base_version)
+        self.assertEqual(set(second.content), set(self.contents[1:]))
+        self.assertEqual(set(second.removed()), {self.contents[0]})
+        self.assertEqual(set(second.added()), set(self.contents[2:]))
+
+    def test_copy_content_to_first_version(self):
+        """The content of the base version is copied to an empty version."""
+        base_version = RepositoryVersion.objects.create(
+            repository=Repository.objects.create(name='base'), number=1
+        )
+        base_version.add_content(self.content(0, 1))
+
+        version = self.create_version(1)
+        version._copy_content(base_version)
+        self.assertEqual(set(version.content), set(self.contents[:2]))
+        self.assertEqual(set(version.added()), set(self.contents[:2]))
@@ -0,0 +1,66 @@
+import gzip
+import os
+from tempfile import TemporaryDirectory
+
+from django.test import SimpleTestCase
+
+from pulpcore.app.compression import compress_file, delete_variants, negotiate_encoding
+
+
+class CompressFileTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'repomd.xml')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, data):
+        with open(self.path, 'wb') as f:
+            f.write(data)
+
+    def test_gzip(self):
+        """A gzip compressed variant is stored next to the file."""
+        data = b'<repomd>' * 1000
+        self.write(data)
+        self.assertEqual(compress_file(self.path, ['gzip']), [self.path + '.gz'])
+        with gzip.open(self.path + '.gz') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_small(self):
+        """Small files are not compressed."""
+        self.write(b'<repomd/>')
+        self.assertEqual(compress_file(self.path, ['gzip']), [])
+
+    def test_compressed(self):
+        """Files that are compressed already are not compressed again."""
+        for name in ('primary.xml.gz', 'filelists.xml.XZ', 'other.xml.zst', 'files.zip'):
+            self.path = os.path.join(self.dir.name, name)
+            self.write(os.urandom(4096))
+            self.assertEqual(compress_file(self.path, ['gzip']), [])
+            self.assertFalse(os.path.exists(self.path + '.gz'))
+
+    def test_delete_variants(self):
+        """The compressed variants are deleted, the file is kept."""
+        self.write(b'<repomd>' * 1000)
+        compress_file(self.path, ['gzip'])
+        delete_variants(self.path)
+        self.assertFalse(os.path.exists(self.path + '.gz'))
+        self.assertTrue(os.path.exists(self.path))
+        delete_variants(self.path)
+
+
+class NegotiateEncodingTestCase(SimpleTestCase):
+
+    def test_accepted(self):
+        """The preferred encoding accepted by the client is chosen."""
+        self.assertEqual(negotiate_encoding('gzip, deflate', ['gzip']), 'gzip')
+        self.assertEqual(negotiate_encoding('gzip, zstd', ['gzip', 'zstd']), 'zstd')
+        self.assertEqual(negotiate_encoding('gzip, zstd;q=0.5', ['gzip', 'zstd']), 'gzip')
+
+    def test_not_accepted(self):
+        """The file is sent as is when no variant is accepted."""
+        self.assertIsNone(negotiate_encoding(None, ['gzip']))
+        self.assertIsNone(negotiate_encoding('gzip;q=0', ['gzip']))
+        self.assertIsNone(negotiate_encoding('br', ['gzip']))
@@ -36,7 +36,8 @@ setup(
     install_requires=requirements,
     extras_require={
         'postgres': ['psycopg2-binary'],
-        'mysql': ['mysqlclient']
+        'mysql': ['mysqlclient'],
+        'zstd': ['zstandard'],
     },
     include_package_data=True,
     classifiers=(